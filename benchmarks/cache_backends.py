@@ -0,0 +1,100 @@
+"""Benchmark of the file and SQLite cache backends on Nominatim responses.
+
+Writes, then reads, n Nominatim-like responses through nominatim_request's
+serialisation, with the in-memory layer disabled, and reports the
+throughput and disk footprint of each backend.
+
+    python benchmarks/cache_backends.py --n 100000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Literal, Tuple
+
+from cartes.osm.requests import (
+    _dumps_json,
+    _hash_request,
+    _loads_json,
+    _read_json,
+    _write_json,
+)
+from cartes.utils.cache import CacheResults
+
+URL = "https://nominatim.openstreetmap.org/search"
+
+BackendType = Literal["file", "sqlite"]
+
+
+def response(i: int) -> List[dict]:
+    return [
+        dict(
+            place_id=i,
+            osm_type="relation",
+            osm_id=35738 + i,
+            lat="43.6044622",
+            lon="1.4442469",
+            display_name=f"Place {i}, Haute-Garonne, Occitanie, France",
+            boundingbox=["43.532", "43.668", "1.350", "1.515"],
+            importance=0.7,
+        )
+    ]
+
+
+def disk_usage(directory: Path) -> Tuple[int, int]:
+    """Number of files and bytes allocated on disk."""
+    files = nbytes = 0
+    for dirpath, _dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            files += 1
+            nbytes += (Path(dirpath) / filename).stat().st_blocks * 512
+    return files, nbytes
+
+
+def benchmark(backend: BackendType, n: int, root: Path) -> None:
+    @CacheResults(
+        cache_dir=root / backend,
+        hashing=_hash_request,
+        reader=_read_json,
+        writer=_write_json,
+        dumps=_dumps_json,
+        loads=_loads_json,
+        maxsize=0,
+        backend=backend,
+    )
+    def request(url: str, **kwargs) -> List[dict]:
+        raise RuntimeError("all requests are cached")
+
+    params = [dict(q=f"place {i}", format="json") for i in range(n)]
+
+    start = time.perf_counter()
+    for i, param in enumerate(params):
+        request.put(response(i), URL, params=param)
+    write = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for param in params:
+        assert request(URL, params=param) is not None
+    read = time.perf_counter() - start
+
+    files, nbytes = disk_usage(root / backend)
+    print(
+        f"{backend:>6}: {n / write:6.0f} writes/s, {n / read:6.0f} reads/s, "
+        f"{files} files, {nbytes / 2**20:.0f} MB on disk"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n", type=int, default=100_000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as root:
+        backends: List[BackendType] = ["file", "sqlite"]
+        for backend in backends:
+            benchmark(backend, args.n, Path(root))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Benchmark of the parsing of Overpass responses into a GeoDataFrame.
+
+For the largest responses of a cache directory (the test responses by
+default), compares Overpass.parse_elements, which gathers elements column
+by column and builds all way geometries at once, with the former path,
+which builds one record per element with to_geometry. Relations are left
+aside: both paths assemble them one by one.
+
+    python benchmarks/parse.py --n 3 tests/cache
+"""
+
+import argparse
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import geopandas as gpd
+
+import numpy as np
+import shapely
+from cartes.osm.overpass import Overpass
+from cartes.osm.overpass.core import to_geometry
+from cartes.osm.requests import _read_json
+
+
+def timeit(function: Callable[[], object], repeat: int = 5) -> float:
+    """Best time of a few runs, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best
+
+
+def per_element(elements: List[Dict[str, Any]]) -> gpd.GeoDataFrame:
+    """The former parser: one record, and one geometry, per element."""
+    return gpd.GeoDataFrame.from_records(
+        list(
+            dict(
+                id_=elt["id"],
+                type_=elt["type"],
+                latitude=elt.get("lat", np.nan),
+                longitude=elt.get("lon", np.nan),
+                geometry=to_geometry(elt) if "geometry" in elt else None,
+                **elt.get("tags", dict()),
+            )
+            for elt in elements
+        )
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("cache_dir", type=Path, nargs="?")
+    parser.add_argument("--n", type=int, default=3)
+    args = parser.parse_args()
+    cache_dir = args.cache_dir or Path(__file__).parents[1] / "tests" / "cache"
+
+    responses = sorted(
+        cache_dir.glob("**/*.json"), key=lambda path: -path.stat().st_size
+    )[: args.n]
+
+    for path in responses:
+        json_ = _read_json(path)
+        if json_ is None:  # e.g. a partial download
+            continue
+        elements = [
+            elt
+            for elt in json_.get("elements", [])
+            if elt["type"] != "relation" and elt.get("tags", None)
+        ]
+        overpass = Overpass(dict(json_, elements=elements))
+        vectorized = overpass.parse_elements(elements)
+        former = per_element(elements)
+        # both parsers build the same geometries
+        assert shapely.equals(
+            np.array(vectorized.geometry.array, dtype=object),
+            np.array(former.geometry.array, dtype=object),
+        )[~former.geometry.isna().to_numpy()].all()
+
+        print(
+            f"{path.name}: {len(elements)} nodes and ways\n"
+            f"  per element:    "
+            f"{timeit(lambda: per_element(elements)):.0f} ms\n"
+            f"  parse_elements: "
+            f"{timeit(lambda: overpass.parse_elements(elements)):.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark of the compressed cache of raw Overpass responses.
+
+For the largest responses of a cache directory (the test responses by
+default, stored in the former plain JSON format), reports the disk footprint
+before and after compression, the time to read and parse each version, and
+the time to parse the body in one pass, chunk by chunk, with ElementStream
+(as json_stream does), rather than with json.loads once it is downloaded.
+
+    python benchmarks/response_cache.py --n 3 tests/cache
+"""
+
+import argparse
+import gzip
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from cartes.osm.requests import (
+    COMPRESSLEVEL,
+    ElementStream,
+    _read_json,
+)
+
+
+def timeit(function: Callable[[], object], repeat: int = 5) -> float:
+    """Best time of a few runs, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("cache_dir", type=Path, nargs="?")
+    parser.add_argument("--n", type=int, default=3)
+    args = parser.parse_args()
+    cache_dir = args.cache_dir or Path(__file__).parents[1] / "tests" / "cache"
+
+    responses = sorted(
+        cache_dir.glob("**/*.json"), key=lambda path: -path.stat().st_size
+    )[: args.n]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for plain in responses:
+            content = plain.read_bytes()
+            if content[:2] == b"\x1f\x8b":  # already compressed
+                content = gzip.decompress(content)
+                plain = Path(tmp) / f"{plain.stem}.plain.json"
+                plain.write_bytes(content)
+            compressed = Path(tmp) / plain.name
+            compress = timeit(
+                lambda: compressed.write_bytes(
+                    gzip.compress(content, compresslevel=COMPRESSLEVEL)
+                )
+            )
+
+            def stream(chunk_size: int = 1 << 16) -> None:
+                chunks = (
+                    content[i : i + chunk_size]
+                    for i in range(0, len(content), chunk_size)
+                )
+                list(ElementStream(chunks))
+
+            print(
+                f"{plain.name}:\n"
+                f"  disk:   {plain.stat().st_size / 2**20:.2f} MB -> "
+                f"{compressed.stat().st_size / 2**20:.2f} MB\n"
+                f"  read:   {timeit(lambda: _read_json(plain)):.0f} ms -> "
+                f"{timeit(lambda: _read_json(compressed)):.0f} ms "
+                f"(compression: {compress:.0f} ms)\n"
+                f"  parse:  {timeit(lambda: json.loads(content)):.0f} ms "
+                f"(json.loads), {timeit(stream):.0f} ms (ElementStream)"
+            )
+
+
+if __name__ == "__main__":
+    main()
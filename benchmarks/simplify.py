@@ -0,0 +1,58 @@
+"""Benchmark of the simplification of all geometries of Overpass results.
+
+Compares Overpass.simplify, which projects and simplifies all plain
+geometries at once and only simplifies relations which re-assemble their
+geometry (e.g. boundaries) one by one, with the simplification of every
+element one by one, on a large landuse query (cached after the first run).
+
+    python benchmarks/simplify.py --resolution 10
+"""
+
+import argparse
+import time
+from typing import Callable
+
+from cartes.osm import Overpass
+
+QUERY = """[out:json][timeout:180];
+area[name="Toulouse"][admin_level=8];
+nwr(area)[landuse];
+out geom;"""
+
+
+def timeit(function: Callable[[], object], repeat: int = 3) -> float:
+    """Best time of a few runs, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--query", default=QUERY)
+    parser.add_argument("--resolution", type=float, default=10)
+    args = parser.parse_args()
+
+    overpass = Overpass.request(query=args.query)
+    bounds = overpass.bounds
+
+    def per_element() -> None:
+        for elt in overpass:
+            elt.simplify(args.resolution, bounds=bounds)
+
+    def vectorized() -> None:
+        overpass.simplify(args.resolution, max_workers=1)
+
+    print(
+        f"{overpass.data.shape[0]} elements "
+        f"({(overpass.data.type_ == 'relation').sum()} relations)\n"
+        f"  per element: {timeit(per_element):.0f} ms\n"
+        f"  simplify:    {timeit(vectorized):.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import datetime
+from typing import List, Optional
+
+from .utils.cache_manager import cache_manager
+
+
+def _human(nbytes: float) -> str:
+    for unit in ["B", "kB", "MB", "GB"]:
+        if nbytes < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+
+def serve(args: argparse.Namespace) -> None:
+    from .tiles.fastapi import main
+
+    main()
+
+
+def cache_stats(args: argparse.Namespace) -> None:
+    stats = cache_manager.stats()
+    print(f"Cache directory: {cache_manager.root}")
+    for namespace, (files, nbytes, oldest) in sorted(stats.items()):
+        line = f"{namespace:<12} {files:>8} files {_human(nbytes):>10}"
+        if oldest is not None:
+            when = datetime.datetime.fromtimestamp(
+                oldest, datetime.timezone.utc
+            )
+            line += f"  oldest access: {when:%Y-%m-%d %H:%M}"
+        ttl = cache_manager.ttl.get(namespace, None)
+        if ttl is not None:
+            line += f"  ttl: {ttl:.0f} s"
+        print(line)
+    files = sum(elt.files for elt in stats.values())
+    nbytes = sum(elt.nbytes for elt in stats.values())
+    print(f"{'total':<12} {files:>8} files {_human(nbytes):>10}")
+
+
+def cache_prune(args: argparse.Namespace) -> None:
+    removed = cache_manager.prune(
+        max_size=args.max_size, namespace=args.namespace
+    )
+    print(f"Removed {len(removed)} files")
+
+
+def cache_migrate(args: argparse.Namespace) -> None:
+    from .osm.requests import migrate_nominatim
+
+    count = migrate_nominatim()
+    print(f"Moved {count} Nominatim responses")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    # Register the directory of Overpass requests if set with CARTES_CACHE
+    from .osm import requests  # noqa: F401
+
+    parser = argparse.ArgumentParser(prog="cartes")
+    subparsers = parser.add_subparsers()
+
+    parser_serve = subparsers.add_parser("serve", help="serve map tiles")
+    parser_serve.set_defaults(func=serve)
+
+    parser_cache = subparsers.add_parser("cache", help="manage the cache")
+    cache_subparsers = parser_cache.add_subparsers(required=True)
+    parser_stats = cache_subparsers.add_parser(
+        "stats", help="size of the cache, by namespace"
+    )
+    parser_stats.set_defaults(func=cache_stats)
+    parser_prune = cache_subparsers.add_parser(
+        "prune", help="remove expired and least recently used files"
+    )
+    parser_prune.add_argument(
+        "--max-size", type=int, default=None, help="maximum size in bytes"
+    )
+    parser_prune.add_argument(
+        "--namespace", default=None, help="e.g. osm, atlas or tiles"
+    )
+    parser_prune.set_defaults(func=cache_prune)
+    parser_migrate = cache_subparsers.add_parser(
+        "migrate", help="move files cached by former versions"
+    )
+    parser_migrate.set_defaults(func=cache_migrate)
+
+    args = parser.parse_args(argv)
+    # serving tiles remains the default behaviour
+    getattr(args, "func", serve)(args)
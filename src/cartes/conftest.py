@@ -1,7 +1,7 @@
 import logging
 from pathlib import Path
 
-from cartes.osm.requests import json_request
+from cartes.osm.requests import json_request, nominatim_request
 
 
 def pytest_configure(config):
@@ -9,4 +9,5 @@ def pytest_configure(config):
     _log.setLevel(logging.INFO)
 
     json_request.cache_dir = Path(config.rootdir) / "tests" / "cache"
+    nominatim_request.cache_dir = json_request.cache_dir
     _log.warning(f"Using cache_dir {json_request.cache_dir} for tests")
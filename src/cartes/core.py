@@ -3,13 +3,13 @@ from __future__ import annotations
 from abc import ABC, abstractmethod
 from typing import TYPE_CHECKING, Any, Iterator, Tuple
 
-from cartopy.crs import Orthographic
-
 import pandas as pd
-from pyproj import Proj, Transformer
 from shapely.geometry import base, shape
 from shapely.ops import transform
 
+from .utils.geodesic import geodesic_area, geodesic_length
+from .utils.projections import transformer_cache
+
 if TYPE_CHECKING:
     from ipyleaflet import Map, Marker, Polygon, Polyline
 
@@ -35,33 +35,29 @@ class GeoObject(ABC):
     def ortho_shape(self):
         shape_ = shape(self)
         lon, lat = shape_.centroid.coords[0]
-        proj = Orthographic(lon, lat)
-        transformer = Transformer.from_proj(
-            Proj("EPSG:4326"), Proj(proj.proj4_init), always_xy=True
-        )
-        return transform(transformer.transform, shape_)
+        forward = transformer_cache.orthographic(lon, lat).forward
+        return transform(forward.transform, shape_)
 
     @property
     def equivalent_shape(self):
         shape_ = shape(self)
-        bounds = self.bounds
-        proj = Proj(
-            proj="aea",  # equivalent projection
-            lat_1=bounds[1],
-            lat_2=bounds[3],
-            lat_0=(bounds[1] + bounds[3]) / 2,
-            lon_0=(bounds[0] + bounds[2]) / 2,
-        )
-
-        transformer = Transformer.from_proj(
-            Proj("EPSG:4326"), proj, always_xy=True
-        )
-        return transform(transformer.transform, shape_)
+        forward = transformer_cache.equal_area(self.bounds).forward
+        return transform(forward.transform, shape_)
 
     @property
     def area(self) -> float:
         return self.equivalent_shape.area
 
+    @property
+    def geodesic_area(self) -> float:
+        """Area on the WGS84 ellipsoid, in square meters."""
+        return float(geodesic_area(self.shape)[0])
+
+    @property
+    def geodesic_length(self) -> float:
+        """Length (or perimeter) on the WGS84 ellipsoid, in meters."""
+        return float(geodesic_length(self.shape)[0])
+
     @property
     def bounds(self) -> Tuple[float, float, float, float]:
         return self.shape.bounds
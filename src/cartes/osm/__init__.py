@@ -1,4 +1,5 @@
+from .endpoints import Endpoint, EndpointPool
 from .nominatim import Nominatim
 from .overpass import Overpass, relations  # noqa: F401
 
-__all__ = ["Nominatim", "Overpass"]
+__all__ = ["Endpoint", "EndpointPool", "Nominatim", "Overpass"]
@@ -0,0 +1,359 @@
+"""Pools of equivalent endpoints, e.g. Overpass mirrors.
+
+Each endpoint has its own connection pools (one for threads, one for each
+event loop) and a limit of concurrent requests. Requests go to the least
+loaded (or next, in round-robin order) available endpoint, and fail over to
+the other ones on 429 (too many requests), 504 (gateway timeout) and
+connection errors.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import (
+    AsyncExitStack,
+    ExitStack,
+    asynccontextmanager,
+    contextmanager,
+)
+from typing import (
+    AsyncIterator,
+    ClassVar,
+    FrozenSet,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+import httpx
+
+_log = logging.getLogger(__name__)
+
+
+class Endpoint:
+    """An endpoint, with its own connection pool.
+
+    - concurrency is the maximum number of concurrent requests, and of
+      connections of the client (and of the asynchronous clients);
+    - after a failure, the endpoint is put aside for cooldown seconds,
+      doubled after each consecutive failure (up to max_cooldown).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        concurrency: int = 2,
+        cooldown: float = 30,
+        max_cooldown: float = 600,
+        client: Optional[httpx.Client] = None,
+    ) -> None:
+        self.url = url
+        self.concurrency = concurrency
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.client = (
+            client
+            if client is not None
+            else httpx.Client(
+                follow_redirects=True,
+                http2=True,
+                limits=httpx.Limits(max_connections=concurrency),
+            )
+        )
+        # connections of asynchronous clients belong to their event loop
+        self.async_clients: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, httpx.AsyncClient
+        ] = weakref.WeakKeyDictionary()
+        self.active = 0
+        self.requests = 0
+        self.failures = 0
+        self.available_at = 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"Endpoint({self.url!r}, active={self.active}/{self.concurrency}, "
+            f"failures={self.failures})"
+        )
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """The asynchronous client of the running event loop.
+
+        It is created on first use, with the same limits as the client.
+        """
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop, None)
+        if client is None:
+            client = httpx.AsyncClient(
+                follow_redirects=True,
+                http2=True,
+                limits=httpx.Limits(max_connections=self.concurrency),
+            )
+            self.async_clients[loop] = client
+        return client
+
+    async def aclose(self) -> None:
+        """Closes the asynchronous client of the running event loop."""
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+    @property
+    def load(self) -> float:
+        return self.active / self.concurrency
+
+    def available(self, now: float) -> bool:
+        return self.available_at <= now
+
+    def failed(self) -> None:
+        self.failures += 1
+        delay = min(self.cooldown * 2 ** (self.failures - 1), self.max_cooldown)
+        self.available_at = time.monotonic() + delay
+        _log.warning(f"Putting {self.url} aside for {delay:.0f} seconds")
+
+    def succeeded(self) -> None:
+        self.failures = 0
+        self.available_at = 0.0
+
+
+class EndpointPool:
+    """A pool of equivalent endpoints, with failover.
+
+    Endpoints may be given as URLs or Endpoint instances. The selection
+    strategy is either "least_loaded" (the default) or "round_robin".
+    Endpoints put aside after a failure are only selected again when their
+    cooldown is over, or when the other endpoints left to try are busy.
+
+    Use the pool in place of a URL in `json_request` or `json_stream`, or
+    set it as the `Overpass.endpoint`.
+    """
+
+    failover_status: ClassVar[FrozenSet[int]] = frozenset({429, 504})
+
+    def __init__(
+        self,
+        endpoints: Sequence[Union[str, Endpoint]],
+        strategy: Literal["least_loaded", "round_robin"] = "least_loaded",
+    ) -> None:
+        if len(endpoints) == 0:
+            raise ValueError("At least one endpoint is needed")
+        if strategy not in ["least_loaded", "round_robin"]:
+            raise ValueError(f"Unknown strategy {strategy}")
+        self.endpoints: List[Endpoint] = [
+            elt if isinstance(elt, Endpoint) else Endpoint(elt)
+            for elt in endpoints
+        ]
+        self.strategy = strategy
+        self.condition = threading.Condition()
+        # coroutines waiting for a free slot, woken up from any thread
+        self.waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]
+        self.waiters = list()
+        self.counter = itertools.count()
+
+    @classmethod
+    def from_env(cls, name: str) -> Optional["EndpointPool"]:
+        """Builds a pool from a comma-separated list of URLs, if set."""
+        value = os.environ.get(name, "")
+        urls = [url.strip() for url in value.split(",") if url.strip()]
+        return cls(urls) if len(urls) > 0 else None
+
+    def __repr__(self) -> str:
+        endpoints = ", ".join(repr(endpoint) for endpoint in self.endpoints)
+        return f"EndpointPool([{endpoints}], strategy={self.strategy!r})"
+
+    def select(self, tried: Set[Endpoint]) -> Optional[Endpoint]:
+        """Selects an endpoint not tried yet, with free capacity.
+
+        Endpoints out of cooldown come first; otherwise, the free endpoint
+        whose cooldown ends first is better than waiting. Returns None if
+        all endpoints left to try are busy. Must be called with the
+        condition held.
+        """
+        free = [
+            elt
+            for elt in self.endpoints
+            if elt not in tried and elt.active < elt.concurrency
+        ]
+        if len(free) == 0:
+            return None
+        now = time.monotonic()
+        available = [elt for elt in free if elt.available(now)]
+        if len(available) == 0:
+            return min(free, key=lambda elt: elt.available_at)
+        if self.strategy == "round_robin":
+            return available[next(self.counter) % len(available)]
+        return min(available, key=lambda elt: elt.load)
+
+    def timeout(self, tried: Set[Endpoint]) -> Optional[float]:
+        """Seconds until the next endpoint left to try is out of cooldown.
+
+        Waiting for a free slot is also bounded by this delay, so that the
+        selection is reconsidered. Must be called with the condition held.
+        """
+        now = time.monotonic()
+        delays = [
+            elt.available_at - now
+            for elt in self.endpoints
+            if elt not in tried and not elt.available(now)
+        ]
+        return min(delays) if len(delays) > 0 else None
+
+    def claim(self, endpoint: Endpoint) -> None:
+        endpoint.active += 1
+        endpoint.requests += 1
+
+    def release(self, endpoint: Endpoint) -> None:
+        with self.condition:
+            endpoint.active -= 1
+            self.condition.notify_all()
+            waiters, self.waiters = self.waiters, list()
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # the event loop is closed
+                pass
+
+    async def aclose(self) -> None:
+        """Closes the asynchronous clients of the running event loop."""
+        for endpoint in self.endpoints:
+            await endpoint.aclose()
+
+    def outcome(
+        self, endpoint: Endpoint, status_code: Optional[int], last: bool
+    ) -> bool:
+        """Records the outcome of a request to an endpoint.
+
+        status_code is None after a connection error. Returns True if the
+        request should fail over to another endpoint.
+        """
+        with self.condition:
+            if (
+                status_code is not None
+                and status_code not in self.failover_status
+            ):
+                endpoint.succeeded()
+                return False
+            endpoint.failed()
+        if status_code is not None:
+            _log.warning(f"Got status code {status_code} from {endpoint.url}")
+        return not last
+
+    @contextmanager
+    def acquire(self, tried: Set[Endpoint]) -> Iterator[Endpoint]:
+        """Waits for an endpoint, not tried yet, with free capacity."""
+        with self.condition:
+            endpoint = self.select(tried)
+            while endpoint is None:
+                self.condition.wait(self.timeout(tried))
+                endpoint = self.select(tried)
+            self.claim(endpoint)
+        try:
+            yield endpoint
+        finally:
+            self.release(endpoint)
+
+    @asynccontextmanager
+    async def async_acquire(
+        self, tried: Set[Endpoint]
+    ) -> AsyncIterator[Endpoint]:
+        """Asynchronous counterpart of acquire.
+
+        Slots are shared with threads using the pool: waiting coroutines are
+        woken up by an event, set when a slot is released in any thread, so
+        that the event loop is never blocked.
+        """
+        while True:
+            with self.condition:
+                endpoint = self.select(tried)
+                if endpoint is not None:
+                    self.claim(endpoint)
+                    break
+                waiter = asyncio.get_running_loop(), asyncio.Event()
+                self.waiters.append(waiter)
+                timeout = self.timeout(tried)
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                with self.condition:
+                    if waiter in self.waiters:
+                        self.waiters.remove(waiter)
+        try:
+            yield endpoint
+        finally:
+            self.release(endpoint)
+
+    @contextmanager
+    def stream(self, method: str, **kwargs) -> Iterator[httpx.Response]:
+        """Streams a response from the first endpoint that does not fail.
+
+        If all endpoints fail, the last failed response is returned (or the
+        last connection error is raised), so that the caller may decide
+        whether to try again later.
+        """
+        tried: Set[Endpoint] = set()
+        while True:
+            with ExitStack() as stack:
+                endpoint = stack.enter_context(self.acquire(tried))
+                tried.add(endpoint)
+                last = len(tried) == len(self.endpoints)
+                try:
+                    response = stack.enter_context(
+                        endpoint.client.stream(
+                            method=method, url=endpoint.url, **kwargs
+                        )
+                    )
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    _log.warning(f"Could not connect to {endpoint.url}: {e}")
+                    if self.outcome(endpoint, None, last):
+                        continue
+                    raise
+                if self.outcome(endpoint, response.status_code, last):
+                    continue
+                yield response
+                return
+
+    @asynccontextmanager
+    async def async_stream(
+        self, method: str, **kwargs
+    ) -> AsyncIterator[httpx.Response]:
+        """Asynchronous counterpart of stream.
+
+        Requests go through the asynchronous client of each endpoint (see
+        `Endpoint.async_client`), so that its connection limits apply. Close
+        the clients with `aclose` before the event loop ends.
+        """
+        tried: Set[Endpoint] = set()
+        while True:
+            async with AsyncExitStack() as stack:
+                endpoint = await stack.enter_async_context(
+                    self.async_acquire(tried)
+                )
+                tried.add(endpoint)
+                last = len(tried) == len(self.endpoints)
+                try:
+                    response = await stack.enter_async_context(
+                        endpoint.async_client.stream(
+                            method=method, url=endpoint.url, **kwargs
+                        )
+                    )
+                except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                    _log.warning(f"Could not connect to {endpoint.url}: {e}")
+                    if self.outcome(endpoint, None, last):
+                        continue
+                    raise
+                if self.outcome(endpoint, response.status_code, last):
+                    continue
+                yield response
+                return
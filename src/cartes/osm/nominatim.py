@@ -5,7 +5,7 @@ from shapely.geometry import mapping, shape
 from ..core import GeoObject
 from ..utils.descriptors import OrientedShape
 from ..utils.mixins import HBoxMixin, HTMLAttrMixin, HTMLTitleMixin
-from .requests import GeoJSONType, JSONType, json_request
+from .requests import GeoJSONType, JSONType, nominatim_request
 
 T = TypeVar("T", bound="Nominatim")
 
@@ -98,7 +98,7 @@ class Nominatim(GeoObject, HBoxMixin, HTMLTitleMixin, HTMLAttrMixin):
             polygon_geojson=True,
             addressdetails=True,
         )
-        json = json_request(
+        json = nominatim_request(
             cls.endpoint.rstrip("/") + "/" + "search",
             timeout=30,
             params=params,
@@ -126,7 +126,7 @@ class Nominatim(GeoObject, HBoxMixin, HTMLTitleMixin, HTMLAttrMixin):
             format="jsonv2",
             polygon_geojson=True,
         )
-        json = json_request(
+        json = nominatim_request(
             cls.endpoint.rstrip("/") + "/" + "reverse",
             timeout=30,
             params=params,
@@ -154,7 +154,7 @@ class Nominatim(GeoObject, HBoxMixin, HTMLTitleMixin, HTMLAttrMixin):
             format="jsonv2",
             polygon_geojson=True,
         )
-        json = json_request(
+        json = nominatim_request(
             cls.endpoint.rstrip("/") + "/" + "lookup",
             timeout=30,
             params=params,
@@ -1,40 +1,176 @@
 from __future__ import annotations
 
+import asyncio
+import json as jsonlib
 import logging
-from concurrent.futures import Future, ProcessPoolExecutor, as_completed
-from functools import lru_cache
+import re
+from array import array
+from collections import defaultdict
+from collections.abc import Mapping
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
 from operator import itemgetter
 from typing import (
     Any,
-    Callable,
+    Coroutine,
     Dict,
+    Iterable,
     Iterator,
     List,
+    Literal,
     Optional,
+    Sequence,
+    Set,
     Tuple,
     TypedDict,
+    TypeVar,
+    Union,
 )
 
 import geopandas as gpd
+import httpx
 import networkx as nx
 from tqdm import tqdm
 
+import numpy as np
 import pandas as pd
-from pyproj import Proj
+import shapely
+from shapely.geometry import LineString, Point
 from shapely.geometry.base import BaseGeometry
-from shapely.ops import unary_union
 
 from ...crs import PlateCarree  # type: ignore
 from ...dataviz import matplotlib_style
-from ...utils.cache import CacheResults, cached_property
+from ...utils.cache import cached_property
+from ...utils.cache_manager import cache_manager
 from ...utils.descriptors import Descriptor
-from ...utils.geometry import reorient
-from ..requests import JSONType, json_request
-from .core import NodeWayRelation, to_geometry
-from .query import Query
+from ...utils.geodesic import geodesic_area, geodesic_length
+from ...utils.projections import project, transformer_cache
+from ..endpoints import EndpointPool
+from ..ratelimit import rate_limit
+from ..requests import (
+    ElementStream,
+    JSONType,
+    URLType,
+    async_json_request,
+    json_request,
+    json_stream,
+    raw_request,
+)
+from .adiff import adiff_query, parse_adiff
+from .core import (
+    ElementRegistry,
+    NodeWayRelation,
+    Relation,
+    RowView,
+    to_geometries,
+    to_geometry,
+)
+from .index import QueryIndex
+from .parquet import parquet_file, read_parquet, writable, write_parquet
+from .query import (
+    BoundsType,
+    Query,
+    QueryBatch,
+    query_bounds,
+    split_bounds,
+    tile_bounds,
+    with_bounds,
+)
 
 _log = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+SplitType = Union[Literal["auto"], Tuple[int, int]]
+
+query_index = QueryIndex(json_request)
+
+
+def _run(coroutine: Coroutine[Any, Any, T]) -> T:
+    """Runs a coroutine from synchronous code, e.g. scripts or Jupyter.
+
+    If an event loop is already running, the coroutine runs in another
+    thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:  # no event loop running in this thread
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+
+def json_header(json_: JSONType) -> Dict[str, Any]:
+    """The non-element fields of a response, without loading lazy ones."""
+    if isinstance(json_, (LazyJSON, MergedJSON)):
+        return dict(json_.header)
+    return dict(
+        (key, value) for key, value in json_.items() if key != "elements"
+    )
+
+
+def partial(json_: JSONType) -> bool:
+    """True if the response reports an error, i.e. results may be missing."""
+    return "runtime error" in json_header(json_).get("remark", "")
+
+
+def clip(data: pd.DataFrame, extent: BaseGeometry) -> pd.DataFrame:
+    """Keeps elements intersecting extent, and elements with no location."""
+    keep = np.ones(len(data), dtype=bool)
+    located = np.zeros(len(data), dtype=bool)
+    if "geometry" in data.columns:
+        geometry = np.array(data.geometry.array, dtype=object)
+        located = ~shapely.is_missing(geometry) & ~shapely.is_empty(geometry)
+        keep[located] = shapely.intersects(geometry[located], extent)
+    if "latitude" in data.columns:
+        lon = data.longitude.to_numpy(dtype=float)
+        lat = data.latitude.to_numpy(dtype=float)
+        point = ~located & ~np.isnan(lon) & ~np.isnan(lat)
+        keep[point] = shapely.intersects_xy(extent, lon[point], lat[point])
+    return data.loc[keep].reset_index(drop=True)
+
+
+def concat(frames: Iterable[pd.DataFrame]) -> Optional[pd.DataFrame]:
+    """Concatenates data frames, keeping the first row of each element."""
+    frames = [frame for frame in frames if len(frame) > 0]
+    if len(frames) == 0:
+        return None
+    # pd.concat returns a GeoDataFrame if the first frame is one
+    frames.sort(key=lambda frame: "geometry" not in frame.columns)
+    data = pd.concat(frames, ignore_index=True)
+    return data.drop_duplicates(["type_", "id_"], ignore_index=True)
+
+
+UNTAGGED = re.compile(r"\bout\b[^;]*\b(ids|skel)\b")
+
+
+def untagged(query: Optional[str]) -> bool:
+    """True if the query outputs elements with no tags (out ids, out skel).
+
+    Untagged elements are otherwise parts (e.g. nodes of ways) of tagged
+    elements, and are not kept in the data frame.
+    """
+    return query is not None and UNTAGGED.search(query) is not None
+
+
+def _moved(
+    member: JSONType, moved: Dict[Tuple[str, int], JSONType]
+) -> JSONType:
+    """A member of a relation, with the location of its new version."""
+    new = moved.get((member["type"], member["ref"]), None)
+    if new is None:
+        return member
+    member = dict(member)
+    if "geometry" in new:
+        member["geometry"] = new["geometry"]
+    if "lat" in new:
+        member.update(lat=new["lat"], lon=new["lon"])
+    return member
+
 
 class Member(TypedDict):
     ref: int
@@ -42,57 +178,226 @@ class Member(TypedDict):
     geometry: Optional[BaseGeometry]
 
 
-def hashing_id(*args: Dict[str, int], **kwargs: Dict[str, int]) -> int:
-    elt = args[1] if len(args) > 1 else kwargs["elt"]
-    return elt["id"]
+class MemberStore(Mapping):
+    """Lazy store of the members of relations, indexed by relation id.
 
+    Coordinates of all members are kept in one flat array. Member geometries
+    are only built when a relation asks for them, and memoized by type and
+    ref, so that members shared by several relations are built once.
+    """
 
-cache_by_id = CacheResults(
-    cache_dir=".",
-    hashing=hashing_id,
-    # no storing in files
-    writer=lambda _a, _b: None,
-    reader=lambda _: dict(unused=True),
-)
+    def __init__(self, elements: Iterable[JSONType] = ()) -> None:
+        # type, ref, role, first point and number of points of each member
+        self.members: Dict[int, List[Tuple[str, int, str, int, int]]] = dict()
+        self.coords = array("d")
+        self.geometries: Dict[Tuple[str, int], Optional[BaseGeometry]] = dict()
+        for elt in elements:
+            if elt["type"] == "relation":
+                self.add(elt)
+
+    def add(self, elt: JSONType) -> None:
+        entries = list()
+        for entry in elt.get("members", []):
+            if entry["type"] == "relation":
+                continue  # TODO subrelations not supported
+            start = len(self.coords) // 2
+            if entry.get("geometry", None):
+                for point in entry["geometry"]:
+                    self.coords.append(point["lon"])
+                    self.coords.append(point["lat"])
+            elif "lon" in entry and "lat" in entry:
+                self.coords.append(entry["lon"])
+                self.coords.append(entry["lat"])
+            count = len(self.coords) // 2 - start
+            entries.append(
+                (entry["type"], entry["ref"], entry["role"], start, count)
+            )
+        self.members[elt["id"]] = entries
+
+    def refs(self, id_: int) -> Set[int]:
+        return set(ref for _, ref, *_ in self.members[id_])
+
+    def geometry(
+        self, type_: str, ref: int, start: int, count: int
+    ) -> Optional[BaseGeometry]:
+        key = type_, ref
+        if key not in self.geometries:
+            if count == 0:
+                geometry = None
+            else:
+                coords = np.frombuffer(
+                    self.coords, count=2 * count, offset=16 * start
+                ).reshape(-1, 2)
+                geometry = (
+                    Point(coords[0]) if type_ == "node" else LineString(coords)
+                )
+            self.geometries[key] = geometry
+        return self.geometries[key]
+
+    def __getitem__(self, id_: int) -> List[Member]:
+        return list(
+            Member(
+                ref=ref,
+                role=role,
+                geometry=self.geometry(type_, ref, start, count),
+            )
+            for type_, ref, role, start, count in self.members[id_]
+        )
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.members)
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+
+class LazyJSON(Mapping):
+    """The JSON response of a query, only loaded when elements are needed.
+
+    Non-element fields (version, osm3s, remark, etc.) are available in the
+    header without loading the response. As with Overpass.from_stream, only
+    relations are kept if the response is streamed.
+    """
+
+    def __init__(
+        self, header: Dict[str, Any], query: str, stream: bool = False
+    ) -> None:
+        self.header = header
+        self.query = query
+        self.stream = stream
+        self._json: Optional[JSONType] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._json is not None
+
+    def load(self) -> JSONType:
+        if self._json is None:
+            if self.stream:
+                elements = json_stream(url=Overpass.endpoint, data=self.query)
+                relations = [e for e in elements if e["type"] == "relation"]
+                self._json = dict(elements=relations, **elements.header)
+            else:
+                self._json = json_request(
+                    url=Overpass.endpoint, data=self.query
+                )
+        return self._json
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.header:
+            return self.header[key]
+        return self.load()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.load())
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+
+class MergedJSON(Mapping):
+    """The JSON responses of the tiles of a query, merged when loaded.
+
+    Elements returned for several tiles are only kept once. The header is
+    the one of the first tile.
+    """
+
+    def __init__(self, parts: Sequence[JSONType]) -> None:
+        self.parts = parts
+        self.header = json_header(parts[0]) if len(parts) > 0 else dict()
+        self._json: Optional[JSONType] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._json is not None
+
+    def load(self) -> JSONType:
+        if self._json is None:
+            seen: Set[Tuple[str, int]] = set()
+            elements = list()
+            for part in self.parts:
+                for elt in part["elements"]:
+                    key = elt["type"], elt["id"]
+                    if key not in seen:
+                        seen.add(key)
+                        elements.append(elt)
+            self._json = dict(self.header, elements=elements)
+        return self._json
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.header:
+            return self.header[key]
+        return self.load()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.load())
+
+    def __len__(self) -> int:
+        return len(self.load())
 
 
 class OverpassDataDescriptor(Descriptor[gpd.GeoDataFrame]):
     """Builds the GeoDataFrame on demand.
     Validates it has required fields when replaced.
+
+    Derived columns (latitude and longitude from centroids, oriented
+    polygons) are computed once; the finished frame is cached until the
+    data is replaced. Results of requests are then written to the parsed
+    cache (see Overpass.write_parsed).
     """
 
+    def __set_name__(self, obj, name: str) -> None:
+        super().__set_name__(obj, name)
+        self.cache_name = self.private_name + "_cache"
+
     def __get__(self, obj, cls=None) -> gpd.GeoDataFrame:
+        data = getattr(obj, self.cache_name, None)
+        if data is None:
+            data = self.derive(obj)
+            setattr(obj, self.cache_name, data)
+            if obj._write_pending:
+                obj._write_pending = False
+                obj.write_parsed(obj.query_string, obj)
+        return data
+
+    def derive(self, obj) -> gpd.GeoDataFrame:
         data = getattr(obj, self.private_name)
         if data is None:
             data = obj.parse()
-            for col in ["_parent", "members", "nodes"]:
+            for col in ["members", "nodes"]:
                 if col in data.columns:
                     data = data.drop(columns=col)
             setattr(obj, self.private_name, data)
 
-        if "geometry" in data.columns:
-            data = data.set_geometry("geometry")
+        if "geometry" not in data.columns:
+            return data.dropna(axis=1, how="all")
+
+        data = data.set_geometry("geometry")
+        geometry = np.array(data.geometry.array, dtype=object)
+        centroid = ~shapely.is_missing(geometry) & ~shapely.is_empty(geometry)
         if "latitude" in data.columns:
-            x = data.query("latitude != latitude")
+            centroid &= data.latitude.isna().to_numpy()
         else:
-            x = data.assign(latitude=None, longitude=None)
-
-        if x.shape[0] > 0 and "geometry" in x.columns:
-            x = x.query("geometry.notnull()")
-            x = x.loc[~x.is_empty]
-            if x.shape[0] > 0:
-                data.loc[x.index, ["latitude", "longitude"]] = x.assign(
-                    longitude=lambda df: df.geometry.centroid.x,
-                    latitude=lambda df: df.geometry.centroid.y,
-                )[["latitude", "longitude"]]
-
-        if "geometry" in data.columns:
-            data = data.assign(
-                # TODO This should not be necessary, yet...
-                geometry=lambda df: df.geometry.apply(reorient)
+            data = data.assign(latitude=np.nan, longitude=np.nan)
+
+        if centroid.any():
+            points = shapely.centroid(geometry[centroid])
+            data.loc[centroid, "longitude"] = shapely.get_x(points)
+            data.loc[centroid, "latitude"] = shapely.get_y(points)
+
+        # Polygon and MultiPolygon, as in utils.geometry.reorient
+        polygonal = np.isin(shapely.get_type_id(geometry), [3, 6])
+        if polygonal.any():
+            geometry[polygonal] = shapely.orient_polygons(
+                geometry[polygonal], exterior_cw=True
+            )
+            data = data.set_geometry(
+                gpd.GeoSeries(geometry, index=data.index, crs=data.crs)
             )
 
-        return data.dropna(axis=1, how="all")
+        # the geometry column is kept, even empty (e.g. out tags)
+        empty = data.columns[data.isna().all().to_numpy()]
+        return data.drop(columns=empty.drop("geometry", errors="ignore"))
 
     def __set__(self, obj, data: gpd.GeoDataFrame) -> None:
         feat = ["id_", "type_", "geometry"]
@@ -101,16 +406,42 @@ class OverpassDataDescriptor(Descriptor[gpd.GeoDataFrame]):
             raise TypeError(msg)
 
         setattr(obj, self.private_name, data)
+        setattr(obj, self.cache_name, None)
 
 
 class Overpass:
-    endpoint = "http://www.overpass-api.de/api/interpreter"
+    # a URL, or a pool of endpoints, e.g. a mirror and public instances
+    endpoint: URLType = (
+        EndpointPool.from_env("CARTES_OVERPASS_ENDPOINTS")
+        or "http://www.overpass-api.de/api/interpreter"
+    )
     data = OverpassDataDescriptor()
+    # number of elements kept alive by the registry of each Overpass object
+    instances_maxsize = 256
+    # bump when parsing changes, to invalidate parsed cache files
+    parser_version = 2
+    # minimal size (in degrees) and maximal number of the tiles of
+    # split="auto", and how many times a tile may be split again when it fails
+    tile_size = 1.0
+    max_tiles = 16
+    split_depth = 3
 
     def __init__(self, json: JSONType, data: Optional[gpd.GeoDataFrame] = None):
         super().__init__()
         self.json = json
+        # the query of results from Overpass.request, see refresh()
+        self.query_string: Optional[str] = None
+        # the data frame is written to the parsed cache once derived
+        self._write_pending = False
         self._bounds: Optional[Tuple[float, float, float, float]] = None
+        self._parsed: Optional[gpd.GeoDataFrame] = None
+        self._id_index: Optional[Tuple[gpd.GeoDataFrame, pd.Index]] = None
+        self._column_arrays: Optional[
+            Tuple[gpd.GeoDataFrame, Dict[str, np.ndarray]]
+        ] = None
+        self._registry: Optional[Tuple[gpd.GeoDataFrame, ElementRegistry]] = (
+            None
+        )
         if data is None:
             self._data = None
         else:
@@ -135,11 +466,11 @@ class Overpass:
         state = self.__dict__.copy()
         # Usually, we do not need the json of the parent for the simplification
         if getattr(self, "simplify_flag", None):
-            state["json"] = dict(
-                (key, value)
-                for key, value in self.json.items()
-                if key != "elements"
-            )
+            state["json"] = json_header(self.json)
+            state["_parsed"] = None
+            state["_id_index"] = state["_column_arrays"] = None
+        # weak references cannot be pickled
+        state["_registry"] = None
         return state
 
     def __setstate__(self, state):
@@ -151,13 +482,16 @@ class Overpass:
         if self._bounds is not None:
             return self._bounds
         if "geometry" in self.data.columns:
-            x = (
-                self.data.query("geometry == geometry")
-                .assign(empty=lambda df: df.geometry.is_empty)
-                .query("not empty")
-            )
-            if x.shape[0] > 0:
-                self._bounds = unary_union(x.geometry).bounds
+            geometry = self.data.geometry
+            valid = geometry.notna() & ~geometry.is_empty
+            if valid.any():
+                west, south, east, north = geometry[valid].total_bounds
+                self._bounds = (
+                    float(west),
+                    float(south),
+                    float(east),
+                    float(north),
+                )
                 return self._bounds
         self._bounds = tuple(
             eval(key[:3])(
@@ -175,17 +509,492 @@ class Overpass:
 
     @classmethod
     def request(
-        cls, query: Optional[str] = None, *args, **kwargs
+        cls,
+        query: Optional[str] = None,
+        *args,
+        stream: bool = False,
+        split: Optional[SplitType] = None,
+        tile_size: Optional[float] = None,
+        **kwargs,
     ) -> "Overpass":
+        """Sends a query to the Overpass API.
+
+        With stream=True, elements are parsed as the response is downloaded
+        (or read from the cache file), and only relations are kept in the
+        `json` attribute, so that memory stays close to the size of the final
+        data frame.
+
+        The parsed data frame is cached as GeoParquet next to the cached
+        response (if pyarrow is installed) when it is first used: the
+        response is then only loaded again if elements are needed, e.g. to
+        assemble relations.
+
+        With split, queries on large bounds are sent as a grid of smaller
+        queries (see `arequest_split`); tile_size defaults to the
+        `Overpass.tile_size` class attribute.
+
+        Queries built from arguments are recorded in an index of cached
+        queries: a query with the same filters as a cached one, on a
+        contained extent (bounds or area), is answered from the cached
+        results, clipped to its extent (see `QueryIndex`).
+        """
+        description = None
         if query is None:
-            query = cls.build_query(*args, **kwargs)
-        res = json_request(url=Overpass.endpoint, data=query)
-        return Overpass(res)
+            built = cls.build(*args, **kwargs)
+            description = query_index.describe(built)
+            query = built.generate()
+
+        if split is not None:
+            if stream:
+                raise ValueError("Split queries cannot be streamed")
+            return _run(cls.arequest_split(query, split, tile_size=tile_size))
+
+        if stream:
+            overpass = cls.read_parsed(query, stream)
+        else:  # the parsed data frame may be missing, e.g. without pyarrow
+            overpass = cls.read_cached(query)
+        if overpass is None and description is not None and not stream:
+            overpass = cls.read_subsumed(query, *description)
+            if overpass is not None:
+                return overpass
+
+        if overpass is None:
+            if stream:
+                overpass = cls.from_stream(
+                    json_stream(url=Overpass.endpoint, data=query), query
+                )
+            else:
+                overpass = Overpass(
+                    json_request(url=Overpass.endpoint, data=query)
+                )
+            overpass.query_string = query
+            overpass._write_pending = True
+        # results of a failed query must not answer contained queries
+        if description is not None and not partial(overpass.json):
+            query_index.record(query, *description)
+        return overpass
+
+    @classmethod
+    def read_subsumed(
+        cls, query: str, signature: str, extent: BaseGeometry
+    ) -> Optional["Overpass"]:
+        """Clips the cached results of a query covering this one, if any."""
+        for candidate in query_index.candidates(query, signature, extent):
+            overpass = cls.read_cached(candidate)
+            if overpass is None:  # evicted from the cache
+                query_index.remove(candidate)
+                continue
+            if partial(overpass.json):  # not a complete answer
+                query_index.remove(candidate)
+                continue
+            _log.info(f"Answering {query} with cached results of {candidate}")
+            result = Overpass(overpass.json)
+            result._data = clip(overpass.data, extent)
+            return result
+        return None
+
+    @classmethod
+    def request_many(
+        cls,
+        queries: Iterable[Union[str, Dict[str, Any]]],
+        max_concurrency: Optional[int] = None,
+    ) -> List["Overpass"]:
+        """Sends several queries to the Overpass API, concurrently.
+
+        Queries are either Overpass QL strings or dictionaries of arguments
+        to `build_query`. Results are returned in the order of the queries.
+        Cached results are used first; identical queries are sent once.
+
+        Concurrency is bounded by max_concurrency, by default the number of
+        slots of the endpoint (see its /api/status page), or the capacity
+        of the pool of endpoints.
+
+        This function may be called from scripts as well as from Jupyter,
+        where an event loop is already running: requests are then sent from
+        another thread. Use `arequest_many` in asynchronous code.
+        """
+        return _run(cls.arequest_many(queries, max_concurrency))
+
+    @classmethod
+    async def arequest_many(
+        cls,
+        queries: Iterable[Union[str, Dict[str, Any]]],
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Any]:
+        """Asynchronous counterpart of request_many.
+
+        With return_exceptions=True, failed requests return their exception
+        in place of a result, as with `asyncio.gather`.
+        """
+        query_strings: List[str] = [
+            query if isinstance(query, str) else cls.build_query(**query)
+            for query in queries
+        ]
+        results: Dict[str, Union[Overpass, BaseException]] = dict()
+        missing: List[str] = list()
+        for query_string in dict.fromkeys(query_strings):
+            overpass = cls.read_cached(query_string)
+            if overpass is not None:
+                results[query_string] = overpass
+            else:
+                missing.append(query_string)
+
+        if len(missing) > 0:
+            url = Overpass.endpoint
+            async with httpx.AsyncClient(
+                follow_redirects=True, http2=True
+            ) as client:
+                if max_concurrency is None:
+                    max_concurrency = (
+                        sum(elt.concurrency for elt in url.endpoints)
+                        if isinstance(url, EndpointPool)
+                        else await rate_limit(client, url) or 2
+                    )
+                semaphore = asyncio.Semaphore(max_concurrency)
+
+                async def fetch(query: str) -> JSONType:
+                    async with semaphore:
+                        return await async_json_request(client, url, data=query)
+
+                try:
+                    responses = await asyncio.gather(
+                        *map(fetch, missing),
+                        return_exceptions=return_exceptions,
+                    )
+                finally:  # clients of the endpoints belong to this loop
+                    if isinstance(url, EndpointPool):
+                        await url.aclose()
+            for query_string, json_ in zip(missing, responses):
+                results[query_string] = (
+                    json_
+                    if isinstance(json_, BaseException)
+                    else cls.from_json(query_string, json_)
+                )
+
+        return [results[query_string] for query_string in query_strings]
+
+    @classmethod
+    def request_batch(
+        cls, queries: Sequence[Union[Query, Dict[str, Any]]]
+    ) -> List["Overpass"]:
+        """Sends several queries as one Overpass program.
+
+        Queries are Query objects or dictionaries of arguments to `build`;
+        they must share their settings (see `QueryBatch`), e.g. layers of
+        one area. Results are returned in the order of the queries, and
+        cached as if each query had been sent alone: cached results are
+        used first, and only the missing queries are sent.
+        """
+        built = [
+            query if isinstance(query, Query) else cls.build(**query)
+            for query in queries
+        ]
+        batch = QueryBatch(built)
+        results: Dict[int, Overpass] = dict()
+        missing: List[int] = list()
+        for i, query_string in enumerate(batch.queries):
+            overpass = cls.read_cached(query_string)
+            if overpass is not None:
+                results[i] = overpass
+            else:
+                missing.append(i)
+
+        if len(missing) > 0:
+            program = QueryBatch([built[i] for i in missing])
+            json_ = jsonlib.loads(
+                raw_request(
+                    Overpass.endpoint,
+                    timeout=program.timeout,
+                    data=program.generate(),
+                )
+            )
+            remark = json_header(json_).get("remark", "")
+            for i, query_string, part in zip(
+                missing, program.queries, program.split(json_)
+            ):
+                if part is None:  # no marker: the query was not run
+                    _log.warning(f"No results for {query_string}: {remark}")
+                    results[i] = Overpass(dict(json_header(json_), elements=[]))
+                    continue
+                if partial(json_):  # do not cache partial results
+                    _log.warning(
+                        f"Partial results for {query_string}: {remark}"
+                    )
+                    results[i] = Overpass(part)
+                    continue
+                json_request.put(part, url=Overpass.endpoint, data=query_string)
+                results[i] = cls.from_json(query_string, part)
+
+        overpasses = [results[i] for i in range(len(built))]
+        for parsed, overpass in zip(built, overpasses):
+            description = query_index.describe(parsed)
+            if description is not None and overpass.query_string is not None:
+                query_index.record(overpass.query_string, *description)
+        return overpasses
+
+    @classmethod
+    async def arequest_split(
+        cls,
+        query: str,
+        split: SplitType,
+        max_concurrency: Optional[int] = None,
+        tile_size: Optional[float] = None,
+    ) -> "Overpass":
+        """Sends a query with a global bounding box as a grid of queries.
+
+        - with split=(nx, ny), the bounding box is split into nx by ny tiles;
+        - with split="auto", bounding boxes larger than tile_size degrees
+          are split along a global grid, clipped to the bounding box (see
+          `tile_bounds`). The grid is coarsened, by powers of two, until
+          there are at most `max_tiles` tiles: large extents are not sent
+          as hundreds of requests, but their tiles are more likely to time
+          out and be split again.
+
+        Inner tiles are cells of the grid, shared by overlapping queries;
+        tiles on the edges only cover the bounding box, so that no element
+        out of it is downloaded, but they are not shared. A smaller
+        tile_size shares more tiles, at the cost of more requests.
+
+        Tiles are sent concurrently (see `arequest_many`) and cached as any
+        other query. A tile timing out or running out of memory (a runtime
+        error remark, or a 504 after retries) is split again in 2 by 2
+        tiles, at most `split_depth` times. Results are merged, each element
+        being kept once.
+        """
+        bounds = query_bounds(query)
+        if split == "auto":
+            if tile_size is None:
+                tile_size = cls.tile_size
+            west, south, east, north = bounds
+            tiles = [bounds]
+            if max(east - west, north - south) > tile_size:
+                tiles = tile_bounds(bounds, tile_size, cls.max_tiles)
+        else:
+            nx, ny = split
+            if nx < 1 or ny < 1:
+                raise ValueError(f"Invalid grid {split}")
+            tiles = split_bounds(bounds, nx, ny)
+
+        parts: List[Overpass] = list()
+        for depth in range(cls.split_depth + 1):
+            queries = [with_bounds(query, tile) for tile in tiles]
+            _log.info(f"Sending {len(queries)} tiles (depth {depth})")
+            results = await cls.arequest_many(
+                queries, max_concurrency, return_exceptions=True
+            )
+            failed: List[BoundsType] = list()
+            for tile, result in zip(tiles, results):
+                if not cls.tile_failed(result):
+                    parts.append(result)
+                elif depth == cls.split_depth:
+                    if isinstance(result, BaseException):
+                        raise result
+                    msg = f"Keeping partial results for tile {tile}"
+                    _log.warning(f"{msg}: {json_header(result.json)['remark']}")
+                    parts.append(result)
+                else:
+                    failed.extend(split_bounds(tile, 2, 2))
+            if len(failed) == 0:
+                break
+            tiles = failed
+
+        return cls.from_tiles(parts)
 
     @staticmethod
-    def build_query(*, out: str = "json", timeout: int = 180, **kwargs) -> str:
-        query = Query(out=out, timeout=timeout, **kwargs)
-        return query.generate()
+    def tile_failed(result: Union["Overpass", BaseException]) -> bool:
+        """True if the tile should be split again, raises other errors."""
+        if isinstance(result, httpx.HTTPStatusError):
+            if result.response.status_code == 504:
+                return True
+        if isinstance(result, BaseException):
+            raise result
+        return partial(result.json)
+
+    @classmethod
+    def from_tiles(
+        cls, parts: Sequence["Overpass"], bounds: Optional[BoundsType] = None
+    ) -> "Overpass":
+        """Merges the results of tiles, keeping each element once.
+
+        If bounds are given, elements out of the bounds are removed.
+        """
+        overpass = Overpass(MergedJSON([elt.json for elt in parts]))
+        data = concat(elt.data for elt in parts)
+        if data is None:
+            return overpass
+        if bounds is not None:
+            data = clip(data, shapely.box(*bounds))
+        overpass._data = data
+        return overpass
+
+    @classmethod
+    def from_json(cls, query: str, json_: JSONType) -> "Overpass":
+        overpass = Overpass(json_)
+        overpass.query_string = query
+        overpass._write_pending = True
+        return overpass
+
+    @classmethod
+    def read_cached(cls, query: str) -> Optional["Overpass"]:
+        """The cached results of query, parsed or not, if any."""
+        overpass = cls.read_parsed(query)
+        if overpass is not None:
+            return overpass
+        json_ = json_request.cached(url=Overpass.endpoint, data=query)
+        if json_ is None:
+            return None
+        return cls.from_json(query, json_)
+
+    @classmethod
+    def read_parsed(
+        cls, query: str, stream: bool = False
+    ) -> Optional["Overpass"]:
+        """Reads the parsed data frame cached for query, if any."""
+        cache_file = json_request.cache_file(url=Overpass.endpoint, data=query)
+        if cache_file is None:  # entries are not stored as files
+            return None
+        parsed = read_parquet(cache_file, cls.parser_stamp())
+        if parsed is None:
+            return None
+        # both files make one entry for the eviction of the cache_manager
+        cache_manager.touch(cache_file)
+        cache_manager.touch(parquet_file(cache_file))
+        data, header = parsed
+        overpass = Overpass(LazyJSON(header, query, stream), data)
+        overpass.query_string = query
+        return overpass
+
+    @classmethod
+    def write_parsed(cls, query: str, overpass: "Overpass") -> None:
+        """Writes the parsed data frame of query to the parsed cache.
+
+        The parsed cache is an optimisation: failures are only logged.
+        """
+        cache_file = json_request.cache_file(url=Overpass.endpoint, data=query)
+        if cache_file is None or not writable(cache_file):
+            return
+        try:
+            write_parquet(
+                cache_file,
+                overpass.data,
+                json_header(overpass.json),
+                cls.parser_stamp(),
+            )
+        except Exception as e:
+            _log.warning(f"Parsed results of {query!r} not cached: {e!r}")
+
+    def refresh(self) -> "Overpass":
+        """Updates cached results with the changes made to OSM since then.
+
+        The augmented diff of the query since the timestamp of the cached
+        response is requested: created, modified and deleted elements are
+        applied to the cached response, and only the changed elements, and
+        the relations whose members moved, are parsed again. The cache entry
+        is updated, with the timestamp of the diff.
+
+        Only the results of `Overpass.request` (not split ones) may be
+        refreshed.
+        """
+        query = self.query_string
+        if query is None:
+            raise ValueError("Only results of Overpass.request are refreshed")
+        if "[date:" in query:
+            raise ValueError("Queries on a past date cannot be refreshed")
+        osm3s = json_header(self.json).get("osm3s", dict())
+        timestamp = osm3s.get("timestamp_osm_base", None)
+        json_ = json_request.cached(url=Overpass.endpoint, data=query)
+        if timestamp is None or json_ is None:  # e.g. evicted from the cache
+            return Overpass.request(query)
+
+        diff = parse_adiff(
+            raw_request(Overpass.endpoint, data=adiff_query(query, timestamp))
+        )
+        changed = dict(((elt["type"], elt["id"]), elt) for elt in diff.elements)
+        _log.info(
+            f"{len(changed)} elements created or modified, "
+            f"{len(diff.deleted)} deleted since {timestamp}"
+        )
+        moved = dict(
+            (key, elt) for key, elt in changed.items() if key[0] != "relation"
+        )
+        affected = set(changed) | diff.deleted
+        elements = list()
+        for elt in json_["elements"]:
+            key = elt["type"], elt["id"]
+            if key in diff.deleted:
+                continue
+            if key in changed:
+                elt = changed.pop(key)
+            elif elt["type"] == "relation" and any(
+                (member["type"], member["ref"]) in moved
+                for member in elt.get("members", [])
+            ):
+                members = [_moved(member, moved) for member in elt["members"]]
+                elt = dict(elt, members=members)
+                affected.add(key)
+            elements.append(elt)
+        elements.extend(changed.values())  # created
+
+        header = json_header(json_)
+        if diff.timestamp is not None:
+            header["osm3s"] = dict(
+                header.get("osm3s", dict()), timestamp_osm_base=diff.timestamp
+            )
+        overpass = Overpass(dict(header, elements=elements))
+        overpass.query_string = query
+
+        old = self.data
+        keep = np.fromiter(
+            ((t, i) not in affected for t, i in zip(old.type_, old.id_)),
+            dtype=bool,
+            count=len(old),
+        )
+        parsed = overpass.parse_elements(
+            elt for elt in elements if (elt["type"], elt["id"]) in affected
+        )
+        parsed = parsed.drop(
+            columns=[col for col in ["members", "nodes"] if col in parsed]
+        )
+        overpass._data = concat([old.loc[keep], parsed])
+
+        json_request.put(overpass.json, url=Overpass.endpoint, data=query)
+        self.write_parsed(query, overpass)
+        return overpass
+
+    @classmethod
+    def parser_stamp(cls) -> str:
+        """Invalidates parsed cache files when the parser changes."""
+        from ... import __version__
+
+        return f"{__version__}/{cls.parser_version}"
+
+    @classmethod
+    def from_stream(
+        cls, stream: ElementStream, query: Optional[str] = None
+    ) -> "Overpass":
+        json: Dict[str, Any] = dict(elements=list())
+
+        def keep_relations(elements: ElementStream) -> Iterator[JSONType]:
+            # relations are needed again for the assembly of their members
+            for elt in elements:
+                if elt["type"] == "relation":
+                    json["elements"].append(elt)
+                yield elt
+
+        overpass = Overpass(json)
+        overpass.query_string = query
+        overpass._parsed = overpass.parse_elements(keep_relations(stream))
+        json.update(stream.header)
+        return overpass
+
+    @staticmethod
+    def build(*, out: str = "json", timeout: int = 180, **kwargs) -> Query:
+        return Query(out=out, timeout=timeout, **kwargs)
+
+    @classmethod
+    def build_query(cls, *args, **kwargs) -> str:
+        return cls.build(*args, **kwargs).generate()
 
     def assign(self, *args, **kwargs) -> "Overpass":
         return Overpass(self.json, self.data.assign(*args, **kwargs))
@@ -211,42 +1020,55 @@ class Overpass:
     def sort_values(self, *args, **kwargs) -> "Overpass":
         return Overpass(self.json, self.data.sort_values(*args, **kwargs))
 
-    def area(self) -> "Overpass":
-        bounds = self.bounds
-        proj = Proj(
-            proj="aea",  # equivalent projection
-            lat_1=bounds[1],
-            lat_2=bounds[3],
-            lat_0=(bounds[1] + bounds[3]) / 2,
-            lon_0=(bounds[0] + bounds[2]) / 2,
-        )
-        return self.assign(
-            area=self.data.geometry.set_crs(epsg=4326).to_crs(crs=proj.crs).area
-        )
+    def area(
+        self, method: Literal["projected", "geodesic"] = "projected"
+    ) -> "Overpass":
+        """Assigns an area column, in square meters.
 
-    def length(self) -> "Overpass":
-        bounds = self.bounds
-        proj = Proj(
-            proj="aea",  # equivalent projection
-            lat_1=bounds[1],
-            lat_2=bounds[3],
-            lat_0=(bounds[1] + bounds[3]) / 2,
-            lon_0=(bounds[0] + bounds[2]) / 2,
-        )
-        return self.assign(
-            length=self.data.geometry.set_crs(epsg=4326)
-            .to_crs(crs=proj.crs)
-            .length
-        )
+        - "projected" computes areas in an equal-area projection fitted to
+          the bounds of the data, which is less accurate for large extents;
+        - "geodesic" computes areas on the WGS84 ellipsoid.
+        """
+        geometry = np.array(self.data.geometry.array, dtype=object)
+        if method == "geodesic":
+            return self.assign(area=geodesic_area(geometry))
+        if method != "projected":
+            raise ValueError(f"Unknown method {method}")
+        forward = transformer_cache.equal_area(self.bounds).forward
+        return self.assign(area=shapely.area(project(geometry, forward)))
+
+    def length(
+        self, method: Literal["projected", "geodesic"] = "projected"
+    ) -> "Overpass":
+        """Assigns a length column, in meters.
+
+        Methods are the same as for `area()`.
+        """
+        geometry = np.array(self.data.geometry.array, dtype=object)
+        if method == "geodesic":
+            return self.assign(length=geodesic_length(geometry))
+        if method != "projected":
+            raise ValueError(f"Unknown method {method}")
+        forward = transformer_cache.equal_area(self.bounds).forward
+        return self.assign(length=shapely.length(project(geometry, forward)))
 
     def coloring(self) -> "Overpass":
         self.graph = nx.Graph()
-        for elt in self:
-            for neighbour in elt.neighbours:
-                self.graph.add_edge(elt.json["id_"], neighbour)
+        # only relations have members, and ids are unique per type only
+        relations = self.data.query('type_ == "relation"')
+        for id_ in relations.id_:
+            for neighbour in self.shared_members(id_):
+                self.graph.add_edge(id_, neighbour)
         colors = nx.algorithms.coloring.greedy_color(self.graph)
         merge = self.merge(
-            pd.Series(colors, name="coloring"), left_on="id_", right_index=True
+            pd.DataFrame(
+                dict(
+                    type_="relation",
+                    id_=list(colors),
+                    coloring=list(colors.values()),
+                )
+            ),
+            on=["type_", "id_"],
         )
         merge.graph = self.graph
         return merge
@@ -286,75 +1108,141 @@ class Overpass:
         max_workers: Optional[int] = 4,
         **kwargs,
     ) -> "Overpass":
+        """Simplifies all geometries in an equal-area projection.
+
+        Nodes, ways and relations with a plain geometry are simplified at
+        once on the projected GeoSeries. Only relations which re-assemble
+        their geometry from simplified members (e.g. Boundary) are simplified
+        one by one, in a process pool if max_workers > 1.
+        """
         if resolution is None:
             return self
 
-        new_overpass = Overpass(self.json)
+        bounds = kwargs.get("bounds", None)
+        if bounds is None:
+            bounds = self.bounds
+        projection = transformer_cache.equal_area(bounds)
+        geometry = project(
+            shapely.simplify(
+                project(
+                    np.array(self.data.geometry.array, dtype=object),
+                    projection.forward,
+                ),
+                resolution,
+            ),
+            projection.backward,
+        )
 
-        if max_workers is not None and max_workers > 1:
+        # the class of relations is known from their type tag
+        relations: List[Tuple[int, NodeWayRelation]] = list()
+        columns = self._columns()
+        tags = columns.get("type", np.full(self.data.shape[0], None))
+        is_relation = columns["type_"] == "relation"
+        for i in np.flatnonzero(is_relation).tolist():
+            cls = Relation.subclasses.get(tags[i], NodeWayRelation)
+            if cls.simplify is not NodeWayRelation.simplify:
+                relations.append((i, self._element(i)))
+
+        result: List[Tuple[int, BaseGeometry]] = list()
+        if len(relations) > 0 and max_workers is not None and max_workers > 1:
             self.simplify_flag = True
             with ProcessPoolExecutor(max_workers=max_workers) as executor:
                 futures: Dict[Future, int] = dict()
-                for i, nwr in enumerate(self):
+                for i, nwr in relations:
                     futures[
                         executor.submit(nwr.simplify, resolution, **kwargs)
                     ] = i
-                result: List[Tuple[int, BaseGeometry]] = list()
                 for future in tqdm(as_completed(futures), total=len(futures)):
                     result.append((futures[future], future.result().shape))
             self.simplify_flag = False
         else:
             result = list(
-                (i, nwr.simplify(resolution, **kwargs))
-                for i, nwr in tqdm(enumerate(self), total=self.data.shape[0])
+                (i, nwr.simplify(resolution, **kwargs).shape)
+                for i, nwr in tqdm(relations, total=len(relations))
             )
 
-        new_overpass.data = self.data.assign(
-            geometry=list(elt for _, elt in sorted(result))
-        )
-        new_overpass.json = self.json
+        for i, shape in result:
+            geometry[i] = shape
 
+        new_overpass = Overpass(self.json)
+        new_overpass.data = self.data.assign(geometry=geometry)
         return new_overpass
 
+    def _columns(self) -> Dict[str, np.ndarray]:
+        """Column arrays of the current data frame, shared by row views."""
+        data = self.data
+        if self._column_arrays is None or self._column_arrays[0] is not data:
+            columns = dict((key, data[key].to_numpy()) for key in data.columns)
+            self._column_arrays = data, columns
+        return self._column_arrays[1]
+
+    def _element(self, position: int) -> NodeWayRelation:
+        data = self.data
+        if self._registry is None or self._registry[0] is not data:
+            self._registry = data, ElementRegistry(self.instances_maxsize)
+        registry = self._registry[1]
+
+        row = RowView(self, self._columns(), position)
+        key = row["type_"], row["id_"]
+        element = registry.get(key)
+        if element is None:
+            if key[0] == "relation":
+                # relations write their assembled geometry in their json
+                element = NodeWayRelation(dict(row))
+            else:
+                element = NodeWayRelation(row)
+            registry.add(key, element)
+        return element
+
     def __iter__(self) -> Iterator[NodeWayRelation]:
-        for _, line in self.data.iterrows():
-            yield NodeWayRelation({"_parent": self, **dict(line)})
+        for position in range(self.data.shape[0]):
+            yield self._element(position)
 
-    @lru_cache()
-    def __getitem__(self, item) -> NodeWayRelation:
-        elt = self.data.query("id_ == @item")
-        if elt.shape[0] == 0:
+    def _positions(
+        self, ids: List[int], type_: Optional[str] = None
+    ) -> np.ndarray:
+        """Row positions of the given ids, based on a hash index on id_.
+
+        The index is built once for the current data frame. Missing ids are
+        skipped; the type_ of the element is checked if specified.
+        """
+        data = self.data
+        if self._id_index is None or self._id_index[0] is not data:
+            self._id_index = data, pd.Index(data.id_)
+        positions = self._id_index[1].get_indexer_for(ids)
+        positions = positions[positions >= 0]
+        if type_ is not None:
+            positions = positions[data.type_.to_numpy()[positions] == type_]
+        return positions
+
+    def __getitem__(self, item: Union[int, Tuple[str, int]]) -> NodeWayRelation:
+        """Returns the element with the given id_.
+
+        Node, way and relation ids may overlap: use ov["way", id_] to specify
+        the type of the element.
+        """
+        type_ = None
+        if isinstance(item, tuple):
+            type_, item = item
+        positions = self._positions([item], type_)
+        if len(positions) == 0:
             raise AttributeError(f"No {item} id_ in the current data")
-        return NodeWayRelation({"_parent": self, **dict(elt.iloc[0])})
+        return self._element(positions[0])
+
+    def get_many(
+        self, ids: Iterable[int], type_: Optional[str] = None
+    ) -> "Overpass":
+        """Returns the elements with the given ids, in a single take.
+
+        Missing ids are ignored.
+        """
+        positions = self._positions(list(ids), type_)
+        return Overpass(self.json, self.data.take(positions))
 
     @property
     def __geo_interface__(self):
         return self.data.__geo_interface__
 
-    @cache_by_id
-    def make_node(self, elt: Dict[str, Any]) -> Dict[str, Any]:
-        return dict(
-            _parent=self,
-            id_=elt["id"],
-            type_=elt["type"],
-            latitude=elt["lat"],
-            longitude=elt["lon"],
-            geometry=to_geometry(elt) if elt.get("geometry", None) else None,
-            **elt["tags"],
-        )
-
-    @cache_by_id
-    def make_way(self, elt: Dict[str, Any]) -> Dict[str, Any]:
-        return dict(
-            _parent=self,
-            id_=elt["id"],
-            type_=elt["type"],
-            nodes=elt["nodes"],
-            geometry=to_geometry(elt) if elt.get("geometry", None) else None,
-            **elt["tags"],
-        )
-
-    @cache_by_id
     def make_relation(self, elt: Dict[str, Any]) -> Dict[str, Any]:
         return NodeWayRelation(
             dict(
@@ -362,52 +1250,160 @@ class Overpass:
                 id_=elt["id"],
                 type_=elt["type"],
                 members=elt["members"],
-                **elt["tags"],
+                **elt.get("tags", dict()),
             )
         ).json
 
     @cached_property
-    def all_members(self) -> Dict[int, List[Member]]:
+    def member_refs(self) -> Dict[int, Set[int]]:
+        """Refs of the (non relation) members of each relation."""
         return dict(
-            (
-                elt["id"],
-                list(
-                    {
-                        "ref": entry["ref"],
-                        "role": entry["role"],
-                        "geometry": to_geometry(entry)
-                        if entry.get("geometry", None)
-                        or (
-                            entry["type"] == "node"
-                            and "lon" in entry
-                            and "lat" in entry
-                        )
-                        else None,
-                    }
-                    for entry in elt.get("members", [])
-                    if entry["type"] != "relation"
-                    # TODO subrelations not supported
-                ),
-            )
-            for elt in self.json["elements"]
+            (id_, self.all_members.refs(id_)) for id_ in self.all_members
         )
 
-    @lru_cache()
+    @cached_property
+    def member_index(self) -> Dict[int, List[int]]:
+        """Inverted index: ids of the relations containing each member ref."""
+        index: Dict[int, List[int]] = defaultdict(list)
+        for id_, refs in self.member_refs.items():
+            for ref in refs:
+                index[ref].append(id_)
+        return dict(index)
+
+    def shared_members(self, id_: int) -> Dict[int, Set[int]]:
+        """Members that relation id_ shares with other relations.
+
+        Keys are the ids of the other relations, values the shared refs.
+        """
+        shared: Dict[int, Set[int]] = defaultdict(set)
+        for ref in self.member_refs.get(id_, set()):
+            for other in self.member_index[ref]:
+                if other != id_:
+                    shared[other].add(ref)
+        # follow the order of the elements in the response
+        return dict(sorted(shared.items(), key=lambda x: self._rank[x[0]]))
+
+    @cached_property
+    def _rank(self) -> Dict[int, int]:
+        return dict((id_, i) for i, id_ in enumerate(self.member_refs))
+
+    @cached_property
+    def all_members(self) -> MemberStore:
+        return MemberStore(self.json["elements"])
+
     def parse(self) -> gpd.GeoDataFrame:
-        make_dict: Dict[
-            str, Callable[[Overpass, Dict[str, Any]], Dict[str, Any]]
-        ] = {
-            "node": Overpass.make_node,
-            "way": Overpass.make_way,
-            "relation": Overpass.make_relation,
-        }
-        return gpd.GeoDataFrame.from_records(
-            list(
-                make_dict[elt["type"]](self, elt)
-                for elt in self.json["elements"]
-                if elt.get("tags", None)
+        if self._parsed is None:
+            self._parsed = self.parse_elements(self.json["elements"])
+        return self._parsed
+
+    def parse_elements(self, elements: Iterable[JSONType]) -> gpd.GeoDataFrame:
+        """Builds the GeoDataFrame from JSON elements.
+
+        Elements are consumed in one pass and gathered column by column:
+        ids, types and coordinates go into compact arrays, and all way
+        geometries are built at once with shapely array constructors.
+        Relations are assembled one by one once all elements are known.
+        Duplicate elements (same type_ and id_) are only kept once.
+
+        Lighter output modes are supported: centers (out center) are the
+        geometry of ways and relations, relations with no member geometry
+        (out center, tags, ids, skel) are not assembled. Untagged elements
+        are only kept if the query outputs no tags (out ids, skel).
+        """
+        seen: Set[Tuple[str, int]] = set()
+        type_: List[str] = list()
+        id_ = array("q")
+        latitude, longitude = array("d"), array("d")
+        tags: List[Dict[str, Any]] = list()
+        nodes: Dict[int, List[int]] = dict()
+        point_geometry: Dict[int, BaseGeometry] = dict()
+        way_rows, counts, closed = array("q"), array("q"), array("b")
+        coords = array("d")
+        relations: Dict[int, Dict[str, Any]] = dict()
+
+        keep_untagged = untagged(self.query_string)
+        for elt in elements:
+            if not keep_untagged and not elt.get("tags", None):
+                continue
+            key = (elt["type"], elt["id"])
+            if key in seen:
+                continue
+            seen.add(key)
+            row = len(type_)
+            type_.append(elt["type"])
+            id_.append(elt["id"])
+            tags.append(elt.get("tags", dict()))
+            point = elt.get("center", elt)
+            latitude.append(point.get("lat", np.nan))
+            longitude.append(point.get("lon", np.nan))
+            if "center" in elt:  # out center
+                point_geometry[row] = Point(point["lon"], point["lat"])
+            elif elt["type"] == "node":
+                if elt.get("geometry", None):
+                    point_geometry[row] = to_geometry(elt)
+            elif elt["type"] == "way":
+                if "nodes" in elt:
+                    nodes[row] = elt["nodes"]
+                if elt.get("geometry", None):
+                    points = elt["geometry"]
+                    way_rows.append(row)
+                    counts.append(len(points))
+                    # nodes may be missing, and rings need four points
+                    closed.append(len(points) > 3 and points[0] == points[-1])
+                    for p in points:
+                        coords.append(p["lon"])
+                        coords.append(p["lat"])
+            elif any(
+                "geometry" in member or "lat" in member
+                for member in elt.get("members", [])
+            ):
+                relations[row] = elt
+
+        # No _parent column: object arrays are not tracked by the garbage
+        # collector, so that reference cycles through them are never freed.
+        columns: Dict[str, Any] = dict(
+            id_=np.frombuffer(id_, dtype=np.int64),
+            type_=np.array(type_, dtype=object),
+        )
+        if "node" in type_ or not np.isnan(np.frombuffer(latitude)).all():
+            columns["latitude"] = np.frombuffer(latitude)
+            columns["longitude"] = np.frombuffer(longitude)
+        if len(nodes) > 0:
+            columns["nodes"] = self._sparse_column(len(type_), nodes)
+        geometry = np.full(len(type_), None, dtype=object)
+        geometry[list(point_geometry)] = list(point_geometry.values())
+        if len(way_rows) > 0:
+            geometry[np.frombuffer(way_rows, dtype=np.int64)] = to_geometries(
+                np.frombuffer(coords).reshape(-1, 2),
+                np.frombuffer(counts, dtype=np.int64),
+                np.frombuffer(closed, dtype=np.int8).astype(bool),
             )
+
+        if len(relations) > 0:
+            for row, elt in relations.items():
+                relations[row] = self.make_relation(elt)
+            columns["members"] = self._sparse_column(
+                len(type_),
+                dict((row, elt["members"]) for row, elt in relations.items()),
+            )
+            geometry[list(relations)] = list(
+                elt.get("geometry", None) for elt in relations.values()
+            )
+
+        columns["geometry"] = geometry
+        tags_df = pd.DataFrame.from_records(tags)
+        tags_df = tags_df.drop(columns=[c for c in tags_df if c in columns])
+        return gpd.GeoDataFrame(
+            pd.concat([pd.DataFrame(columns), tags_df], axis=1)
+        )
+
+    @staticmethod
+    def _sparse_column(length: int, values: Dict[int, Any]) -> np.ndarray:
+        column = np.full(length, np.nan, dtype=object)
+        column[list(values)] = np.fromiter(
+            values.values(), dtype=object, count=len(values)
         )
+        return column
 
     def plot(self, ax, by: Optional[str] = None, **kwargs):
         if by is None:
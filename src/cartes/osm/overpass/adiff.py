@@ -0,0 +1,116 @@
+"""Augmented diffs of Overpass queries.
+
+A query sent with the `[adiff:"<timestamp>"]` setting returns the changes
+to its results since timestamp: created, modified and deleted elements
+(elements no longer matching the query are reported as deleted). Augmented
+diffs are written in XML: elements are converted to the JSON format of
+Overpass responses.
+
+>>> diff = parse_adiff(b'''<osm version="0.6">
+... <meta osm_base="2024-05-02T10:00:00Z"/>
+... <action type="create">
+...   <node id="1" lat="43.6" lon="1.4"><tag k="a" v="b"/></node>
+... </action>
+... <action type="delete">
+...   <old><node id="2" lat="43.6" lon="1.5"/></old>
+...   <new><node id="2" visible="false"/></new>
+... </action>
+... </osm>''')
+>>> diff.timestamp
+'2024-05-02T10:00:00Z'
+>>> diff.elements
+[{'type': 'node', 'id': 1, 'lat': 43.6, 'lon': 1.4, 'tags': {'a': 'b'}}]
+>>> diff.deleted
+{('node', 2)}
+
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+from xml.etree import ElementTree
+
+from ..requests import JSONType
+
+OUT = re.compile(r"\[out:\w+\]")
+
+
+class AugmentedDiff(NamedTuple):
+    # osm_base of the diff, i.e. the timestamp of the next refresh
+    timestamp: Optional[str]
+    # new versions of the created and modified elements
+    elements: List[JSONType]
+    deleted: Set[Tuple[str, int]]
+
+
+def adiff_query(query: str, timestamp: str) -> str:
+    """The augmented diff of a query since timestamp."""
+    settings = f'[out:xml][adiff:"{timestamp}"]'
+    if OUT.search(query):
+        return OUT.sub(settings, query, count=1)
+    query = query.lstrip()
+    return settings + ("" if query.startswith("[") else ";") + query
+
+
+def _point(elt: ElementTree.Element) -> Dict[str, float]:
+    return dict(lat=float(elt.attrib["lat"]), lon=float(elt.attrib["lon"]))
+
+
+def to_json(elt: ElementTree.Element) -> JSONType:
+    """Converts a node, way or relation to the JSON format."""
+    json_: Dict[str, Any] = dict(type=elt.tag, id=int(elt.attrib["id"]))
+    if "lat" in elt.attrib:
+        json_.update(_point(elt))
+    bounds = elt.find("bounds")
+    if bounds is not None:
+        json_["bounds"] = dict(
+            (key, float(value)) for key, value in bounds.attrib.items()
+        )
+    if elt.tag == "way":
+        json_["nodes"] = [int(nd.attrib["ref"]) for nd in elt.iter("nd")]
+        geometry = [_point(nd) for nd in elt.iter("nd") if "lat" in nd.attrib]
+        if len(geometry) > 0:
+            json_["geometry"] = geometry
+    if elt.tag == "relation":
+        json_["members"] = list()
+        for member in elt.iter("member"):
+            entry: Dict[str, Any] = dict(
+                type=member.attrib["type"],
+                ref=int(member.attrib["ref"]),
+                role=member.attrib.get("role", ""),
+            )
+            if "lat" in member.attrib:
+                entry.update(_point(member))
+            geometry = [_point(nd) for nd in member.iter("nd")]
+            if len(geometry) > 0:
+                entry["geometry"] = geometry
+            json_["members"].append(entry)
+    tags = dict((tag.attrib["k"], tag.attrib["v"]) for tag in elt.iter("tag"))
+    if len(tags) > 0:
+        json_["tags"] = tags
+    return json_
+
+
+def parse_adiff(content: bytes) -> AugmentedDiff:
+    """Parses the XML response of an augmented diff query."""
+    root = ElementTree.fromstring(content)
+    meta = root.find("meta")
+    timestamp = None if meta is None else meta.attrib.get("osm_base", None)
+    remark = root.find("remark")
+    if remark is not None and "runtime error" in (remark.text or ""):
+        raise RuntimeError(remark.text.strip())  # type: ignore
+
+    elements: List[JSONType] = list()
+    deleted: Set[Tuple[str, int]] = set()
+    for action in root.iter("action"):
+        new = action.find("new")
+        children = list(action if new is None else new)
+        if len(children) == 0:
+            continue
+        elt = children[0]
+        if action.attrib["type"] == "delete":
+            deleted.add((elt.tag, int(elt.attrib["id"])))
+        else:
+            elements.append(to_json(elt))
+    return AugmentedDiff(timestamp, elements, deleted)
@@ -1,6 +1,19 @@
-from typing import Any, ClassVar, Dict, Optional, Tuple, TypeVar, Union
-
-from pyproj import Proj, Transformer
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    Iterator,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import numpy as np
+import shapely
 from shapely.geometry import LineString, Point, Polygon, mapping, shape
 from shapely.geometry.base import BaseGeometry
 from shapely.ops import transform
@@ -9,6 +22,7 @@ from ...core import GeoObject
 from ...utils.descriptors import OrientedShape
 from ...utils.geometry import reorient
 from ...utils.mixins import HBoxMixin, HTMLAttrMixin, HTMLTitleMixin
+from ...utils.projections import transformer_cache
 from ..requests import GeoJSONType, JSONType
 
 
@@ -31,6 +45,138 @@ def to_geometry(elt: JSONType) -> BaseGeometry:
     return reorient(shape(list((p["lon"], p["lat"]) for p in elt["geometry"])))
 
 
+def to_geometries(
+    coords: np.ndarray, counts: np.ndarray, closed: np.ndarray
+) -> np.ndarray:
+    """Builds an array of shapely geometries based on flat coordinates.
+
+    This is the vectorized counterpart of `to_geometry` for ways: `coords`
+    stacks the (lon, lat) points of all ways, `counts` is the number of points
+    per way and `closed` tells which ways are Polygons rather than LineStrings.
+
+    >>> to_geometries(
+    ...     np.array([[0, 0], [1, 1], [0, 0], [0, 1], [1, 0], [0, 0]]),
+    ...     np.array([2, 4]),
+    ...     np.array([False, True]),
+    ... ).tolist()
+    [<LINESTRING (0 0, 1 1)>, <POLYGON ((0 0, 0 1, 1 0, 0 0))>]
+
+    """
+    geometries = np.empty(len(counts), dtype=object)
+    is_closed = np.repeat(closed, counts)
+
+    if (~closed).any():
+        geometries[~closed] = shapely.linestrings(
+            coords[~is_closed],
+            indices=np.repeat(np.arange((~closed).sum()), counts[~closed]),
+        )
+    if closed.any():
+        rings = shapely.linearrings(
+            coords[is_closed],
+            indices=np.repeat(np.arange(closed.sum()), counts[closed]),
+        )
+        geometries[closed] = shapely.orient_polygons(
+            shapely.polygons(rings), exterior_cw=True
+        )
+
+    return geometries
+
+
+def _is_missing(value: Any) -> bool:
+    return value is None or (isinstance(value, float) and value != value)
+
+
+class RowView(Mapping):
+    """A read-only view on one row of an Overpass data frame.
+
+    Values are read lazily, by position, from column arrays shared by all the
+    rows of a frame. Only values which are present (i.e. tags which are not
+    NaN) are exposed as keys, together with the `_parent` Overpass object.
+    """
+
+    __slots__ = ("_parent", "columns", "position")
+
+    def __init__(
+        self, parent: Any, columns: Dict[str, np.ndarray], position: int
+    ) -> None:
+        self._parent = parent
+        self.columns = columns
+        self.position = position
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "_parent":
+            return self._parent
+        value = self.columns[key][self.position]
+        if _is_missing(value):
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        yield "_parent"
+        for key, column in self.columns.items():
+            if not _is_missing(column[self.position]):
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def __reduce__(self):
+        # Do not pickle the full columns for a single row
+        return dict, (dict(self),)
+
+
+def _to_shape(json: GeoJSONType) -> BaseGeometry:
+    geometry = json.get("geometry", None)
+    if isinstance(geometry, BaseGeometry):
+        return geometry
+    if geometry is None and "longitude" in json:  # nodes from `out geom`
+        return Point(json["longitude"], json["latitude"])
+    return shape(geometry)
+
+
+class ElementRegistry:
+    """Registry of the NodeWayRelation instances built by one Overpass object.
+
+    Instances are weakly referenced, so that they are freed together with
+    the elements which use them. The `maxsize` most recently used instances
+    are also kept alive, so that relations are not assembled again when
+    accessed several times in a row.
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self.instances: weakref.WeakValueDictionary[
+            Tuple[str, int], NodeWayRelation
+        ] = weakref.WeakValueDictionary()
+        self.recent: OrderedDict[Tuple[str, int], NodeWayRelation] = (
+            OrderedDict()
+        )
+
+    def get(self, key: Tuple[str, int]) -> Optional["NodeWayRelation"]:
+        instance = self.instances.get(key, None)
+        if instance is not None:
+            self.keep(key, instance)
+        return instance
+
+    def add(self, key: Tuple[str, int], instance: "NodeWayRelation") -> None:
+        self.instances[key] = instance
+        self.keep(key, instance)
+
+    def keep(self, key: Tuple[str, int], instance: "NodeWayRelation") -> None:
+        if self.maxsize <= 0:
+            return
+        self.recent[key] = instance
+        self.recent.move_to_end(key)
+        while len(self.recent) > self.maxsize:
+            self.recent.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.instances)
+
+
 T = TypeVar("T", bound="NodeWayRelation")
 
 
@@ -44,21 +190,19 @@ class NodeWayRelation(GeoObject, HBoxMixin, HTMLTitleMixin, HTMLAttrMixin):
     - Representation for such objects in implemented with usual mixins.
     - Default simplification is available as well.
 
+    Instances are shared through the ElementRegistry of their parent
+    Overpass object.
+
     """
 
     shape = OrientedShape()
     subclasses: ClassVar[Dict[str, Any]] = dict()
-    instances: ClassVar[Dict[int, "NodeWayRelation"]] = dict()
 
     def __new__(cls, json: Optional[GeoJSONType] = None):
         if json is None:
             return super().__new__(cls)
 
-        # Singleton instances
-        id_ = json["id_"]
-        if id_ in NodeWayRelation.instances.keys():
-            return NodeWayRelation.instances[id_]
-        # Otherwise dispatch on subclasses
+        # Dispatch on subclasses
         type_ = NodeWayRelation.subclasses[json["type_"]]
         if cls in NodeWayRelation.subclasses.values():
             return super().__new__(cls)
@@ -126,24 +270,15 @@ class NodeWayRelation(GeoObject, HBoxMixin, HTMLTitleMixin, HTMLAttrMixin):
         bounds: Union[None, Tuple[float, float, float, float]] = None,
     ) -> T:
         if bounds is None:
-            bounds = self.parent.bounds
-
-        proj = Proj(
-            proj="aea",  # equivalent projection
-            lat_1=bounds[1],
-            lat_2=bounds[3],
-            lat_0=(bounds[1] + bounds[3]) / 2,
-            lon_0=(bounds[0] + bounds[2]) / 2,
-        )
+            bounds = self.json["_parent"].bounds
 
-        forward = Transformer.from_proj(Proj("EPSG:4326"), proj, always_xy=True)
-        backward = Transformer.from_proj(
-            proj, Proj("EPSG:4326"), always_xy=True
-        )
+        projection = transformer_cache.equal_area(bounds)
         new = type(self)(self.json)
         new.shape = transform(
-            backward.transform,
-            transform(forward.transform, self.shape).simplify(resolution),
+            projection.backward.transform,
+            transform(projection.forward.transform, self.shape).simplify(
+                resolution
+            ),
         )
         return new
 
@@ -153,7 +288,7 @@ class Node(NodeWayRelation):
 
     def __init__(self, json: GeoJSONType):
         super().__init__(json)
-        self.shape = shape(self.json["geometry"])
+        self.shape = _to_shape(self.json)
 
 
 class Way(NodeWayRelation):
@@ -161,7 +296,7 @@ class Way(NodeWayRelation):
 
     def __init__(self, json: GeoJSONType):
         super().__init__(json)
-        self.shape = shape(self.json["geometry"])
+        self.shape = _to_shape(self.json)
 
 
 class Relation(NodeWayRelation):
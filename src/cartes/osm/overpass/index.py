@@ -0,0 +1,138 @@
+"""Index of the filters and extents of cached Overpass queries.
+
+Cache files are keyed by the query string: the same filters on a smaller
+bounding box (or area) are a different entry. The index records, for each
+query built with `Overpass.request(**kwargs)`, a signature of its filters
+(the query without its bounds and area) and its extent, so that a query
+contained in a cached one may be answered by clipping the cached results.
+
+Only queries whose results can be clipped are indexed: results with
+geometries (`geometry=True`, `out="json"`), no `around` filter nor pivot,
+and an extent that is known without a request, i.e. bounds, a Nominatim
+polygon as area, both (their intersection) or none (the whole world).
+
+The index is a SQLite database (.queries.sqlite, hidden from the cache
+manager) in the cache directory of `json_request`. Entries of evicted
+responses are removed when they are found missing.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import shapely
+from shapely.geometry.base import BaseGeometry
+
+from ...utils.cache import CacheFunction
+from ..nominatim import Nominatim
+from .query import Query
+
+_log = logging.getLogger(__name__)
+
+
+class QueryIndex:
+    filename = ".queries.sqlite"
+
+    def __init__(self, function: CacheFunction) -> None:
+        self.function = function
+        self.local = threading.local()
+
+    @property
+    def database(self) -> Path:
+        return Path(self.function.cache_dir) / self.filename
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # the cache directory may change, e.g. in tests
+        key = os.getpid(), self.database
+        if getattr(self.local, "key", None) != key:
+            self.database.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(
+                self.database, timeout=60, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS queries ("
+                "query TEXT PRIMARY KEY, signature TEXT NOT NULL, "
+                "west REAL, south REAL, east REAL, north REAL, "
+                "area REAL, extent BLOB NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS signatures ON queries (signature)"
+            )
+            self.local.connection = connection
+            self.local.key = key
+        return self.local.connection
+
+    @staticmethod
+    def describe(query: Query) -> Optional[Tuple[str, BaseGeometry]]:
+        """The signature and extent of a query, None if not indexable."""
+        # centers of elements crossing the extent may be out of it
+        if query.geometry not in [True, "geom"] or query.out != "json":
+            return None
+        for statement in query.filters():
+            for filters in statement.values():
+                if "around" in filters or list(filters) == ["area"]:
+                    return None
+
+        extent: BaseGeometry = shapely.box(-180, -90, 180, 90)
+        area, bounds = query.extent()
+        if area is not None:
+            if not isinstance(area, Nominatim):
+                return None
+            if area.shape.geom_type not in ["Polygon", "MultiPolygon"]:
+                return None
+            extent = area.shape
+        if bounds is not None:
+            extent = extent.intersection(shapely.box(*bounds))
+
+        unbounded = query.copy()
+        unbounded.area = unbounded.bounds = None
+        signature = re.sub(r"\[timeout:\d+\]", "", unbounded.generate())
+        return signature, extent
+
+    def record(self, query: str, signature: str, extent: BaseGeometry) -> None:
+        west, south, east, north = extent.bounds
+        self.connection.execute(
+            "INSERT OR IGNORE INTO queries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                query,
+                signature,
+                west,
+                south,
+                east,
+                north,
+                extent.area,
+                shapely.to_wkb(extent),
+            ),
+        )
+
+    def candidates(
+        self, query: str, signature: str, extent: BaseGeometry
+    ) -> List[str]:
+        """Indexed queries with the same filters covering extent.
+
+        The smallest ones come first, as they need the least clipping.
+        """
+        west, south, east, north = extent.bounds
+        rows = self.connection.execute(
+            "SELECT query, extent FROM queries WHERE signature = ? "
+            "AND query != ? AND west <= ? AND south <= ? "
+            "AND east >= ? AND north >= ? ORDER BY area",
+            (signature, query, west, south, east, north),
+        ).fetchall()
+        return [
+            candidate
+            for candidate, wkb in rows
+            if shapely.from_wkb(wkb).covers(extent)
+        ]
+
+    def remove(self, query: str) -> None:
+        _log.info(f"Removing {query} from {self.database}")
+        self.connection.execute("DELETE FROM queries WHERE query = ?", (query,))
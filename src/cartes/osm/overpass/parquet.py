@@ -0,0 +1,111 @@
+"""GeoParquet cache of parsed Overpass results.
+
+The parsed data frame is stored next to the cached JSON response, with the
+same name and a .parquet suffix. The non-element fields of the response
+(version, osm3s, remark, etc.) and a version stamp of the parser are stored
+in the metadata of the file.
+
+This cache is only used if pyarrow is installed, e.g. with the parquet extra
+(`pip install cartes[parquet]`).
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional, Set, Tuple
+
+import geopandas as gpd
+
+from ...utils.cache_manager import temporary_file
+
+_log = logging.getLogger(__name__)
+
+METADATA_KEY = b"cartes"
+
+# parsed cache files which could not be written, not attempted again
+unwritable: Set[Path] = set()
+
+
+def parquet_file(cache_file: Path) -> Path:
+    return cache_file.with_suffix(".parquet")
+
+
+def read_parquet(
+    cache_file: Path, stamp: str
+) -> Optional[Tuple[gpd.GeoDataFrame, Dict[str, Any]]]:
+    """Returns the data frame and the header parsed from cache_file.
+
+    Returns None if the parsed file does not exist, is older than the JSON
+    response or was written by another version of the parser.
+    """
+    path = parquet_file(cache_file)
+    try:
+        if path.stat().st_mtime < cache_file.stat().st_mtime:
+            return None
+        import pyarrow.parquet as pq
+    except (FileNotFoundError, ImportError):
+        return None
+
+    try:
+        table = pq.read_table(path)
+        metadata = json.loads(table.schema.metadata[METADATA_KEY])
+        if metadata["stamp"] != stamp:
+            _log.info(f"Ignoring {path} written by parser {metadata['stamp']}")
+            return None
+        data = gpd.GeoDataFrame.from_arrow(table)
+    except Exception as e:
+        _log.warning(f"Ignoring {path}: {e}")
+        return None
+
+    _log.info(f"Reading parsed cache file {path}")
+    return data, metadata["header"]
+
+
+def writable(cache_file: Path) -> bool:
+    """True if the data frame parsed from cache_file may be written."""
+    if not cache_file.exists() or parquet_file(cache_file) in unwritable:
+        return False
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_parquet(
+    cache_file: Path,
+    data: gpd.GeoDataFrame,
+    header: Dict[str, Any],
+    stamp: str,
+) -> None:
+    """Writes the data frame and the header parsed from cache_file.
+
+    Files which could not be written (e.g. columns mixing several types)
+    are not attempted again.
+    """
+    # e.g. only nodes: fast enough to parse again
+    if not writable(cache_file) or not isinstance(data, gpd.GeoDataFrame):
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = parquet_file(cache_file)
+    try:
+        table = pa.table(data.to_arrow(index=False))
+        metadata = json.dumps(dict(stamp=stamp, header=header))
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), METADATA_KEY: metadata}
+        )
+        partial_file = temporary_file(path)
+        try:
+            pq.write_table(table, partial_file)
+            partial_file.replace(path)
+        finally:  # unless renamed
+            partial_file.unlink(missing_ok=True)
+    except Exception as e:
+        _log.warning(f"Could not write {path}: {e}")
+        unwritable.add(path)
+        return
+    _log.info(f"Writing parsed cache file {path}")
@@ -1,13 +1,23 @@
+import copy
 import logging
+import math
 import re
 from abc import ABC, abstractmethod
 from numbers import Real
-from typing import Any, Dict, List, Mapping, Optional, Union
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
 
 from .. import Nominatim
 
 QueryType = Union[bool, int, str, List, Mapping[str, Any]]
 
+# geometry=True is "out geom", geometry=False "out" (body); lighter modes:
+# - center: tags and a representative point (the center of the bounds);
+# - tags: tags only;
+# - ids: types and ids only;
+# - skel qt: coordinates of nodes, nodes of ways and members of relations,
+#   without tags, sorted by location rather than by id.
+OUT_MODES = ["geom", "center", "tags", "ids", "skel qt"]
+
 _log = logging.getLogger(__name__)
 
 
@@ -142,8 +152,8 @@ class NodeWayRel(Generator):
     def generate(self, value, obj, geom: bool = True) -> str:
         return "".join(self.generate_single(elt, obj, geom) for elt in value)
 
-    def generate_single(self, elt, obj, geom: bool) -> str:
-        geom_str = " geom" if geom else ""
+    def generate_single(self, elt, obj, geom: Union[bool, str]) -> str:
+        geom_str = " geom" if geom is True else f" {geom}" if geom else ""
         for res, elt in elt.items():
             break
         # Particular situation of pivot relations
@@ -198,9 +208,12 @@ class Query:
         *,
         out: str = "json",
         timeout: int = 180,
-        geometry: bool = True,
+        geometry: Union[bool, str] = True,
         **kwargs: QueryType,
     ) -> None:
+        if not isinstance(geometry, bool) and geometry not in OUT_MODES:
+            msg = f"geometry must be a boolean or one of {OUT_MODES}"
+            raise ValueError(msg)
         self.out = out
         self.timeout = timeout
         self.geometry = geometry
@@ -227,12 +240,214 @@ class Query:
 
         self.nwr = nwr + node + way + rel
 
-    def generate(self) -> str:
-        res = (
+    def copy(self) -> "Query":
+        """A copy of the query: generating a query consumes some filters."""
+        query = copy.copy(self)
+        query._nwr = copy.deepcopy(self._nwr)  # type: ignore
+        if isinstance(self._area, dict):  # type: ignore
+            query._area = dict(self._area)  # type: ignore
+        return query
+
+    def filters(self) -> List[Dict[str, Any]]:
+        """The statements of the query, without its area and bounds.
+
+        Each statement maps an element type (node, way, rel or nwr) to its
+        filters. The statements are copied, as generating a query consumes
+        some filters.
+        """
+        return copy.deepcopy(getattr(self, "_nwr", []))
+
+    def extent(self) -> Tuple[Any, Optional["BoundsType"]]:
+        """The area (a dictionary or a Nominatim) and the bounds of the query.
+
+        Each of them is None if the query is not restricted by it.
+        """
+        return getattr(self, "_area", None), getattr(self, "_bounds", None)
+
+    def settings(self) -> str:
+        return (
             f"[out:{self.out}][timeout:{self.timeout}]"
             + (f"[date:'{self.date}']" if self.date is not None else "")
             + f"{self.bounds};"
         )
+
+    def generate(self) -> str:
+        res = self.settings()
         res += f"{self.area}"
         res += f"{self.nwr}"
         return res
+
+
+class QueryBatch:
+    """Several queries sent as one Overpass program.
+
+    Queries must share their settings (output format, date and bounds);
+    the timeout of the program is the largest one. Areas are resolved once,
+    in named sets. The statements of each query follow a marker element
+    (`make batch`), so that the response can be split back with `split`.
+
+    >>> batch = QueryBatch([
+    ...     Query(area=dict(icao="LFBO"), aeroway="runway"),
+    ...     Query(area=dict(icao="LFBO"), aeroway="taxiway"),
+    ... ])
+    >>> print(batch.generate().replace(";", ";\\n"))
+    [out:json][timeout:180];
+    area[icao=LFBO]->.area0;
+    make batch index=0;
+    out;
+    nwr(area.area0)[aeroway=runway];
+    out geom;
+    make batch index=1;
+    out;
+    nwr(area.area0)[aeroway=taxiway];
+    out geom;
+    <BLANKLINE>
+
+    """
+
+    marker = "batch"
+
+    def __init__(self, queries: Sequence[Query]) -> None:
+        if len(queries) == 0:
+            raise ValueError("At least one query is needed")
+        # standalone queries, i.e. the cache keys of each part
+        self.queries = [query.copy().generate() for query in queries]
+        self.timeout = max(query.timeout for query in queries)
+        settings = set()
+        for query in queries:
+            query = query.copy()
+            query.timeout = self.timeout
+            settings.add((query.settings(), query.geometry))
+        if len(settings) > 1:
+            msg = "Queries of a batch must share out, date, bounds and geometry"
+            raise ValueError(msg)
+        self.header = settings.pop()[0]
+
+        self.areas: Dict[str, str] = dict()  # area statement -> set name
+        self.bodies: List[str] = list()
+        for query in queries:
+            area, body = query.copy().area, query.copy().nwr
+            if area == "":
+                self.bodies.append(body)
+                continue
+            named = re.search(r"->\.(\w+);$", area)
+            if named is not None:  # the statements name their area
+                self.areas.setdefault(area, named.group(1))
+                self.bodies.append(body)
+                continue
+            name = self.areas.setdefault(area, f"area{len(self.areas)}")
+            for default in ["(area)", "(pivot)"]:
+                body = body.replace(default, f"{default[:-1]}.{name})")
+            self.bodies.append(body)
+
+    def generate(self) -> str:
+        res = self.header
+        for area, name in self.areas.items():
+            res += (
+                area
+                if area.endswith(f"->.{name};")
+                else f"{area[:-1]}->.{name};"
+            )
+        for i, body in enumerate(self.bodies):
+            res += f"make {self.marker} index={i};out;{body}"
+        return res
+
+    def split(self, json: Mapping[str, Any]) -> List[Optional[Dict[str, Any]]]:
+        """Splits the response of the program into one per query.
+
+        The elements of a query are the ones following its marker: a query
+        with no results gets an explicit empty list of elements, but a query
+        whose marker is missing (e.g. an interrupted program) gets None.
+        """
+        header = dict(
+            (key, value) for key, value in json.items() if key != "elements"
+        )
+        parts: Dict[int, List[Any]] = dict()
+        current: Optional[List[Any]] = None
+        for elt in json["elements"]:
+            if elt["type"] == self.marker:
+                current = parts.setdefault(int(elt["tags"]["index"]), list())
+            elif current is not None:
+                current.append(elt)
+        return [
+            dict(header, elements=parts[i]) if i in parts else None
+            for i in range(len(self.bodies))
+        ]
+
+
+BBOX = re.compile(r"\[bbox:([^\]]+)\]")
+
+BoundsType = Tuple[float, float, float, float]
+
+
+def query_bounds(query: str) -> BoundsType:
+    """The global bounding box (west, south, east, north) of a query."""
+    match = BBOX.search(query)
+    if match is None:
+        msg = "Only queries with a global bounding box [bbox:...] can be split"
+        raise ValueError(msg)
+    south, west, north, east = (float(x) for x in match.group(1).split(","))
+    return west, south, east, north
+
+
+def with_bounds(query: str, bounds: BoundsType) -> str:
+    """Replaces the global bounding box of a query."""
+    west, south, east, north = (round(x, 7) for x in bounds)
+    return BBOX.sub(f"[bbox:{south},{west},{north},{east}]", query, count=1)
+
+
+def split_bounds(bounds: BoundsType, nx: int, ny: int) -> List[BoundsType]:
+    """Splits bounds into a grid of nx (longitude) by ny (latitude) tiles."""
+    west, south, east, north = bounds
+    lon = [west + (east - west) * i / nx for i in range(nx + 1)]
+    lat = [south + (north - south) * j / ny for j in range(ny + 1)]
+    return [
+        (lon[i], lat[j], lon[i + 1], lat[j + 1])
+        for j in range(ny)
+        for i in range(nx)
+    ]
+
+
+def grid_bounds(bounds: BoundsType, size: float) -> List[BoundsType]:
+    """Cells of the global grid of the given size (in degrees) covering bounds.
+
+    As cells do not depend on bounds, overlapping queries share them.
+
+    >>> grid_bounds((1.2, 43.6, 1.8, 43.9), 0.5)
+    [(1.0, 43.5, 1.5, 44.0), (1.5, 43.5, 2.0, 44.0)]
+
+    """
+    west, south, east, north = bounds
+    columns = range(math.floor(west / size), math.ceil(east / size))
+    rows = range(math.floor(south / size), math.ceil(north / size))
+    return [
+        tuple(round(x * size, 7) for x in (i, j, i + 1, j + 1))  # type: ignore
+        for j in rows
+        for i in columns
+    ]
+
+
+def tile_bounds(
+    bounds: BoundsType, size: float, max_tiles: int
+) -> List[BoundsType]:
+    """At most max_tiles tiles of a global grid, clipped to bounds.
+
+    The grid is of the given size (in degrees), doubled until bounds are
+    covered by at most max_tiles cells.
+
+    >>> tile_bounds((1.2, 43.6, 1.8, 43.9), 0.5, 16)
+    [(1.2, 43.6, 1.5, 43.9), (1.5, 43.6, 1.8, 43.9)]
+    >>> tiles = tile_bounds((-5.2, 42.3, 8.3, 51.1), 1.0, 16)
+    >>> len(tiles), tiles[0]
+    (15, (-5.2, 42.3, -4.0, 44.0))
+
+    """
+    cells = grid_bounds(bounds, size)
+    while len(cells) > max_tiles:
+        size *= 2
+        cells = grid_bounds(bounds, size)
+    west, south, east, north = bounds
+    return [
+        (max(w, west), max(s, south), min(e, east), min(n, north))
+        for w, s, e, n in cells
+    ]
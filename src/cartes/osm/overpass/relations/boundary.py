@@ -1,9 +1,9 @@
+import copy
 import itertools
 from collections import UserDict
 from operator import itemgetter
 from typing import Dict, Iterator, List, Set, Tuple, TypeVar, Union, cast
 
-from pyproj import Proj, Transformer
 from shapely.geometry import MultiLineString, MultiPolygon, Polygon
 from shapely.geometry.base import BaseGeometry
 from shapely.geometry.collection import GeometryCollection
@@ -11,6 +11,7 @@ from shapely.ops import polygonize, transform, unary_union
 
 from ....utils.cache import cached_property
 from ....utils.geometry import reorient
+from ....utils.projections import transformer_cache
 from .. import Overpass
 from ..core import Relation
 
@@ -79,26 +80,14 @@ class Boundary(Relation):
     ) -> T:
         if bounds is None:
             bounds = self.parent.bounds
-        b0, b1, b2, b3 = bounds
+        projection = transformer_cache.equal_area(bounds)
 
         def simplify_shape(shape_: BaseGeometry) -> BaseGeometry:
-            proj = Proj(
-                proj="aea",  # equivalent projection
-                lat_1=b1,
-                lat_2=b3,
-                lat_0=(b1 + b3) / 2,
-                lon_0=(b0 + b2) / 2,
-            )
-
-            forward = Transformer.from_proj(
-                Proj("EPSG:4326"), proj, always_xy=True
-            )
-            backward = Transformer.from_proj(
-                proj, Proj("EPSG:4326"), always_xy=True
-            )
             return transform(
-                backward.transform,
-                transform(forward.transform, shape_).simplify(resolution),
+                projection.backward.transform,
+                transform(projection.forward.transform, shape_).simplify(
+                    resolution
+                ),
             )
 
         rel_dict = RelationsDict()
@@ -106,8 +95,11 @@ class Boundary(Relation):
             for elt in shapes:
                 rel_dict.include(simplify_shape(elt), role)
 
-        self._make_geometry(rel_dict)
-        return self
+        # do not alter the instance shared by the parent
+        new = copy.copy(self)
+        new.json = dict(self.json)
+        new._make_geometry(rel_dict)
+        return new
 
     def _make_geometry(self, parts: RelationsDict):
         outer: List[Polygon] = list(polygonize((unary_union(parts["outer"]))))
@@ -130,18 +122,7 @@ class Boundary(Relation):
         self.json["geometry"] = self.shape
 
     def intersections(self) -> Iterator[Tuple[int, Set[int]]]:
-        all_sets: Dict[int, Set[int]] = dict(
-            (key, set(e["ref"] for e in list_))
-            for key, list_ in self.parent.all_members.items()
-        )
-        key_i = self.json["id_"]
-        set_i = all_sets[key_i]
-        for key_j, set_j in all_sets.items():
-            if key_i == key_j:
-                continue
-            intersection = set_i.intersection(set_j)
-            if len(intersection) > 0:
-                yield key_j, intersection
+        yield from self.parent.shared_members(self.json["id_"]).items()
 
     @cached_property
     def neighbours(self) -> Set[int]:
@@ -0,0 +1,238 @@
+"""Retries of rate limited (429) and timed out (504) requests.
+
+Overpass instances publish the state of the slots of each client at
+/api/status: after a 429, the request is sent again as soon as a slot is
+free. Otherwise, requests are sent again after an exponential backoff with
+(full) jitter, within a budget of retries and a deadline for each request.
+
+>>> status = parse_status('''Connected as: 1234
+... Current time: 2024-05-01T10:00:00Z
+... Rate limit: 2
+... Slot available after: 2024-05-01T10:00:04Z, in 4 seconds.
+... Slot available after: 2024-05-01T10:00:09Z, in 9 seconds.
+... Currently running queries (pid, space limit, time limit, start time):
+... ''')
+>>> status
+SlotStatus(rate_limit=2, available=0, waits=[4.0, 9.0])
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+from typing import Awaitable, Callable, List, NamedTuple, Optional
+
+import httpx
+
+_log = logging.getLogger(__name__)
+
+
+class SlotStatus(NamedTuple):
+    rate_limit: int
+    available: int
+    # seconds until each busy slot is freed, in increasing order
+    waits: List[float]
+
+
+def parse_status(text: str) -> SlotStatus:
+    """Parses the slot information of an Overpass /api/status page."""
+    rate_limit = re.search(r"Rate limit: (\d+)", text)
+    available = re.search(r"(\d+) slots? available now", text)
+    waits = re.findall(r"Slot available after: \S+, in (-?\d+) seconds?", text)
+    return SlotStatus(
+        int(rate_limit.group(1)) if rate_limit else 0,
+        int(available.group(1)) if available else 0,
+        sorted(max(float(elt), 0) for elt in waits),
+    )
+
+
+def status_url(url: httpx.URL) -> Optional[httpx.URL]:
+    """The status page of an Overpass interpreter endpoint."""
+    if not url.path.endswith("/interpreter"):
+        return None
+    return url.copy_with(path=url.path[: -len("interpreter")] + "status")
+
+
+class RateLimitInfo(NamedTuple):
+    retries: int
+    gave_up: int
+    # seconds spent waiting for a slot (429) and backing off (504, etc.)
+    slot_wait: float
+    backoff_wait: float
+
+
+class RateLimiter:
+    """Decides whether, and when, to send a failed request again.
+
+    - max_retries is the budget of retries of each request;
+    - deadline (in seconds) bounds the time spent on a request, retries
+      included;
+    - the backoff before the n-th retry is drawn uniformly between 0 and
+      min(max_delay, base_delay * 2**n).
+
+    Time spent waiting is available with `info()`.
+    """
+
+    retry_status = frozenset({429, 502, 503, 504})
+
+    def __init__(
+        self,
+        max_retries: int = 6,
+        deadline: float = 900,
+        base_delay: float = 2,
+        max_delay: float = 120,
+    ) -> None:
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep: Callable[[float], None] = time.sleep
+        self.async_sleep: Callable[[float], Awaitable[None]] = asyncio.sleep
+        self.lock = threading.Lock()
+        self.retries = self.gave_up = 0
+        self.slot_wait = self.backoff_wait = 0.0
+
+    def info(self) -> RateLimitInfo:
+        return RateLimitInfo(
+            self.retries, self.gave_up, self.slot_wait, self.backoff_wait
+        )
+
+    def clear(self) -> None:
+        with self.lock:
+            self.retries = self.gave_up = 0
+            self.slot_wait = self.backoff_wait = 0.0
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2**attempt)
+        )
+
+    def status_page(self, response: httpx.Response) -> Optional[httpx.URL]:
+        """The status page to read before sending a request again, if any."""
+        if response.status_code != 429 or "Retry-After" in response.headers:
+            return None
+        return status_url(response.request.url)
+
+    def slot_delay(
+        self, response: httpx.Response, status: Optional[str]
+    ) -> Optional[float]:
+        """Seconds until a slot is free, if the server tells."""
+        retry_after = response.headers.get("Retry-After", None)
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+        if status is None:
+            return None
+        slots = parse_status(status)
+        _log.info(f"Status at {response.request.url}: {slots}")
+        if slots.available > 0 or len(slots.waits) == 0:
+            return None
+        return slots.waits[0]
+
+    def delay(
+        self,
+        response: httpx.Response,
+        attempt: int,
+        start: float,
+        status: Optional[str] = None,
+    ) -> Optional[float]:
+        """Seconds to wait before the next attempt, None to give up.
+
+        - attempt counts the retries already made;
+        - start is the (monotonic) time of the first attempt;
+        - status is the content of the status page, if read.
+        """
+        if response.status_code not in self.retry_status:
+            return None
+
+        delay = None
+        if response.status_code == 429:
+            delay = self.slot_delay(response, status)
+        from_status = delay is not None
+        if delay is None:
+            delay = self.backoff(attempt)
+
+        elapsed = time.monotonic() - start
+        if attempt >= self.max_retries or elapsed + delay > self.deadline:
+            msg = f"Giving up on {response.request.url} after {attempt} retries"
+            _log.warning(f"{msg} and {elapsed:.0f} seconds")
+            with self.lock:
+                self.gave_up += 1
+            return None
+
+        msg = f"Got status code {response.status_code}"
+        _log.warning(f"{msg}. Trying again in {delay:.1f} seconds...")
+        with self.lock:
+            self.retries += 1
+            if from_status:
+                self.slot_wait += delay
+            else:
+                self.backoff_wait += delay
+        return delay
+
+    def wait(
+        self,
+        response: httpx.Response,
+        attempt: int,
+        start: float,
+        client: httpx.Client,
+    ) -> bool:
+        """Waits before the next attempt. False if the request should fail."""
+        status = None
+        url = self.status_page(response)
+        if url is not None:
+            try:
+                page = client.get(url, timeout=10)
+                status = page.raise_for_status().text
+            except httpx.HTTPError as e:
+                _log.warning(f"Could not get the status at {url}: {e}")
+        delay = self.delay(response, attempt, start, status)
+        if delay is None:
+            return False
+        self.sleep(delay)
+        return True
+
+    async def async_wait(
+        self,
+        response: httpx.Response,
+        attempt: int,
+        start: float,
+        client: httpx.AsyncClient,
+    ) -> bool:
+        """Asynchronous counterpart of wait."""
+        status = None
+        url = self.status_page(response)
+        if url is not None:
+            try:
+                page = await client.get(url, timeout=10)
+                status = page.raise_for_status().text
+            except httpx.HTTPError as e:
+                _log.warning(f"Could not get the status at {url}: {e}")
+        delay = self.delay(response, attempt, start, status)
+        if delay is None:
+            return False
+        await self.async_sleep(delay)
+        return True
+
+
+async def rate_limit(client: httpx.AsyncClient, url: str) -> Optional[int]:
+    """The number of slots of an Overpass instance, None if unknown.
+
+    Private instances usually have no rate limit (0).
+    """
+    status = status_url(httpx.URL(url))
+    if status is None:
+        return None
+    try:
+        page = await client.get(status, timeout=10)
+        return parse_status(page.raise_for_status().text).rate_limit
+    except httpx.HTTPError as e:
+        _log.warning(f"Could not get the status at {status}: {e}")
+        return None
+
+
+rate_limiter = RateLimiter()
@@ -1,18 +1,39 @@
+import codecs
+import gzip
 import hashlib
+import itertools
 import json
 import logging
 import os
 import time
+from functools import partial
 from pathlib import Path
-from typing import Any, Literal, Optional
+from typing import (
+    Any,
+    AsyncContextManager,
+    BinaryIO,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    Literal,
+    Optional,
+    Set,
+    Union,
+)
 
 import httpx
 from appdirs import user_cache_dir
 
-from ..utils.cache import CacheResults
+from ..utils.cache import CacheFunction, CacheResults
+from ..utils.cache_manager import cache_manager, temporary_file
+from .endpoints import EndpointPool
+from .ratelimit import rate_limiter
 
 JSONType = Any
 GeoJSONType = Any
+# Only requests with data (Overpass queries) may be sent to a pool
+URLType = Union[str, EndpointPool]
 
 DEFAULT_HEADERS = {
     # overpass-api.de rejects stock/faked browser User-Agents with HTTP 406.
@@ -27,6 +48,17 @@ client = httpx.Client(follow_redirects=True, http2=True)
 _log = logging.getLogger(__name__)
 
 
+def _stream(
+    url: URLType, method: str, **kwargs
+) -> ContextManager[httpx.Response]:
+    """Streams the response from a URL, or from a pool of endpoints."""
+    if isinstance(url, EndpointPool):
+        return url.stream(method=method, headers=DEFAULT_HEADERS, **kwargs)
+    return client.stream(
+        method=method, url=url, headers=DEFAULT_HEADERS, **kwargs
+    )
+
+
 def _hash_request(*args, **kwargs) -> str:
     kwargs.pop("timeout", None)
     kwargs.pop("method", None)
@@ -40,14 +72,50 @@ def _hash_request(*args, **kwargs) -> str:
     return hashcode + ".json"
 
 
-def _write_json(json_: JSONType, cache_file) -> None:  # coverage: ignore
+# Cache files are gzip compressed raw response bodies. Former cache files
+# (plain JSON) are recognised as they do not start with the gzip magic number.
+GZIP_MAGIC = b"\x1f\x8b"
+COMPRESSLEVEL = 6
+
+
+def _open_cache(cache_file: Path) -> BinaryIO:
+    fh = cache_file.open("rb")
+    if fh.read(2) == GZIP_MAGIC:
+        fh.seek(0)
+        return gzip.GzipFile(fileobj=fh, mode="rb")  # type: ignore
+    fh.seek(0)
+    return fh
+
+
+def _write_raw(chunks: Iterable[bytes], cache_file: Path) -> Iterator[bytes]:
+    """Compresses chunks of a response body to cache_file as they pass by."""
+    with gzip.open(cache_file, "wb", compresslevel=COMPRESSLEVEL) as fh:
+        for chunk in chunks:
+            fh.write(chunk)
+            yield chunk
+
+
+def _dumps_json(json_: JSONType) -> bytes:
+    return gzip.compress(
+        json.dumps(json_).encode(), compresslevel=COMPRESSLEVEL
+    )
+
+
+def _write_json(json_: JSONType, cache_file: Path) -> None:  # coverage: ignore
     _log.info(f"Writing cache file {cache_file}")
-    cache_file.write_text(json.dumps(json_, indent=2))
+    cache_file.write_bytes(_dumps_json(json_))
 
 
 def _read_json(cache_file: Path) -> Optional[JSONType]:
     _log.info(f"Reading cache file {cache_file}")
-    json_ = json.loads(cache_file.read_text())
+    with _open_cache(cache_file) as fh:
+        return _loads_json(fh.read())
+
+
+def _loads_json(content: bytes) -> Optional[JSONType]:
+    if content[:2] == GZIP_MAGIC:
+        content = gzip.decompress(content)
+    json_ = json.loads(content)
 
     if isinstance(json_, list):
         return json_
@@ -64,6 +132,115 @@ def _read_json(cache_file: Path) -> Optional[JSONType]:
     return json_
 
 
+def _request(
+    function: CacheFunction[JSONType],
+    url: URLType,
+    timeout: int = 180,
+    method: Literal["POST", "GET"] = "POST",
+    **kwargs,
+) -> JSONType:
+    """
+    Sends a request and returns the JSON response.
+
+    If the entries of the cached function are files, the raw body of the
+    response is written, compressed, to the cache file while it is
+    downloaded. Otherwise, the cached function stores the JSON response.
+
+    The body is then parsed at once with json.loads: decoding it as it is
+    downloaded (with ElementStream) takes about twice as long, and only
+    bounds memory if elements are not all kept (see `json_stream`, used by
+    `Overpass.request(stream=True)`). See benchmarks/response_cache.py.
+
+    Failed requests are sent again as decided by the `rate_limiter`.
+    """
+    _log.info(f"Sending {method} request to {url} with {kwargs}")
+
+    new_kwargs = kwargs.copy()
+    if "data" in new_kwargs and isinstance(new_kwargs["data"], str):
+        new_kwargs["data"] = new_kwargs["data"].encode("utf-8")
+
+    cache_file = function.cache_file(url, **kwargs)
+    partial_file = None if cache_file is None else temporary_file(cache_file)
+    content = b""
+
+    try:
+        start = time.monotonic()
+        for attempt in itertools.count():
+            remaining = rate_limiter.deadline - (time.monotonic() - start)
+            with _stream(
+                url,
+                method,
+                timeout=min(timeout, max(remaining, 1)),
+                **new_kwargs,
+            ) as response:
+                if response.status_code == 200 and partial_file is not None:
+                    content = b"".join(
+                        _write_raw(response.iter_bytes(), partial_file)
+                    )
+                else:
+                    content = response.read()
+
+            # 429 (too many requests), 504 (gateway timeout), etc.
+            if not rate_limiter.wait(response, attempt, start, client):
+                break
+
+        if response.status_code == 403:  # forbidden for url
+            msg = "Error 403: IP address may be blocked"
+            _log.warning(msg)
+
+        response.raise_for_status()
+
+        try:
+            response_json = json.loads(content)
+        except Exception:
+            msg = f"""Server returned no JSON data.
+            {response} {response.reason_phrase}
+            {content.decode(errors="replace")}"""
+            _log.warning(msg)
+            raise
+
+        if cache_file is not None and partial_file is not None:
+            _log.info(f"Writing cache file {cache_file}")
+            partial_file.replace(cache_file)
+            cache_manager.written(cache_file)
+    finally:  # e.g. an error, or an interrupted download
+        if partial_file is not None:
+            partial_file.unlink(missing_ok=True)
+    return response_json
+
+
+def raw_request(
+    url: URLType,
+    timeout: int = 180,
+    method: Literal["POST", "GET"] = "POST",
+    **kwargs,
+) -> bytes:
+    """
+    Sends a request and returns the raw body of the response, e.g. XML.
+
+    Responses are not cached. Failed requests are sent again as decided by
+    the `rate_limiter`.
+    """
+    _log.info(f"Sending {method} request to {url} with {kwargs}")
+
+    new_kwargs = kwargs.copy()
+    if "data" in new_kwargs and isinstance(new_kwargs["data"], str):
+        new_kwargs["data"] = new_kwargs["data"].encode("utf-8")
+
+    start = time.monotonic()
+    for attempt in itertools.count():
+        remaining = rate_limiter.deadline - (time.monotonic() - start)
+        with _stream(
+            url, method, timeout=min(timeout, max(remaining, 1)), **new_kwargs
+        ) as response:
+            content = response.read()
+        if not rate_limiter.wait(response, attempt, start, client):
+            break
+
+    response.raise_for_status()
+    return content
+
+
 @CacheResults(
     cache_dir=os.environ.get(
         "CARTES_CACHE",
@@ -72,74 +249,349 @@ def _read_json(cache_file: Path) -> Optional[JSONType]:
     hashing=_hash_request,
     reader=_read_json,
     writer=_write_json,
+    dumps=_dumps_json,
+    loads=_loads_json,
 )
 def json_request(
-    url: str,
+    url: URLType,
     timeout: int = 180,
     method: Literal["POST", "GET"] = "POST",
     **kwargs,
 ) -> JSONType:
     """
     Send a request to the Overpass API and return the JSON response.
+
+    The url may be a pool of endpoints (see EndpointPool), with failover.
+    The raw body of the response is written, compressed, to the cache file
+    while it is downloaded.
+    """
+    return _request(json_request, url, timeout=timeout, method=method, **kwargs)
+
+
+@CacheResults(
+    # next to the cache of Overpass requests, see CARTES_CACHE
+    cache_dir=json_request.cache_dir.parent / "nominatim",
+    hashing=_hash_request,
+    reader=_read_json,
+    writer=_write_json,
+    dumps=_dumps_json,
+    loads=_loads_json,
+)
+def nominatim_request(
+    url: str,
+    timeout: int = 30,
+    method: Literal["POST", "GET"] = "GET",
+    **kwargs,
+) -> JSONType:
     """
-    _log.info(f"Sending POST request to {url} with {kwargs}")
+    Send a request to the Nominatim API and return the JSON response.
+
+    Responses are small and numerous: they are stored in a SQLite database
+    by default (see CARTES_CACHE_BACKEND). Responses cached with the
+    Overpass ones by former versions are moved once, on the first request,
+    unless `cartes cache migrate` was run before (see `migrate_nominatim`).
+    """
+    if nominatim_request.cache_dir not in _migrated:
+        migrate_nominatim()
+        migrated = nominatim_request.backend.read(_hash_request(url, **kwargs))
+        if migrated is not None:
+            return migrated
+    return _request(
+        nominatim_request, url, timeout=timeout, method=method, **kwargs
+    )
+
+
+_migrated: Set[Path] = set()
+
+
+def _is_overpass(cache_file: Path) -> bool:
+    """True if a cache file holds an Overpass response.
+
+    Overpass responses start with their "version" field; Nominatim
+    responses are lists, or dictionaries without elements.
+    """
+    with _open_cache(cache_file) as fh:
+        head = fh.read(512).lstrip()
+    if head.startswith(b"["):
+        return False
+    if any(field in head for field in [b'"version"', b'"osm3s"']):
+        return True
+    json_ = _loads_json(cache_file.read_bytes())
+    return not isinstance(json_, dict) or "elements" in json_
+
+
+def migrate_nominatim() -> int:
+    """Moves Nominatim responses cached with the Overpass ones by former
+    versions to the cache of nominatim_request. Returns their number.
+
+    Former versions only wrote flat cache directories: subdirectories (the
+    sharded layout of the `cache_manager`) are not scanned. Cache files are
+    only scanned once: a hidden marker file is then left in the cache
+    directory of nominatim_request.
+    """
+    source, target = json_request.cache_dir, nominatim_request.cache_dir
+    marker = target / ".migrated"
+    count = 0
+    with cache_manager.lock(marker):
+        if source == target or marker.exists() or not source.is_dir():
+            _migrated.add(target)
+            return count
+        with os.scandir(source) as entries:
+            for entry in entries:
+                cache_file = Path(entry.path)
+                if entry.name.startswith(".") or cache_file.suffix != ".json":
+                    continue
+                try:
+                    if not entry.is_file() or _is_overpass(cache_file):
+                        continue
+                    json_ = _read_json(cache_file)
+                except (OSError, ValueError) as exc:
+                    _log.warning(f"Skipping cache file {cache_file}: {exc}")
+                    continue
+                _log.info(f"Moving {cache_file} to {target}")
+                nominatim_request.backend.write(entry.name, json_)
+                cache_file.unlink(missing_ok=True)
+                count += 1
+        marker.touch()
+    _migrated.add(target)
+    return count
+
+
+def _async_stream(
+    client: httpx.AsyncClient, url: URLType, method: str, **kwargs
+) -> AsyncContextManager[httpx.Response]:
+    if isinstance(url, EndpointPool):
+        return url.async_stream(
+            method=method, headers=DEFAULT_HEADERS, **kwargs
+        )
+    return client.stream(
+        method=method, url=url, headers=DEFAULT_HEADERS, **kwargs
+    )
+
+
+async def async_json_request(
+    client: httpx.AsyncClient,
+    url: URLType,
+    timeout: int = 180,
+    method: Literal["POST", "GET"] = "POST",
+    **kwargs,
+) -> JSONType:
+    """
+    Asynchronous counterpart of json_request, sharing its cache.
+
+    Unlike json_request, concurrent calls for the same key are not merged:
+    callers are expected to send distinct requests.
+    """
+    json_ = json_request.cached(url, **kwargs)
+    if json_ is not None:
+        return json_
+    _log.info(f"Sending {method} request to {url} with {kwargs}")
 
     new_kwargs = kwargs.copy()
     if "data" in new_kwargs and isinstance(new_kwargs["data"], str):
         new_kwargs["data"] = new_kwargs["data"].encode("utf-8")
 
-    response = client.request(
-        method=method,
-        url=url,
-        headers=DEFAULT_HEADERS,
-        timeout=timeout,
-        **new_kwargs,
-    )
+    start = time.monotonic()
+    for attempt in itertools.count():
+        remaining = rate_limiter.deadline - (time.monotonic() - start)
+        async with _async_stream(
+            client,
+            url,
+            method,
+            timeout=min(timeout, max(remaining, 1)),
+            **new_kwargs,
+        ) as response:
+            content = await response.aread()
+        if not await rate_limiter.async_wait(response, attempt, start, client):
+            break
 
     if response.status_code == 403:  # forbidden for url
         msg = "Error 403: IP address may be blocked"
         _log.warning(msg)
 
-    if response.status_code == 504:  # gateway timeout
-        msg = f"Got status code {response.status_code}. Trying again soon..."
-        _log.warning(msg)
-        time.sleep(5)
-        return json_request(url, timeout=timeout, **kwargs)
-
-    if response.status_code == 429:  # too many requests
-        status = client.get("https://overpass-api.de/api/status")
-        status.raise_for_status()
-        print(status.content.decode())
-
     response.raise_for_status()
 
-    # b = BytesIO()
-
-    # if kwargs.get("stream", None):
-    #     total_size = int(response.headers.get("content-length", 0))
-    #     _log.info(f"{response.headers}")
-    #     block_size = 1024 * 1024
-    #     pbar = tqdm(total=total_size, unit="B", unit_scale=True)
-    #     for data in response.iter_content(block_size):
-    #         pbar.update(len(data))
-    #         b.write(data)
-    #     b.seek(0)
-    #     pbar.close()
-    #     if total_size != 0 and pbar.n != total_size:
-    #         msg = f"Download not complete: {pbar.n}/{total_size}"
-    #         raise RuntimeError(msg)
-
-    # try:
-    #     if kwargs.get("stream", None):
-    #         response_json = json.loads(b.read().decode())
-    #     else:
     try:
-        response_json = response.json()
+        json_ = json.loads(content)
     except Exception:
         msg = f"""Server returned no JSON data.
         {response} {response.reason_phrase}
-        {response.text}"""
+        {content.decode(errors="replace")}"""
         _log.warning(msg)
         raise
 
-    return response_json
+    json_request.put(json_, url, **kwargs)
+    return json_
+
+
+class ElementStream:
+    """Iterates over the elements of an Overpass JSON response.
+
+    The document is decoded incrementally from an iterable of bytes, so that
+    elements are yielded one by one and the full response is never held in
+    memory. Other top-level fields (version, osm3s, remark, etc.) are
+    collected in the `header` attribute as they are met.
+
+    >>> stream = ElementStream([b'{"version": 0.6, "elem', b'ents": [{"id"',
+    ...     b': 1}, {"id": 2}], "remark": "ok"}'])
+    >>> list(stream)
+    [{'id': 1}, {'id': 2}]
+    >>> stream.header
+    {'version': 0.6, 'remark': 'ok'}
+
+    """
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self.chunks = iter(chunks)
+        self.header: Dict[str, JSONType] = dict()
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+
+    def __iter__(self) -> Iterator[JSONType]:
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == "elements":
+                self._expect("[")
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                self.header[key] = self._value()
+            if self._expect(",}") == "}":
+                # run the source to its end, e.g. to finalise a cache file
+                for _ in self.chunks:
+                    pass
+                return
+
+    def _fill(self, size: int = 0) -> bool:
+        """Reads chunks until at least size characters are available."""
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+        while True:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self._buffer += self._decoder.decode(b"", final=True)
+                return False
+            self._buffer += self._decoder.decode(chunk)
+            if len(self._buffer) > size:
+                return True
+
+    def _peek(self) -> str:
+        while True:
+            while (
+                self._pos < len(self._buffer)
+                and self._buffer[self._pos] in " \t\n\r"
+            ):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                msg = "Unexpected end of data"
+                raise json.JSONDecodeError(msg, self._buffer, self._pos)
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if char not in chars:
+            msg = f"Expecting one of {chars!r}"
+            raise json.JSONDecodeError(msg, self._buffer, self._pos)
+        self._pos += 1
+        return char
+
+    def _value(self) -> JSONType:
+        self._peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(
+                    self._buffer, self._pos
+                )
+                # A value is only known to be complete (think of numbers)
+                # when a delimiter follows it.
+                if end < len(self._buffer):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                pass
+            # Doubling the buffer keeps large elements linear to decode
+            if not self._fill(2 * (len(self._buffer) - self._pos)):
+                value, self._pos = self._json_decoder.raw_decode(
+                    self._buffer, self._pos
+                )
+                return value
+
+
+def _iter_file(cache_file: Path, chunk_size: int = 1 << 20) -> Iterator[bytes]:
+    _log.info(f"Streaming cache file {cache_file}")
+    with _open_cache(cache_file) as fh:
+        yield from iter(partial(fh.read, chunk_size), b"")
+
+
+def _iter_response(
+    cache_file: Path,
+    url: URLType,
+    timeout: int = 180,
+    method: Literal["POST", "GET"] = "POST",
+    **kwargs,
+) -> Iterator[bytes]:
+    _log.info(f"Streaming {method} request to {url} with {kwargs}")
+
+    new_kwargs = kwargs.copy()
+    if "data" in new_kwargs and isinstance(new_kwargs["data"], str):
+        new_kwargs["data"] = new_kwargs["data"].encode("utf-8")
+
+    start = time.monotonic()
+    with _stream(url, method, timeout=timeout, **new_kwargs) as response:
+        if response.status_code == 200:
+            # The cache file only appears once the download is complete
+            partial_file = temporary_file(cache_file)
+            try:
+                yield from _write_raw(response.iter_bytes(), partial_file)
+            except BaseException:  # including an abandoned stream
+                partial_file.unlink(missing_ok=True)
+                raise
+            _log.info(f"Writing cache file {cache_file}")
+            partial_file.replace(cache_file)
+            cache_manager.written(cache_file)
+            return
+        response.read()
+
+    # Further retries are left to json_request
+    if not rate_limiter.wait(response, 0, start, client):
+        response.raise_for_status()
+    json_ = json_request(url, timeout=timeout, method=method, **kwargs)
+    yield json.dumps(json_).encode("utf-8")
+
+
+def json_stream(
+    url: URLType,
+    timeout: int = 180,
+    method: Literal["POST", "GET"] = "POST",
+    **kwargs,
+) -> ElementStream:
+    """
+    Send a request to the Overpass API and stream the elements of the response.
+
+    The cache directory of `json_request` is shared: existing cache files are
+    read in chunks, and new responses are written to the cache on the fly.
+    """
+    cache_file = json_request.cache_file(url, **kwargs)
+    if cache_file is None:  # entries are not stored as files
+        json_ = json_request(url, timeout=timeout, method=method, **kwargs)
+        return ElementStream([json.dumps(json_).encode("utf-8")])
+    if cache_file.exists():
+        cache_manager.touch(cache_file)
+        return ElementStream(_iter_file(cache_file))
+    return ElementStream(
+        _iter_response(
+            cache_file, url, timeout=timeout, method=method, **kwargs
+        )
+    )
@@ -11,6 +11,8 @@ from PIL import Image
 import numpy as np
 from cartes import __version__
 
+from ..utils.cache_manager import cache_manager, temporary_file
+
 nest_asyncio.apply()
 
 async_client = httpx.AsyncClient(
@@ -46,18 +48,27 @@ class Cache(object):
         super().__init__(*args, **kwargs)
 
     async def get_image(self, tile):
-        tile_fname = self.cache_directory / (
-            "_".join(str(v) for v in tile) + self.extension
+        tile_fname = cache_manager.lookup(
+            self.cache_directory,
+            "_".join(str(v) for v in tile) + self.extension,
         )
 
-        if not os.path.exists(tile_fname):
+        if os.path.exists(tile_fname):
+            cache_manager.touch(tile_fname)
+        else:
             async with self.semaphore:
                 response = await async_client.get(
                     self._image_url(tile),  # type: ignore
                     headers={"User-Agent": f"cartes {__version__}"},
                 )
             response.raise_for_status()
-            tile_fname.write_bytes(response.content)
+            temp_file = temporary_file(tile_fname)
+            try:
+                temp_file.write_bytes(response.content)
+                temp_file.replace(tile_fname)
+            finally:  # unless renamed, e.g. if the disk is full
+                temp_file.unlink(missing_ok=True)
+            cache_manager.written(tile_fname)
 
         with open(tile_fname, "rb") as fh:
             img = Image.open(fh)
@@ -2,18 +2,273 @@ from __future__ import annotations
 
 import json
 import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 from functools import cached_property  # noqa: F401
 from pathlib import Path
-from typing import Any, Callable, Dict, Generic, Hashable, TypeVar, Union
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Generic,
+    Hashable,
+    Iterable,
+    Iterator,
+    Literal,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import pandas as pd
 
+from .cache_manager import cache_manager, temporary_file
 from .descriptors import DirectoryCreateIfNotExists
 
 T = TypeVar("T")
 
 _log = logging.getLogger(__name__)
 
+DEFAULT_MAXSIZE = 128
+DEFAULT_MAXBYTES = 1 << 30  # 1 GiB
+
+
+def _env_limit(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.environ.get(name, None)
+    if value is None:
+        return default
+    if value.strip().lower() in ["", "none"]:
+        return None
+    return int(value)
+
+
+def approximate_size(content: Any) -> int:
+    """Approximate memory footprint of a result, in bytes.
+
+    The sizes of containers (dicts, lists, tuples and sets) are summed
+    recursively with the sizes of their elements.
+    """
+    if isinstance(content, pd.DataFrame):
+        return int(content.memory_usage(deep=True).sum())
+    size = sys.getsizeof(content)
+    if isinstance(content, dict):
+        size += sum(
+            approximate_size(key) + approximate_size(value)
+            for key, value in content.items()
+        )
+    elif isinstance(content, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(elt) for elt in content)
+    return size
+
+
+class ManagedDirectory(DirectoryCreateIfNotExists):
+    """A cache directory known to the cache_manager."""
+
+    def __set__(self, obj, path: Union[str, Path]) -> None:
+        super().__set__(obj, path)
+        cache_manager.register(getattr(obj, self.private_name))
+
+
+class CacheBackend(ABC, Generic[T]):
+    """Storage of the entries of a CacheFunction, by key.
+
+    Keys are the hash codes of the arguments of the function.
+    """
+
+    cache_dir = ManagedDirectory()
+
+    def __init__(self, cache_dir: Union[str, Path]) -> None:
+        self.cache_dir = cache_dir
+
+    def path(self, key: str) -> Optional[Path]:
+        """Path of the file holding the entry, if entries are files."""
+        return None
+
+    def lock(self, key: str) -> ContextManager[Any]:
+        """Lock on an entry, to fetch it only once across processes."""
+        return cache_manager.lock(self.cache_dir / key)
+
+    @abstractmethod
+    def stamp(self, key: str) -> Optional[int]:
+        """Modification time of the entry (in ns), None if missing."""
+
+    @abstractmethod
+    def read(self, key: str) -> Optional[T]:
+        pass
+
+    @abstractmethod
+    def write(self, key: str, content: T) -> None:
+        pass
+
+
+class FileBackend(CacheBackend[T]):
+    """Stores each entry in a file, laid out by the cache_manager."""
+
+    def __init__(
+        self,
+        cache_dir: Union[str, Path],
+        writer: Callable[[T, Path], None],
+        reader: Callable[[Path], Optional[T]],
+    ) -> None:
+        super().__init__(cache_dir)
+        self.writer = writer
+        self.reader = reader
+
+    def path(self, key: str) -> Path:
+        return cache_manager.lookup(self.cache_dir, key)
+
+    def lock(self, key: str) -> ContextManager[Any]:
+        return cache_manager.lock(self.path(key))
+
+    def stamp(self, key: str) -> Optional[int]:
+        try:
+            return self.path(key).stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def read(self, key: str) -> Optional[T]:
+        cache_file = self.path(key)
+        _log.info(f"Looking for cache file: {cache_file}")
+        if not cache_file.exists():
+            return None
+        _log.info(f"Using cache file: {cache_file}")
+        cache_manager.touch(cache_file)
+        return self.reader(cache_file)
+
+    def write(self, key: str, content: T) -> None:
+        cache_file = self.path(key)
+        temp_file = temporary_file(cache_file)
+        try:
+            self.writer(content, temp_file)
+            if temp_file.exists():
+                temp_file.replace(cache_file)
+        finally:  # unless renamed, e.g. if the writer fails
+            temp_file.unlink(missing_ok=True)
+        cache_manager.written(cache_file)
+
+
+class SQLiteBackend(CacheBackend[T]):
+    """Stores entries as rows of a SQLite database, in WAL mode.
+
+    The database (cache.sqlite) lives in the cache directory. This suits
+    numerous small entries better than files: no inode and no directory
+    lookup per entry. Entries are serialised to bytes with dumps and loads.
+
+    Connections are opened per thread, and again after a fork.
+    """
+
+    filename = "cache.sqlite"
+
+    def __init__(
+        self,
+        cache_dir: Union[str, Path],
+        dumps: Callable[[T], bytes],
+        loads: Callable[[bytes], Optional[T]],
+    ) -> None:
+        super().__init__(cache_dir)
+        self.dumps = dumps
+        self.loads = loads
+        self.database = self.cache_dir / self.filename
+        self.namespace = cache_manager.namespace(self.cache_dir)
+        self.local = threading.local()
+        cache_manager.register_database(self)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if getattr(self.local, "pid", None) != os.getpid():
+            # autocommit: each statement is its own transaction
+            connection = sqlite3.connect(
+                self.database, timeout=60, isolation_level=None
+            )
+            # must be set before the table is created
+            connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "size INTEGER NOT NULL, atime REAL NOT NULL, "
+                "mtime INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def expired(self, mtime: int) -> bool:
+        ttl = cache_manager.ttl.get(self.namespace, None)
+        return ttl is not None and mtime / 1e9 + ttl < time.time()
+
+    def stamp(self, key: str) -> Optional[int]:
+        row = self.connection.execute(
+            "SELECT mtime FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or self.expired(row[0]):
+            return None
+        return row[0]
+
+    def read(self, key: str) -> Optional[T]:
+        _log.info(f"Looking for {key} in {self.database}")
+        row = self.connection.execute(
+            "SELECT value, mtime FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if self.expired(row[1]):
+            _log.info(f"Removing expired {key} from {self.database}")
+            self.remove([key])
+            return None
+        self.connection.execute(
+            "UPDATE entries SET atime = ? WHERE key = ?", (time.time(), key)
+        )
+        return self.loads(row[0])
+
+    def write(self, key: str, content: T) -> None:
+        _log.info(f"Writing {key} to {self.database}")
+        value = self.dumps(content)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value), time.time(), time.time_ns()),
+        )
+        cache_manager.written(self.database, len(value))
+
+    def entries(self) -> Iterator[Tuple[str, int, float, float]]:
+        """Key, size, access and modification times (in s) of all rows."""
+        for key, size, atime, mtime in self.connection.execute(
+            "SELECT key, size, atime, mtime FROM entries"
+        ):
+            yield key, size, atime, mtime / 1e9
+
+    def remove(self, keys: Iterable[str]) -> None:
+        self.connection.executemany(
+            "DELETE FROM entries WHERE key = ?", ((key,) for key in keys)
+        )
+        self.connection.execute("PRAGMA incremental_vacuum")
+
+
+# a backend name, a backend, or a factory of backends for a cache directory
+BackendType = Union[
+    Literal["file", "sqlite"],
+    CacheBackend[T],
+    Callable[[Path], CacheBackend[T]],
+]
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: Optional[int]
+    maxbytes: Optional[int]
+    currsize: int
+    nbytes: int
+
 
 class CacheFunction(Generic[T]):
     """Function caching utilities.
@@ -32,9 +287,28 @@ class CacheFunction(Generic[T]):
     - writer: Callable[[T, Path], None] describes how to serialize the results;
     - reader: Callable[[Path], T] describes how to read the results from a file.
 
-    """
+    The LRU cache is bounded in number of entries (maxsize) and in bytes
+    (maxbytes). The size of an entry is an approximation of the memory
+    footprint of the loaded result (see `approximate_size`), computed once
+    when it is stored.
+    Limits default to the CARTES_CACHE_MAXSIZE and CARTES_CACHE_MAXBYTES
+    environment variables, if set. "none" means unbounded, 0 disables the
+    in-memory layer. Statistics are available with `cache_info()`.
+
+    Entries are stored by a backend: "file" (one file per entry, with the
+    writer and reader) or "sqlite" (rows of a database in cache_dir, with
+    the optional dumps and loads, which serialize results to bytes). The
+    backend defaults to the one of the namespace of cache_dir in the
+    `cache_manager` (see CARTES_CACHE_BACKEND), and to files if dumps and
+    loads are not provided. Other storages are plugged in with a
+    CacheBackend, which must live in cache_dir, or with a factory of
+    backends, called with the cache directory whenever it is set.
+
+    Entries are laid out, expired and evicted by the `cache_manager`. Cache
+    files are written to a temporary file, then renamed. Concurrent calls
+    for the same key, in threads or processes, wait for the first one.
 
-    cache_dir = DirectoryCreateIfNotExists()
+    """
 
     def __init__(
         self,
@@ -43,38 +317,180 @@ class CacheFunction(Generic[T]):
         hashing: Callable[..., Hashable],
         writer: Callable[[T, Path], None],
         reader: Callable[[Path], T],
+        maxsize: Optional[int] = None,
+        maxbytes: Optional[int] = None,
+        backend: Optional[BackendType[T]] = None,
+        dumps: Optional[Callable[[T], bytes]] = None,
+        loads: Optional[Callable[[bytes], Optional[T]]] = None,
     ):
         self.function = function
-        self.cache_dir = cache_dir
         self.hashing = hashing
         self.writer = writer
         self.reader = reader
+        self.backend_type = backend
+        self.dumps = dumps
+        self.loads = loads
+        self.cache_dir = cache_dir
+        self.maxsize = (
+            maxsize
+            if maxsize is not None
+            else _env_limit("CARTES_CACHE_MAXSIZE", DEFAULT_MAXSIZE)
+        )
+        self.maxbytes = (
+            maxbytes
+            if maxbytes is not None
+            else _env_limit("CARTES_CACHE_MAXBYTES", DEFAULT_MAXBYTES)
+        )
+
+        self.lru_cache: OrderedDict[Hashable, Tuple[T, int]] = OrderedDict()
+        self.nbytes = self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    @property
+    def cache_dir(self) -> Path:
+        return self.backend.cache_dir
+
+    @cache_dir.setter
+    def cache_dir(self, cache_dir: Union[str, Path]) -> None:
+        backend = self.backend_type
+        if isinstance(backend, CacheBackend):
+            if backend.cache_dir != Path(cache_dir):
+                msg = f"{backend} stores entries in {backend.cache_dir}"
+                raise ValueError(f"{msg}, not in {cache_dir}")
+            self.backend: CacheBackend[T] = backend
+            return
+        if callable(backend):
+            self.backend = backend(Path(cache_dir))
+            return
+        name = backend or cache_manager.backend(cache_dir)
+        if name == "sqlite" and (self.dumps is None or self.loads is None):
+            msg = f"No dumps and loads for {self.function}, using files"
+            _log.warning(msg)
+            name = "file"
+        self.backend = (
+            SQLiteBackend(cache_dir, self.dumps, self.loads)  # type: ignore
+            if name == "sqlite"
+            else FileBackend(cache_dir, self.writer, self.reader)
+        )
 
-        self.lru_cache: Dict[Hashable, T] = dict()
+    def cache_file(self, *args, **kwargs) -> Optional[Path]:
+        """Path of the cache file for the given arguments.
 
-    def __call__(self, *args, **kwargs) -> T:
+        None if the backend does not store entries as files.
+        """
         hashcode = self.hashing(*args, **kwargs)
-        cache_file = self.cache_dir / str(hashcode)
-        res = self.lru_cache.get(cache_file.as_posix(), None)
+        return self.backend.path(str(hashcode))
+
+    def keys(self, *args, **kwargs) -> Tuple[str, str]:
+        """Keys of the backend and of the in-memory layer."""
+        hashcode = str(self.hashing(*args, **kwargs))
+        return hashcode, (self.cache_dir / hashcode).as_posix()
 
+    def __call__(self, *args, **kwargs) -> T:
+        hashcode, key = self.keys(*args, **kwargs)
+        res = self.lookup(hashcode, key)
         if res is not None:
             return res
 
-        _log.info(f"Looking for cache file: {cache_file}")
+        # Only one thread or process fetches a given key, others wait
+        with self.backend.lock(hashcode):
+            res = self.recall(key, count=False)
+            if res is not None:
+                return res
+            res = self.fetch(hashcode, *args, **kwargs)
 
-        if cache_file.exists():
-            _log.info(f"Using cache file: {cache_file}")
-            res = self.reader(cache_file)
+        self.store(key, res)
+        return res
+
+    def cached(self, *args, **kwargs) -> Optional[T]:
+        """Returns the result if cached, without calling the function."""
+        return self.lookup(*self.keys(*args, **kwargs))
+
+    def put(self, res: T, *args, **kwargs) -> None:
+        """Caches a result obtained otherwise, e.g. asynchronously."""
+        hashcode, key = self.keys(*args, **kwargs)
+        self.backend.write(hashcode, res)
+        self.store(key, res)
+
+    def lookup(self, hashcode: str, key: str) -> Optional[T]:
+        """Returns the result from the in-memory layer, or the backend."""
+        res = self.recall(key)
+        if res is not None:
+            return res
+        with self.lock:
+            self.misses += 1
+
+        # Entries are written atomically: reading them needs no lock
+        res = self.backend.read(hashcode)
+        if res is not None:
+            self.store(key, res)
+        return res
+
+    def recall(self, key: Hashable, count: bool = True) -> Optional[T]:
+        """Returns the result from the in-memory layer, if present."""
+        with self.lock:
+            entry = self.lru_cache.get(key, None)
+            if entry is None:
+                return None
+            self.hits += count
+            self.lru_cache.move_to_end(key)
+            return entry[0]
+
+    def fetch(self, hashcode: str, *args, **kwargs) -> T:
+        """Reads the result from the backend, or calls the function."""
+        res = None
+        stamp = self.backend.stamp(hashcode)
+        if stamp is not None:
+            res = self.backend.read(hashcode)
 
         if res is None:
             msg = f"Calling function {self.function} with {args, kwargs}"
             _log.debug(msg)
             res = self.function(*args, **kwargs)
-            self.writer(res, cache_file)
+            # unless the function wrote the cache file itself
+            if self.backend.stamp(hashcode) == stamp:
+                self.backend.write(hashcode, res)
 
-        self.lru_cache[cache_file.as_posix()] = res
         return res
 
+    def store(self, key: Hashable, res: T) -> None:
+        if self.maxsize == 0:
+            return
+        size = approximate_size(res)
+        with self.lock:
+            previous = self.lru_cache.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous[1]
+            self.lru_cache[key] = res, size
+            self.nbytes += size
+            while len(self.lru_cache) > 0 and (
+                (
+                    self.maxsize is not None
+                    and len(self.lru_cache) > self.maxsize
+                )
+                or (self.maxbytes is not None and self.nbytes > self.maxbytes)
+            ):
+                _, (_, evicted) = self.lru_cache.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(
+            self.hits,
+            self.misses,
+            self.evictions,
+            self.maxsize,
+            self.maxbytes,
+            len(self.lru_cache),
+            self.nbytes,
+        )
+
+    def cache_clear(self) -> None:
+        """Empties the in-memory layer; cache files are left untouched."""
+        with self.lock:
+            self.lru_cache.clear()
+            self.nbytes = self.hits = self.misses = self.evictions = 0
+
 
 class CacheResults(Generic[T]):
     """Defines a decorator for functions when results should be cached.
@@ -87,6 +503,10 @@ class CacheResults(Generic[T]):
     - writer: Callable[[T, Path], None] describes how to serialize the results;
     - reader: Callable[[Path], T] describes how to read the results from a file.
 
+    Optional maxsize and maxbytes bound the in-memory LRU cache. Optional
+    backend, dumps and loads select the storage of entries (see
+    CacheFunction).
+
     """
 
     def __init__(
@@ -95,15 +515,34 @@ class CacheResults(Generic[T]):
         hashing: Callable[..., Hashable],
         writer: Callable[[T, Path], None],
         reader: Callable[[Path], T],
+        maxsize: Optional[int] = None,
+        maxbytes: Optional[int] = None,
+        backend: Optional[BackendType[T]] = None,
+        dumps: Optional[Callable[[T], bytes]] = None,
+        loads: Optional[Callable[[bytes], Optional[T]]] = None,
     ):
         self.cache_dir = cache_dir
         self.hashing = hashing
         self.writer = writer
         self.reader = reader
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.backend = backend
+        self.dumps = dumps
+        self.loads = loads
 
     def __call__(self, function: Callable[..., T]) -> CacheFunction[T]:
         cache_function = CacheFunction(
-            function, self.cache_dir, self.hashing, self.writer, self.reader
+            function,
+            self.cache_dir,
+            self.hashing,
+            self.writer,
+            self.reader,
+            maxsize=self.maxsize,
+            maxbytes=self.maxbytes,
+            backend=self.backend,
+            dumps=self.dumps,
+            loads=self.loads,
         )
         cache_function.__doc__ = function.__doc__
         return cache_function
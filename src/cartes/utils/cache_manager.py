@@ -0,0 +1,432 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    ClassVar,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from appdirs import user_cache_dir
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+
+if TYPE_CHECKING:
+    from .cache import SQLiteBackend
+
+_log = logging.getLogger(__name__)
+
+
+def _env_bytes(name: str) -> Optional[int]:
+    value = os.environ.get(name, None)
+    if value is None or value.strip().lower() in ["", "none"]:
+        return None
+    return int(value)
+
+
+def _env_mapping(name: str) -> Dict[str, str]:
+    """Parses per-namespace settings, e.g. "osm=86400,tiles=2592000"."""
+    value = os.environ.get(name, "")
+    mapping: Dict[str, str] = dict()
+    for item in value.split(","):
+        if "=" in item:
+            namespace, setting = item.split("=", 1)
+            mapping[namespace.strip()] = setting.strip()
+    return mapping
+
+
+# Nominatim responses are small and numerous: one file each wastes inodes
+DEFAULT_BACKENDS = {"nominatim": "sqlite"}
+
+# suffixes of files derived from a cache file, and of the cache file
+COMPANIONS = {".parquet": ".json"}
+
+
+def temporary_file(path: Path) -> Path:
+    """A temporary file, unique to the current process and thread, in the
+    directory of path: write to it, then rename it (atomically) to path.
+
+    Names of temporary files start with a dot, as lock files, so that they
+    are ignored when computing statistics or pruning. Parent directories are
+    created, as this is the write path of cache files.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    suffix = f"{os.getpid()}-{threading.get_ident()}.tmp"
+    return path.with_name(f".{path.name}.{suffix}")
+
+
+class FileLock:
+    """Exclusive lock on a key, shared by threads and processes.
+
+    The lock is reentrant for the thread holding it. Processes synchronise
+    with flock on a lock file, removed on release; on platforms without
+    fcntl, only threads of the current process are synchronised.
+    """
+
+    _guard = threading.Lock()
+    _threads: ClassVar[Dict[Path, threading.RLock]] = dict()
+    _count: ClassVar[Dict[Path, int]] = dict()
+    _held = threading.local()
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def __enter__(self) -> "FileLock":
+        with FileLock._guard:
+            lock = FileLock._threads.setdefault(self.path, threading.RLock())
+            FileLock._count[self.path] = FileLock._count.get(self.path, 0) + 1
+        lock.acquire()
+
+        held = FileLock._held.__dict__.setdefault("files", dict())
+        if self.path not in held and fcntl is not None:
+            held[self.path] = [self._lock_file(), 0]
+        if self.path in held:
+            held[self.path][1] += 1
+        return self
+
+    def _lock_file(self) -> BinaryIO:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            fh = self.path.open("ab")
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            # The file may have been removed by the previous holder
+            try:
+                if os.fstat(fh.fileno()).st_ino == self.path.stat().st_ino:
+                    return fh
+            except FileNotFoundError:
+                pass
+            fh.close()
+
+    def __exit__(self, *args) -> None:
+        held = FileLock._held.__dict__.get("files", dict())
+        if self.path in held:
+            held[self.path][1] -= 1
+            if held[self.path][1] == 0:
+                fh, _ = held.pop(self.path)
+                self.path.unlink(missing_ok=True)
+                fcntl.flock(fh, fcntl.LOCK_UN)
+                fh.close()
+
+        with FileLock._guard:
+            lock = FileLock._threads[self.path]
+            FileLock._count[self.path] -= 1
+            if FileLock._count[self.path] == 0:
+                del FileLock._threads[self.path]
+                del FileLock._count[self.path]
+        lock.release()
+
+
+class Entry(NamedTuple):
+    path: Path
+    namespace: str
+    size: int
+    atime: float
+    mtime: float
+    # rows of a database: path is then <database>/<key>
+    key: Optional[str] = None
+    # files derived from path, expired and evicted with it
+    companions: Tuple[Path, ...] = ()
+
+
+class NamespaceStats(NamedTuple):
+    files: int
+    nbytes: int
+    oldest_access: Optional[float]
+
+
+class CacheManager:
+    """Manages the files of all disk caches of cartes.
+
+    Files are stored in a sharded layout: `<directory>/<xx>/<name>`, where
+    `xx` are the first two hex characters of the md5 hash of the name, so
+    that no directory grows too large. Files in the former flat layout are
+    moved to their shard the first time they are looked up.
+
+    - Each namespace (the first directory below root, e.g. osm, atlas or
+      tiles) may have its own TTL, in seconds, based on the time the file
+      was written.
+    - The total size of the cache may be bounded (max_size, in bytes): the
+      least recently accessed files are evicted first when pruning.
+    - Pruning happens on demand (`cartes cache prune`) or automatically
+      when a file is written: once the running total of the sizes written
+      since the last pruning exceeds max_size, and at most once every
+      `prune_interval` seconds otherwise (e.g. to remove expired files).
+    - Files derived from an entry (e.g. the parsed .parquet version of a
+      .json response) are accounted, expired and evicted with it.
+    - Each namespace may store its entries in files ("file") or in a SQLite
+      database ("sqlite"); rows of databases are expired and evicted as
+      files are.
+
+    Defaults are read from the CARTES_CACHE_DISK_MAXBYTES, CARTES_CACHE_TTL
+    (e.g. "osm=86400,tiles=2592000") and CARTES_CACHE_BACKEND (e.g.
+    "nominatim=sqlite,osm=file") environment variables.
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path, None] = None,
+        max_size: Optional[int] = None,
+        ttl: Optional[Dict[str, float]] = None,
+        prune_interval: float = 86400,
+        backends: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.root = Path(user_cache_dir("cartes") if root is None else root)
+        self.max_size = (
+            max_size
+            if max_size is not None
+            else _env_bytes("CARTES_CACHE_DISK_MAXBYTES")
+        )
+        self.ttl = (
+            ttl
+            if ttl is not None
+            else {
+                namespace: float(seconds)
+                for namespace, seconds in _env_mapping(
+                    "CARTES_CACHE_TTL"
+                ).items()
+            }
+        )
+        self.prune_interval = prune_interval
+        self.backends = (
+            backends
+            if backends is not None
+            else {**DEFAULT_BACKENDS, **_env_mapping("CARTES_CACHE_BACKEND")}
+        )
+        self.directories: Set[Path] = set()
+        self.databases: Dict[Path, "SQLiteBackend[Any]"] = dict()
+        # size of the cache at the last pruning, plus the sizes written since
+        self.total: Optional[int] = None
+        self.guard = threading.Lock()
+
+    def register(self, directory: Union[str, Path]) -> None:
+        """Registers a cache directory located outside of root."""
+        directory = Path(directory)
+        if not directory.is_relative_to(self.root):
+            self.directories.add(directory)
+
+    def register_database(self, database: "SQLiteBackend[Any]") -> None:
+        """Registers a database, so that its rows are managed as files."""
+        self.databases[database.database] = database
+
+    def backend(self, directory: Union[str, Path]) -> str:
+        """Name of the backend storing the entries of a cache directory."""
+        directory = Path(directory)
+        self.register(directory)
+        return self.backends.get(self.namespace(directory), "file")
+
+    def namespace(self, path: Path) -> str:
+        for base in self.directories:
+            if path.is_relative_to(base):
+                return base.name
+        if path.is_relative_to(self.root) and path != self.root:
+            return path.relative_to(self.root).parts[0]
+        return path.name if path.is_dir() else path.parent.name
+
+    @staticmethod
+    def shard(name: str) -> str:
+        return hashlib.md5(name.encode("utf-8")).hexdigest()[:2]
+
+    def lookup(self, directory: Path, name: str) -> Path:
+        """Returns the path of an entry in the sharded layout.
+
+        Entries in the flat layout are migrated, expired entries are removed.
+        Parent directories are only created when files are written (see
+        `temporary_file`), not when probing for entries.
+        """
+        path = directory / self.shard(name) / name
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            legacy = directory / name
+            if not legacy.is_file():
+                return path
+            _log.info(f"Moving cache file {legacy} to {path}")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(legacy, path)
+            stat = path.stat()
+
+        ttl = self.ttl.get(self.namespace(directory), None)
+        if ttl is not None and stat.st_mtime + ttl < time.time():
+            _log.info(f"Removing expired cache file {path}")
+            path.unlink(missing_ok=True)
+            for suffix, main in COMPANIONS.items():
+                if main == path.suffix:
+                    path.with_suffix(suffix).unlink(missing_ok=True)
+        return path
+
+    @staticmethod
+    def lock(path: Path) -> FileLock:
+        """Lock on an entry, to fetch it only once across processes."""
+        return FileLock(path.with_name(f".{path.name}.lock"))
+
+    def touch(self, path: Path) -> None:
+        """Records an access to path, for the LRU eviction."""
+        try:
+            os.utime(path, (time.time(), path.stat().st_mtime))
+        except FileNotFoundError:
+            pass
+
+    def written(self, path: Path, size: Optional[int] = None) -> None:
+        """Notifies a write (of size bytes, the size of path by default),
+        which may trigger an automatic pruning."""
+        if self.max_size is None and len(self.ttl) == 0:
+            return
+        if size is None:
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                size = 0
+        stamp = self.root / ".last_prune"
+        with self.guard:
+            try:
+                last = stamp.stat().st_mtime
+                if self.total is None:  # as recorded by the last pruning
+                    self.total = int(stamp.read_text() or 0)
+            except (FileNotFoundError, ValueError):
+                last = 0
+            self.total = (self.total or 0) + size
+            over = self.max_size is not None and self.total > self.max_size
+            if not over and last + self.prune_interval >= time.time():
+                return
+            # other threads do not trigger a pruning in the meantime
+            self.total = 0
+            self.root.mkdir(parents=True, exist_ok=True)
+            stamp.touch()
+        self.prune()
+
+    def entries(self) -> Iterator[Entry]:
+        # databases and their -wal and -shm files
+        database_files = {
+            path.with_name(path.name + suffix)
+            for path in self.databases
+            for suffix in ["", "-wal", "-shm", "-journal"]
+        }
+        for base in [self.root, *sorted(self.directories)]:
+            if not base.is_dir():
+                continue
+            for dirpath, _dirnames, filenames in os.walk(base):
+                names = set(filenames)
+                for filename in filenames:
+                    if filename.startswith("."):
+                        continue
+                    path = Path(dirpath) / filename
+                    if path in database_files:
+                        continue
+                    main = COMPANIONS.get(path.suffix, None)
+                    if main is not None and path.stem + main in names:
+                        continue  # accounted with the main file
+                    entry = self.entry(path, names)
+                    if entry is not None:
+                        yield entry
+
+        for path, database in sorted(self.databases.items()):
+            if not path.exists():
+                continue
+            namespace = self.namespace(path.parent)
+            for key, size, atime, mtime in database.entries():
+                yield Entry(path / key, namespace, size, atime, mtime, key)
+
+    def entry(self, path: Path, names: Set[str]) -> Optional[Entry]:
+        """The entry of a file and of its companions, in names."""
+        companions = tuple(
+            path.with_suffix(suffix)
+            for suffix, main in COMPANIONS.items()
+            if main == path.suffix and path.stem + suffix in names
+        )
+        size, atime, mtime = 0, 0.0, float("inf")
+        for file in (path, *companions):
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                if file == path:
+                    return None
+                continue
+            size += stat.st_size
+            # the last access to any file, the oldest write
+            atime = max(atime, stat.st_atime)
+            mtime = min(mtime, stat.st_mtime)
+        return Entry(
+            path, self.namespace(path), size, atime, mtime, None, companions
+        )
+
+    def stats(self) -> Dict[str, NamespaceStats]:
+        stats: Dict[str, NamespaceStats] = dict()
+        for entry in self.entries():
+            files, nbytes, oldest = stats.get(
+                entry.namespace, NamespaceStats(0, 0, None)
+            )
+            stats[entry.namespace] = NamespaceStats(
+                files + 1,
+                nbytes + entry.size,
+                entry.atime if oldest is None else min(oldest, entry.atime),
+            )
+        return stats
+
+    def prune(
+        self,
+        max_size: Optional[int] = None,
+        namespace: Optional[str] = None,
+    ) -> List[Path]:
+        """Removes expired files, then the least recently accessed ones
+        until the cache fits in max_size. Returns the removed paths."""
+        if max_size is None:
+            max_size = self.max_size
+        now = time.time()
+        removed: List[Entry] = list()
+        kept: List[Entry] = list()
+
+        for entry in self.entries():
+            if namespace is not None and entry.namespace != namespace:
+                continue
+            ttl = self.ttl.get(entry.namespace, None)
+            if ttl is not None and entry.mtime + ttl < now:
+                removed.append(entry)
+            else:
+                kept.append(entry)
+
+        total = sum(entry.size for entry in kept)
+        if max_size is not None and total > max_size:
+            for entry in sorted(kept, key=lambda entry: entry.atime):
+                removed.append(entry)
+                total -= entry.size
+                if total <= max_size:
+                    break
+
+        rows: Dict[Path, List[str]] = dict()
+        for entry in removed:
+            if entry.key is None:
+                entry.path.unlink(missing_ok=True)
+                for companion in entry.companions:
+                    companion.unlink(missing_ok=True)
+            else:
+                rows.setdefault(entry.path.parent, list()).append(entry.key)
+        for database, keys in rows.items():
+            self.databases[database].remove(keys)
+
+        if namespace is None and self.root.is_dir():
+            with self.guard:
+                self.total = total
+                (self.root / ".last_prune").write_text(str(total))
+
+        _log.info(f"Removed {len(removed)} entries from the cache")
+        return [entry.path for entry in removed]
+
+
+cache_manager = CacheManager()
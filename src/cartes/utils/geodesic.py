@@ -0,0 +1,91 @@
+"""Ellipsoidal measures on arrays of shapely geometries.
+
+Coordinates are expected in (longitude, latitude) on the WGS84 ellipsoid.
+All geometries are flattened into one coordinate array, so that the cost
+grows linearly with the total number of vertices.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import shapely
+from pyproj import Geod
+
+geod = Geod(ellps="WGS84")
+
+
+def _as_array(geometry) -> np.ndarray:
+    return np.asarray(geometry, dtype=object).reshape(-1)
+
+
+def geodesic_length(geometry) -> np.ndarray:
+    """Lengths in meters (perimeters for polygons), 0 for points.
+
+    All segments are measured in one single call to Geod.inv.
+    """
+    geometry = _as_array(geometry)
+    result = np.zeros(len(geometry))
+    result[shapely.is_missing(geometry)] = np.nan
+
+    polygonal = np.isin(shapely.get_type_id(geometry), [3, 6])
+    lines = geometry.copy()
+    lines[polygonal] = shapely.boundary(geometry[polygonal])
+    parts, geom_index = shapely.get_parts(lines, return_index=True)
+    coords, part_index = shapely.get_coordinates(parts, return_index=True)
+    if len(coords) < 2:
+        return result
+
+    same = part_index[1:] == part_index[:-1]
+    _, _, distance = geod.inv(
+        coords[:-1, 0][same],
+        coords[:-1, 1][same],
+        coords[1:, 0][same],
+        coords[1:, 1][same],
+    )
+    segment_geom = geom_index[part_index[:-1][same]]
+    result += np.bincount(segment_geom, distance, minlength=len(geometry))
+    return result
+
+
+def geodesic_area(geometry) -> np.ndarray:
+    """Areas in square meters, 0 for points and lines.
+
+    Holes are removed from the area of exteriors, regardless of the
+    orientation of rings.
+    """
+    geometry = _as_array(geometry)
+    result = np.zeros(len(geometry))
+    result[shapely.is_missing(geometry)] = np.nan
+
+    parts, geom_index = shapely.get_parts(geometry, return_index=True)
+    polygons = shapely.get_type_id(parts) == 3
+    parts, geom_index = parts[polygons], geom_index[polygons]
+    rings, part_index = shapely.get_rings(parts, return_index=True)
+    if len(rings) == 0:
+        return result
+
+    # the first ring of each polygon is its exterior
+    exterior = np.ones(len(rings), dtype=bool)
+    exterior[1:] = part_index[1:] != part_index[:-1]
+
+    coords, ring_index = shapely.get_coordinates(rings, return_index=True)
+    if len(coords) == 0:
+        return result
+    bounds = np.flatnonzero(np.diff(ring_index)) + 1
+    starts = np.concatenate([[0], bounds])
+    stops = np.concatenate([bounds, [len(coords)]])
+
+    area = np.fromiter(
+        (
+            abs(geod.polygon_area_perimeter(coords[a:b, 0], coords[a:b, 1])[0])
+            for a, b in zip(starts, stops)
+        ),
+        dtype=float,
+        count=len(starts),
+    )
+    ring_id = ring_index[starts]
+    area[~exterior[ring_id]] *= -1
+    result += np.bincount(
+        geom_index[part_index[ring_id]], area, minlength=len(geometry)
+    )
+    return result
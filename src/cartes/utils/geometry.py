@@ -2,10 +2,11 @@ from typing import Dict
 
 import geopandas as gpd
 
-from pyproj import Proj, Transformer
 from shapely.geometry import MultiPolygon, Polygon, base, polygon
 from shapely.ops import polygonize, transform
 
+from .projections import transformer_cache
+
 
 def reorient(shape: base.BaseGeometry, orientation=-1) -> base.BaseGeometry:
     if isinstance(shape, Polygon):
@@ -25,22 +26,17 @@ def simplify(
 
     Reference: https://shapely.readthedocs.io/en/stable/manual.html#object.simplify
     """
-    proj = Proj(
-        proj="aea",  # equivalent projection
-        lat_1=bounds["minlat"],
-        lat_2=bounds["maxlat"],
-        lat_0=(bounds["minlat"] + bounds["maxlat"]) / 2,
-        lon_0=(bounds["minlon"] + bounds["maxlon"]) / 2,
-    )
-    transformer_fwd = Transformer.from_proj(
-        Proj("EPSG:4326"), proj, always_xy=True
-    )
-    transformer_back = Transformer.from_proj(
-        proj, Proj("EPSG:4326"), always_xy=True
+    projection = transformer_cache.equal_area(
+        (
+            bounds["minlon"],
+            bounds["minlat"],
+            bounds["maxlon"],
+            bounds["maxlat"],
+        )
     )
     return transform(
-        transformer_back.transform,
-        transform(transformer_fwd.transform, shape).simplify(resolution),
+        projection.backward.transform,
+        transform(projection.forward.transform, shape).simplify(resolution),
     )
 
 
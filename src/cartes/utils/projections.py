@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, NamedTuple, Tuple
+
+import numpy as np
+import shapely
+from pyproj import Proj, Transformer
+
+
+class Projection(NamedTuple):
+    proj: Proj
+    forward: Transformer  # from EPSG:4326
+    backward: Transformer  # to EPSG:4326
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class TransformerCache:
+    """Bounded LRU cache of projections and their transformers.
+
+    Building a Proj and its Transformers costs milliseconds, which adds up
+    when done for each element of a collection. Projections are keyed by
+    their parameters, rounded to `precision` decimals, so that neighbouring
+    calls on the same area share the same transformers.
+
+    pyproj Transformers must not be shared between threads: projections are
+    also keyed by the thread which built them.
+
+    Statistics are available with the `info()` method, as for
+    `functools.lru_cache`.
+    """
+
+    def __init__(self, maxsize: int = 128, precision: int = 6) -> None:
+        self.maxsize = maxsize
+        self.precision = precision
+        self.hits = self.misses = 0
+        self.projections: OrderedDict[Hashable, Projection] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, factory: Callable[[], Proj]) -> Projection:
+        key = threading.get_ident(), key
+        with self.lock:
+            projection = self.projections.get(key, None)
+            if projection is not None:
+                self.hits += 1
+                self.projections.move_to_end(key)
+                return projection
+            self.misses += 1
+
+        proj = factory()
+        wgs84 = Proj("EPSG:4326")
+        projection = Projection(
+            proj,
+            Transformer.from_proj(wgs84, proj, always_xy=True),
+            Transformer.from_proj(proj, wgs84, always_xy=True),
+        )
+
+        with self.lock:
+            self.projections[key] = projection
+            while len(self.projections) > self.maxsize:
+                self.projections.popitem(last=False)
+        return projection
+
+    def equal_area(
+        self, bounds: Tuple[float, float, float, float]
+    ) -> Projection:
+        """Albers equal-area projection fitted to (west, south, east, north)."""
+        west, south, east, north = (round(x, self.precision) for x in bounds)
+        return self.get(
+            ("aea", west, south, east, north),
+            lambda: Proj(
+                proj="aea",  # equivalent projection
+                lat_1=south,
+                lat_2=north,
+                lat_0=(south + north) / 2,
+                lon_0=(west + east) / 2,
+            ),
+        )
+
+    def orthographic(self, lon: float, lat: float) -> Projection:
+        """Orthographic projection centred on (lon, lat)."""
+        lon, lat = round(lon, self.precision), round(lat, self.precision)
+
+        def factory() -> Proj:
+            from cartopy.crs import Orthographic
+
+            return Proj(Orthographic(lon, lat).proj4_init)
+
+        return self.get(("ortho", lon, lat), factory)
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(
+            self.hits, self.misses, self.maxsize, len(self.projections)
+        )
+
+    def clear(self) -> None:
+        with self.lock:
+            self.projections.clear()
+            self.hits = self.misses = 0
+
+
+transformer_cache = TransformerCache()
+
+
+def project(geometry: np.ndarray, transformer: Transformer) -> np.ndarray:
+    """Applies a transformer to an array of shapely geometries at once."""
+
+    def transform(coords: np.ndarray) -> np.ndarray:
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y])
+
+    return shapely.transform(geometry, transform)
@@ -1,7 +1,14 @@
+import json
 import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List
 
-from cartes.osm.requests import json_request
+import pytest
+
+from cartes.osm.requests import json_request, nominatim_request
 
 
 def pytest_configure(config):
@@ -9,4 +16,88 @@ def pytest_configure(config):
     _log.setLevel(logging.INFO)
 
     json_request.cache_dir = Path(config.rootdir) / "tests" / "cache"
+    nominatim_request.cache_dir = json_request.cache_dir
     _log.warning(f"Using cache_dir {json_request.cache_dir} for tests")
+
+
+class StandIn(ThreadingHTTPServer):
+    """A local stand-in for an Overpass instance."""
+
+    daemon_threads = True
+
+    def __init__(self, status: int = 200, delay: float = 0) -> None:
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.status = status
+        self.delay = delay
+        # statuses of the next responses, before status
+        self.statuses: List[int] = list()
+        self.status_page = "Rate limit: 2\n2 slots available now.\n"
+        # the JSON (or raw) response to each query
+        self.response: Callable[[str], Any] = self.echo
+        self.requests = 0
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/api/interpreter"
+
+    def echo(self, query: str) -> Dict[str, Any]:
+        node = dict(type="node", id=self.server_port, lat=0, lon=0)
+        node["tags"] = dict(name=query)
+        return {"elements": [node]}
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: StandIn
+
+    def do_GET(self) -> None:
+        body = self.server.status_page.encode()
+        self.send_response(200 if self.path == "/api/status" else 404)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        with self.server.lock:
+            self.server.requests += 1
+            status = (
+                self.server.statuses.pop(0)
+                if self.server.statuses
+                else self.server.status
+            )
+            self.server.active += 1
+            self.server.max_active = max(
+                self.server.max_active, self.server.active
+            )
+        query = self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.server.delay)
+        body = self.server.response(query.decode())
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        with self.server.lock:
+            self.server.active -= 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def servers() -> Iterator[List[StandIn]]:
+    instances: List[StandIn] = list()
+
+    def start(status: int = 200, delay: float = 0) -> StandIn:
+        server = StandIn(status, delay)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        instances.append(server)
+        return server
+
+    yield start  # type: ignore
+    for server in instances:
+        server.shutdown()
+        server.server_close()
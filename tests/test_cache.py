@@ -0,0 +1,401 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from cartes.utils.cache import (
+    CacheResults,
+    approximate_size,
+    read_json,
+    write_json,
+)
+from cartes.utils.cache_manager import CacheManager
+
+
+def test_lru(tmp_path: Path) -> None:
+    calls = list()
+
+    @CacheResults(
+        cache_dir=tmp_path,
+        hashing=lambda x: f"{x}.json",
+        writer=write_json,
+        reader=read_json,
+        maxsize=2,
+    )
+    def square(x: int) -> dict:
+        calls.append(x)
+        return dict(x=x, square=x * x)
+
+    assert square(1)["square"] == 1
+    assert square(2)["square"] == 4
+    assert square(1)["square"] == 1
+    assert square(3)["square"] == 9  # evicts 2
+    info = square.cache_info()
+    assert (info.hits, info.misses, info.evictions) == (1, 3, 1)
+    assert info.currsize == 2
+    # the memory footprint of loaded results, not the size of their files
+    nbytes = sum(approximate_size(dict(x=x, square=x * x)) for x in [1, 3])
+    assert info.nbytes == nbytes
+
+    # evicted entries are read again from their cache file
+    assert square(2)["square"] == 4
+    assert calls == [1, 2, 3]
+
+
+def test_maxbytes(tmp_path: Path, monkeypatch) -> None:
+    maxbytes = 3 * approximate_size(dict(x="a" * 10)) // 2
+    monkeypatch.setenv("CARTES_CACHE_MAXBYTES", str(maxbytes))
+
+    @CacheResults(
+        cache_dir=tmp_path,
+        hashing=lambda x: f"{x}.json",
+        writer=write_json,
+        reader=read_json,
+    )
+    def identity(x: str) -> dict:
+        return dict(x=x)
+
+    identity("a" * 10)
+    identity("b" * 10)
+    info = identity.cache_info()
+    assert info.maxbytes == maxbytes
+    assert info.currsize == 1 and info.evictions == 1
+    assert info.nbytes <= maxbytes
+
+
+def test_sharded_layout(tmp_path: Path) -> None:
+    manager = CacheManager(root=tmp_path, ttl=dict(osm=60))
+    directory = tmp_path / "osm"
+    directory.mkdir()
+    (directory / "legacy.json").write_text("{}")
+
+    # flat entries are moved to their shard
+    path = manager.lookup(directory, "legacy.json")
+    assert path == directory / manager.shard("legacy.json") / "legacy.json"
+    assert path.exists() and not (directory / "legacy.json").exists()
+
+    # expired entries are removed
+    os.utime(path, (time.time(), time.time() - 120))
+    assert not manager.lookup(directory, "legacy.json").exists()
+
+    # probes create no directory, only writes do
+    path = manager.lookup(directory, "missing.json")
+    assert not path.parent.exists()
+    with manager.lock(path):
+        assert path.parent.is_dir()
+
+
+def test_prune(tmp_path: Path) -> None:
+    manager = CacheManager(root=tmp_path)
+    now = time.time()
+    for i, namespace in enumerate(["osm", "atlas", "tiles", "osm"]):
+        path = manager.lookup(tmp_path / namespace, f"{i}.json")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"0" * 100)
+        os.utime(path, (now - 1000 * i, now))  # 3 is the least recently used
+
+    stats = manager.stats()
+    assert stats["osm"].files == 2 and stats["osm"].nbytes == 200
+
+    removed = manager.prune(max_size=250)
+    assert [path.name for path in removed] == ["3.json", "2.json"]
+    assert sum(elt.nbytes for elt in manager.stats().values()) == 200
+
+
+def test_automatic_prune(tmp_path: Path) -> None:
+    manager = CacheManager(root=tmp_path, max_size=250)
+    paths = list()
+    for i in range(3):
+        path = manager.lookup(tmp_path / "osm", f"{i}.json")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"0" * 100)
+        os.utime(path, (i, i))
+        paths.append(path)
+        manager.written(path)
+    # the first write prunes (no record of the size of the cache), then
+    # the running total only exceeds max_size with the third file
+    assert manager.total == 200
+    assert [path.exists() for path in paths] == [False, True, True]
+
+    # other processes start from the size recorded by the last pruning
+    manager = CacheManager(root=tmp_path, max_size=250)
+    path = manager.lookup(tmp_path / "osm", "3.json")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"0" * 10)
+    manager.written(path)
+    assert manager.total == 210
+    assert all(path.exists() for path in paths[1:])
+
+
+def test_companions(tmp_path: Path) -> None:
+    manager = CacheManager(root=tmp_path, ttl=dict(osm=60))
+    now = time.time()
+    paths = [manager.lookup(tmp_path / "osm", f"{i}.json") for i in range(2)]
+    for i, path in enumerate(paths):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"0" * 100)
+        path.with_suffix(".parquet").write_bytes(b"0" * 50)
+        for file in [path, path.with_suffix(".parquet")]:
+            os.utime(file, (now - 1000 * (i + 1), now))
+    # a recent access to the parsed file counts for the entry
+    os.utime(paths[1].with_suffix(".parquet"), (now, now))
+
+    assert manager.stats()["osm"] == (2, 300, now - 1000)
+    assert manager.prune(max_size=200) == [paths[0]]
+    assert not paths[0].with_suffix(".parquet").exists()
+    assert paths[1].with_suffix(".parquet").exists()
+
+    # expired entries are removed with their companions
+    os.utime(paths[1], (now, now - 120))
+    assert not manager.lookup(tmp_path / "osm", "1.json").exists()
+    assert not paths[1].with_suffix(".parquet").exists()
+
+
+def test_raw_response(tmp_path: Path, monkeypatch) -> None:
+    import gzip
+
+    import httpx
+
+    from cartes.osm import requests
+
+    body = b'{"version": 0.6, "elements": [{"type": "node", "id": 1}]}'
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, content=body)
+    )
+    monkeypatch.setattr(requests, "client", httpx.Client(transport=transport))
+    monkeypatch.setattr(requests.json_request, "cache_dir", tmp_path)
+
+    query = "[out:json];node(1);out;"
+    json_ = requests.json_request("https://overpass.test", data=query)
+    assert json_["elements"] == [{"type": "node", "id": 1}]
+
+    # the raw body is stored compressed, and read again
+    cache_file = requests.json_request.cache_file(
+        "https://overpass.test", data=query
+    )
+    assert cache_file is not None
+    assert gzip.decompress(cache_file.read_bytes()) == body
+    assert requests._read_json(cache_file) == json_
+    stream = requests.json_stream("https://overpass.test", data=query)
+    assert list(stream) == json_["elements"]
+
+
+def test_interrupted_writes(tmp_path: Path, monkeypatch) -> None:
+    import httpx
+
+    from cartes.osm import requests
+
+    def interrupted():
+        yield b'{"version": 0.6, "elements": ['
+        raise httpx.ReadError("connection lost")
+
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, content=interrupted())
+    )
+    monkeypatch.setattr(requests, "client", httpx.Client(transport=transport))
+    monkeypatch.setattr(requests.json_request, "cache_dir", tmp_path)
+    with pytest.raises(httpx.ReadError):
+        requests.json_request("https://overpass.test", data="node(1);out;")
+
+    def failing_writer(content: dict, path: Path) -> None:
+        path.write_text("{")
+        raise OSError("No space left on device")
+
+    cached = CacheResults(
+        cache_dir=tmp_path,
+        hashing=lambda x: f"{x}.json",
+        writer=failing_writer,
+        reader=read_json,
+    )(lambda x: dict(square=x * x))
+    with pytest.raises(OSError):
+        cached(2)
+
+    # neither partial cache files nor temporary files are left behind
+    assert [path for path in tmp_path.glob("**/*") if path.is_file()] == []
+
+
+def _slow_square(x: int, log: Path) -> dict:
+    with log.open("a") as fh:
+        fh.write(f"{x}\n")
+    time.sleep(0.2)
+    return dict(square=x * x)
+
+
+def _cached_slow_square(cache_dir: Path, x: int) -> int:
+    cached = CacheResults(
+        cache_dir=cache_dir,
+        hashing=lambda x, log: f"{x}.json",
+        writer=write_json,
+        reader=read_json,
+    )(_slow_square)
+    return cached(x, cache_dir / "calls.log")["square"]
+
+
+def test_single_flight(tmp_path: Path) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(
+            executor.map(lambda _: _cached_slow_square(tmp_path, 3), range(8))
+        )
+    assert results == [9] * 8
+    assert (tmp_path / "calls.log").read_text() == "3\n"
+    # no temporary or lock file is left behind
+    assert list(tmp_path.glob("**/.*")) == []
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="fork")
+def test_single_flight_processes(tmp_path: Path) -> None:
+    import multiprocessing
+    from functools import partial
+
+    with multiprocessing.get_context("fork").Pool(4) as pool:
+        results = pool.map(partial(_cached_slow_square, tmp_path), [4] * 8)
+    assert results == [16] * 8
+    assert (tmp_path / "calls.log").read_text() == "4\n"
+
+
+def test_sqlite_backend(tmp_path: Path, monkeypatch) -> None:
+    import json
+
+    from cartes.utils import cache
+
+    manager = CacheManager(root=tmp_path, backends=dict(geocoding="sqlite"))
+    monkeypatch.setattr(cache, "cache_manager", manager)
+    calls = list()
+
+    def cached_square() -> cache.CacheFunction:
+        @CacheResults(
+            cache_dir=tmp_path / "geocoding",
+            hashing=lambda x: f"{x}.json",
+            writer=write_json,
+            reader=read_json,
+            dumps=lambda content: json.dumps(content).encode(),
+            loads=json.loads,
+        )
+        def square(x: int) -> dict:
+            calls.append(x)
+            return dict(square=x * x)
+
+        return square
+
+    square = cached_square()
+    assert isinstance(square.backend, cache.SQLiteBackend)
+    assert square.cache_file(2) is None
+    squares = [square(x)["square"] for x in range(10)]
+    assert squares == [x * x for x in range(10)]
+
+    # a new function (e.g. in another process) reads the database
+    square = cached_square()
+    assert square(3)["square"] == 9
+    assert calls == list(range(10))
+    names = {path.name for path in (tmp_path / "geocoding").iterdir()}
+    assert names <= {"cache.sqlite", "cache.sqlite-wal", "cache.sqlite-shm"}
+
+    # rows are managed as files
+    stats = manager.stats()
+    assert stats["geocoding"].files == 10
+    removed = manager.prune(max_size=stats["geocoding"].nbytes - 1)
+    assert [path.name for path in removed] == ["0.json"]
+    assert manager.stats()["geocoding"].files == 9
+
+
+def test_pluggable_backends(tmp_path: Path) -> None:
+    import json
+
+    from cartes.utils import cache
+
+    def cached_square(backend: cache.BackendType) -> cache.CacheFunction:
+        @CacheResults(
+            cache_dir=tmp_path / "squares",
+            hashing=lambda x: f"{x}.json",
+            writer=write_json,
+            reader=read_json,
+            backend=backend,
+        )
+        def square(x: int) -> dict:
+            return dict(square=x * x)
+
+        return square
+
+    def factory(cache_dir: Path) -> cache.SQLiteBackend:
+        return cache.SQLiteBackend(
+            cache_dir, lambda content: json.dumps(content).encode(), json.loads
+        )
+
+    # a factory of backends follows the cache directory
+    square = cached_square(factory)
+    assert isinstance(square.backend, cache.SQLiteBackend)
+    assert square(3)["square"] == 9
+    square.cache_dir = tmp_path / "other"
+    assert square.backend.cache_dir == tmp_path / "other"
+    assert square.cached(3) is None
+
+    # a backend is used as is, in its own directory
+    backend = factory(tmp_path / "squares")
+    square = cached_square(backend)
+    assert square.backend is backend
+    assert square.cached(3) == dict(square=9)
+    with pytest.raises(ValueError):
+        square.cache_dir = tmp_path / "other"
+
+
+def test_nominatim_cache(tmp_path: Path, monkeypatch) -> None:
+    import subprocess
+
+    from cartes.osm.requests import (
+        json_request,
+        migrate_nominatim,
+        nominatim_request,
+    )
+
+    # nominatim responses are cached next to CARTES_CACHE
+    env = dict(os.environ, CARTES_CACHE=str(tmp_path / "overpass"))
+    cache_dir = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "from cartes.osm.requests import nominatim_request; "
+            "print(nominatim_request.cache_dir)",
+        ],
+        env=env,
+        text=True,
+    )
+    assert Path(cache_dir.strip()) == tmp_path / "nominatim"
+
+    # responses cached with the Overpass ones are moved, all at once
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path / "osm")
+    monkeypatch.setattr(nominatim_request, "cache_dir", tmp_path / "nominatim")
+
+    def put_flat(content, url: str, **kwargs) -> Path:
+        """Writes a cache file in the flat layout of former versions."""
+        json_request.put(content, url, **kwargs)
+        cache_file = json_request.cache_file(url, **kwargs)
+        assert cache_file is not None
+        return cache_file.rename(tmp_path / "osm" / cache_file.name)
+
+    url = "https://nominatim.openstreetmap.org/search"
+    params = dict(q="Toulouse", format="json")
+    legacy = put_flat([dict(osm_id=35738)], url, params=params)
+    reverse = "https://nominatim.openstreetmap.org/reverse"
+    coords = dict(lat=43.6, lon=1.44, format="json")
+    put_flat(dict(osm_id=1, osm_type="node"), reverse, params=coords)
+    overpass = dict(version=0.6, elements=[dict(type="node", id=1)])
+    put_flat(overpass, "https://overpass.test", data="node(1);out;")
+    json_request.cache_clear()
+
+    assert nominatim_request(url, params=params) == [dict(osm_id=35738)]
+    assert not legacy.exists()
+    assert nominatim_request.cached(reverse, params=coords) == dict(
+        osm_id=1, osm_type="node"
+    )
+    assert json_request.cached("https://overpass.test", data="node(1);out;")
+    nominatim_request.cache_clear()
+    assert nominatim_request.cached(url, params=params) == [dict(osm_id=35738)]
+
+    # the cache files are scanned only once
+    put_flat([dict(osm_id=35738)], url, params=params)
+    assert migrate_nominatim() == 0
+    assert legacy.exists()
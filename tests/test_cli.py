@@ -0,0 +1,64 @@
+import os
+import time
+from pathlib import Path
+
+from cartes import cli
+from cartes.utils.cache_manager import CacheManager
+
+
+def cached_files(manager: CacheManager, root: Path) -> None:
+    now = time.time()
+    for i, namespace in enumerate(["osm", "osm", "tiles"]):
+        path = manager.lookup(root / namespace, f"{i}.json")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"0" * 1024)
+        os.utime(path, (now - 1000 * i, now))  # 2 is the least recently used
+
+
+def test_cache_stats(tmp_path: Path, monkeypatch, capsys) -> None:
+    manager = CacheManager(root=tmp_path, ttl=dict(tiles=3600))
+    monkeypatch.setattr(cli, "cache_manager", manager)
+    cached_files(manager, tmp_path)
+
+    cli.main(["cache", "stats"])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == f"Cache directory: {tmp_path}"
+    assert lines[1].split()[:5] == ["osm", "2", "files", "2.0", "kB"]
+    assert lines[2].split()[:5] == ["tiles", "1", "files", "1.0", "kB"]
+    assert lines[2].endswith("ttl: 3600 s")
+    assert lines[3].split() == ["total", "3", "files", "3.0", "kB"]
+
+
+def test_cache_prune(tmp_path: Path, monkeypatch, capsys) -> None:
+    manager = CacheManager(root=tmp_path)
+    monkeypatch.setattr(cli, "cache_manager", manager)
+    cached_files(manager, tmp_path)
+
+    # only the least recently used files of the namespace are removed
+    cli.main(["cache", "prune", "--max-size", "1024", "--namespace", "osm"])
+    assert capsys.readouterr().out == "Removed 1 files\n"
+    stats = manager.stats()
+    assert stats["osm"].files == 1 and stats["tiles"].files == 1
+    assert manager.lookup(tmp_path / "osm", "0.json").exists()
+
+    cli.main(["cache", "prune", "--max-size", "1024"])
+    assert capsys.readouterr().out == "Removed 1 files\n"
+    assert list(manager.stats()) == ["osm"]
+
+
+def test_cache_migrate(tmp_path: Path, monkeypatch, capsys) -> None:
+    from cartes.osm.requests import json_request, nominatim_request
+
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path / "osm")
+    monkeypatch.setattr(nominatim_request, "cache_dir", tmp_path / "nominatim")
+    url = "https://nominatim.openstreetmap.org/search"
+    params = dict(q="Toulouse", format="json")
+    json_request.put([dict(osm_id=35738)], url, params=params)
+    cache_file = json_request.cache_file(url, params=params)
+    assert cache_file is not None
+    # the flat layout of former versions
+    cache_file.rename(tmp_path / "osm" / cache_file.name)
+
+    cli.main(["cache", "migrate"])
+    assert capsys.readouterr().out == "Moved 1 Nominatim responses\n"
+    assert nominatim_request.cached(url, params=params) == [dict(osm_id=35738)]
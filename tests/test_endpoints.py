@@ -0,0 +1,198 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import httpx
+import pytest
+
+from cartes.osm import Overpass
+from cartes.osm.endpoints import Endpoint, EndpointPool
+from cartes.osm.ratelimit import RateLimitInfo
+from cartes.osm.requests import json_request, rate_limiter
+
+
+def test_failover(servers, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path)
+    busy, timeout, mirror = servers(429), servers(504), servers(200)
+    closed = servers(200)
+    closed.shutdown()
+    closed.server_close()  # connection refused
+
+    pool = EndpointPool([closed.url, busy.url, timeout.url, mirror.url])
+    json_ = json_request(pool, data="node(1);out;")
+    assert json_["elements"][0]["id"] == mirror.server_port
+    assert (busy.requests, timeout.requests, mirror.requests) == (1, 1, 1)
+
+    # failed endpoints are put aside, and no longer tried first
+    json_request(pool, data="node(2);out;")
+    assert (busy.requests, timeout.requests, mirror.requests) == (1, 1, 2)
+    assert [elt.failures for elt in pool.endpoints] == [1, 1, 1, 0]
+
+
+@pytest.mark.parametrize("strategy", ["least_loaded", "round_robin"])
+def test_load_balancing(servers, tmp_path, monkeypatch, strategy) -> None:
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path)
+    first, second = servers(delay=0.2), servers(delay=0.2)
+    pool = EndpointPool(
+        [Endpoint(first.url, concurrency=2), Endpoint(second.url)],
+        strategy=strategy,
+    )
+    with ThreadPoolExecutor(8) as executor:
+        list(
+            executor.map(
+                lambda i: json_request(pool, data=f"node({i});out;"),
+                range(8),
+            )
+        )
+    assert first.requests + second.requests == 8
+    assert first.requests >= 2 and second.requests >= 2
+    # concurrency limits are enforced for each endpoint
+    assert first.max_active <= 2 and second.max_active <= 2
+    assert all(elt.active == 0 for elt in pool.endpoints)
+
+
+def test_async_pool(servers, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path)
+    first, second = servers(delay=0.1), servers(delay=0.1)
+    pool = EndpointPool(
+        [
+            Endpoint(first.url, concurrency=2),
+            Endpoint(second.url, concurrency=1),
+        ]
+    )
+    monkeypatch.setattr(Overpass, "endpoint", pool)
+
+    # more concurrent requests than slots: coroutines wait for free slots
+    queries = [f"node({i});out;" for i in range(9)]
+    results = Overpass.request_many(queries, max_concurrency=9)
+    assert [elt.data.name.iloc[0] for elt in results] == queries
+    assert first.requests + second.requests == 9
+    # each endpoint has its own limits, and clients are closed
+    assert first.max_active <= 2 and second.max_active <= 1
+    assert all(elt.active == 0 for elt in pool.endpoints)
+    assert all(len(elt.async_clients) == 0 for elt in pool.endpoints)
+    assert pool.waiters == []
+
+
+def test_select() -> None:
+    busy, late, early = (Endpoint(f"http://{i}.test") for i in range(3))
+    pool = EndpointPool([busy, late, early])
+    now = time.monotonic()
+    busy.active = busy.concurrency
+    late.available_at, early.available_at = now + 60, now + 30
+    # free endpoints in cooldown are better than waiting for busy ones
+    assert pool.select(set()) is early
+    early.active = early.concurrency
+    assert pool.select(set()) is late
+    assert pool.select({late}) is None
+    assert pool.timeout({late}) == pytest.approx(30, abs=1)
+    busy.active = 0
+    assert pool.select(set()) is busy
+
+
+def test_async_acquire_timeout() -> None:
+    endpoint = Endpoint("http://0.test", concurrency=1)
+    pool = EndpointPool([endpoint])
+    pool.claim(endpoint)
+    endpoint.available_at = time.monotonic() + 0.05
+
+    async def wait() -> Endpoint:
+        async with pool.async_acquire(set()) as acquired:
+            return acquired
+
+    async def main() -> None:
+        task = asyncio.create_task(wait())
+        await asyncio.sleep(0.2)
+        # the wait timed out at the end of the cooldown, then started again
+        assert not task.done() and len(pool.waiters) == 1
+        pool.release(endpoint)
+        assert await task is endpoint
+
+    asyncio.run(main())
+    assert endpoint.active == 0 and pool.waiters == []
+
+
+def test_rate_limiter(servers, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path)
+    sleeps: List[float] = list()
+    monkeypatch.setattr(rate_limiter, "sleep", sleeps.append)
+    rate_limiter.clear()
+
+    server = servers()
+    server.statuses = [429, 504]
+    server.status_page = (
+        "Rate limit: 2\n"
+        "Slot available after: 2024-05-01T10:00:09Z, in 9 seconds.\n"
+        "Slot available after: 2024-05-01T10:00:03Z, in 3 seconds.\n"
+    )
+    json_ = json_request(server.url, data="node(1);out;")
+    assert json_["elements"][0]["id"] == server.server_port
+    assert server.requests == 3
+
+    # the first free slot, then a backoff with jitter
+    assert sleeps[0] == 3
+    assert 0 <= sleeps[1] <= 2 * rate_limiter.base_delay
+    assert rate_limiter.info() == RateLimitInfo(2, 0, 3, sleeps[1])
+
+    # the budget of retries is enforced
+    monkeypatch.setattr(rate_limiter, "max_retries", 2)
+    server.status = 504
+    with pytest.raises(httpx.HTTPStatusError):
+        json_request(server.url, data="node(2);out;")
+    assert server.requests == 6
+    assert rate_limiter.info().gave_up == 1
+
+    # so is the deadline
+    monkeypatch.setattr(rate_limiter, "deadline", 0)
+    with pytest.raises(httpx.HTTPStatusError):
+        json_request(server.url, data="node(3);out;")
+    assert server.requests == 7
+
+
+def test_request_many(servers, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path)
+    server = servers(delay=0.2)
+    server.status_page = "Rate limit: 3\n3 slots available now.\n"
+    monkeypatch.setattr(Overpass, "endpoint", server.url)
+
+    queries = [f"node({i});out;" for i in range(9)]
+    json_request(server.url, data=queries[4])  # already cached
+    assert server.requests == 1
+
+    results = Overpass.request_many(queries + queries[:2])
+    assert [elt.data.name.iloc[0] for elt in results] == queries + queries[:2]
+    # cached and duplicate queries are not sent, slots are respected
+    assert server.requests == 9
+    assert server.max_active == 3
+
+    # also from a running event loop, e.g. in Jupyter
+    async def main() -> List[Overpass]:
+        return Overpass.request_many(queries[::-1])
+
+    results = asyncio.run(main())
+    assert [elt.data.name.iloc[0] for elt in results] == queries[::-1]
+    assert server.requests == 9
+
+
+def test_stream_cache(servers, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path)
+    server = servers()
+    monkeypatch.setattr(Overpass, "endpoint", server.url)
+
+    query = "[out:json];node(1);out;"
+    for _ in range(2):
+        overpass = Overpass.request(query, stream=True)
+        assert overpass.data.name.item() == query
+    assert server.requests == 1
+    # the response is cached, and no temporary file is left behind
+    cache_file = json_request.cache_file(server.url, data=query)
+    assert cache_file is not None and cache_file.exists()
+    assert list(tmp_path.glob("**/.*.tmp")) == []
+
+    # a failed response is retried after a wait, not sent again at once
+    sleeps: List[float] = list()
+    monkeypatch.setattr(rate_limiter, "sleep", sleeps.append)
+    server.statuses = [504]
+    Overpass.request("[out:json];node(2);out;", stream=True)
+    assert server.requests == 3 and len(sleeps) == 1
@@ -1,3 +1,9 @@
+import gc
+import sys
+import weakref
+
+import pytest
+
 from cartes.osm import Overpass
 
 
@@ -33,3 +39,102 @@ out geom;
     assert tls.simplify(1e3, max_workers=1).data.shape[0] == 6
 
     assert tls.simplify(1e3).data.shape[0] == 6
+
+
+def test_simplify_ways():
+    airport = Overpass.request(
+        query="""[out:json][timeout:180];area[icao="EDDF"];nwr(area)[aeroway];
+        out geom;""",
+    )
+    nwr = airport.query('type_ == "way"').head(50)
+    simplified = nwr.simplify(10, max_workers=1)
+    for way, elt in zip(nwr, simplified):
+        expected = way.simplify(10, bounds=nwr.bounds).shape
+        assert elt.shape.equals_exact(expected, 1e-7)
+
+
+def test_coloring():
+    tls = Overpass.request(
+        query="""[out:json][timeout:180];
+area[name='Toulouse'][admin_level=8];
+rel(area)["boundary"="postal_code"];
+out geom;
+ """
+    )
+    colored = tls.coloring()
+    for id_ in tls.data.id_:
+        neighbours = tls[id_].neighbours
+        assert neighbours == set(tls.shared_members(id_))
+        for other in neighbours:
+            assert id_ in tls[other].neighbours
+    for u, v in colored.graph.edges:
+        assert colored[u].coloring != colored[v].coloring
+
+
+def test_members():
+    tls = Overpass.request(
+        query="""[out:json][timeout:180];
+area[name='Toulouse'][admin_level=8];
+rel(area)["boundary"="postal_code"];
+out geom;
+ """
+    )
+    id_ = tls.data.id_.iloc[0]
+    other, shared = next(iter(tls.shared_members(id_).items()))
+    members = dict((m["ref"], m["geometry"]) for m in tls.all_members[id_])
+    others = dict((m["ref"], m["geometry"]) for m in tls.all_members[other])
+    # shared members are only built once
+    assert all(members[ref] is others[ref] for ref in shared)
+
+
+def test_registry():
+    tls = Overpass.request(
+        query="""[out:json][timeout:180];
+area[name='Toulouse'][admin_level=8];
+rel(area)["boundary"="postal_code"];
+out geom;
+ """
+    )
+    id_ = tls.data.id_.iloc[0]
+    assert tls[id_] is tls[id_]
+    # elements are not shared between Overpass objects
+    other = Overpass(tls.json)
+    assert other[id_] is not tls[id_]
+    assert other[id_].json["_parent"] is other
+
+    # parsed results are freed with their Overpass object
+    reference = weakref.ref(other)
+    del other
+    gc.collect()
+    assert reference() is None
+
+
+@pytest.mark.slow
+def test_registry_memory():
+    resource = pytest.importorskip("resource")  # not on Windows
+    tls = Overpass.request(
+        query="""[out:json][timeout:180];
+area[name='Toulouse'][admin_level=8];
+rel(area)["boundary"="postal_code"];
+out geom;
+ """
+    )
+    id_ = tls.data.id_.iloc[0]
+
+    def cycle() -> weakref.ref:
+        overpass = Overpass(tls.json)
+        assert overpass[id_].shape is not None
+        return weakref.ref(overpass)
+
+    references = [cycle() for _ in range(20)]
+    gc.collect()
+    # peak resident memory, in bytes on macOS, in kB elsewhere
+    unit = 1 if sys.platform == "darwin" else 1 << 10
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    references.extend(cycle() for _ in range(1000))
+    gc.collect()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+
+    # each cycle used to leak its parsed frame (about 400 kB)
+    assert all(reference() is None for reference in references)
+    assert after - before < 50 << 20
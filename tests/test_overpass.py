@@ -1,6 +1,13 @@
+import os
+import re
+import time
+from typing import Any, Dict, List
+
 import pytest
 
-from cartes.osm.overpass import Overpass
+from cartes.osm.overpass import LazyJSON, Overpass
+from cartes.osm.overpass.parquet import parquet_file, read_parquet
+from cartes.osm.requests import json_request
 
 
 def test_basic_query() -> None:
@@ -140,3 +147,461 @@ def test_issue_22() -> None:
         rel=dict(boundary="administrative", admin_level=dict(regex="[6-7]")),
     )
     assert sh_area[27014].shape is not None
+
+
+def test_parse_duplicates() -> None:
+    node = dict(type="node", id=1, lat=43.6, lon=1.4, tags=dict(name="a"))
+    way = dict(
+        type="way",
+        id=1,
+        nodes=[1, 2],
+        geometry=[dict(lat=43.6, lon=1.4), dict(lat=43.7, lon=1.5)],
+        tags=dict(name="b"),
+    )
+    overpass = Overpass(dict(elements=[node, way, node, way]))
+    data = overpass.data
+    assert data.shape[0] == 2
+    assert list(data.type_) == ["node", "way"]
+    assert data.geometry.iloc[1].geom_type == "LineString"
+
+
+def test_parse_closed_ways() -> None:
+    square = [(1.4, 43.6), (1.5, 43.6), (1.5, 43.7), (1.4, 43.6)]
+    geometry = [dict(lon=lon, lat=lat) for lon, lat in square]
+    ways = [
+        # closedness comes from the geometry, even without nodes
+        dict(type="way", id=1, geometry=geometry, tags=dict(name="a")),
+        dict(type="way", id=2, geometry=geometry[:3], tags=dict(name="b")),
+        # a degenerate closed way is no ring
+        dict(
+            type="way",
+            id=3,
+            geometry=geometry[:2] + geometry[:1],
+            tags=dict(name="c"),
+        ),
+    ]
+    data = Overpass(dict(elements=ways)).data
+    assert list(data.geometry.geom_type) == [
+        "Polygon",
+        "LineString",
+        "LineString",
+    ]
+
+
+def test_output_modes() -> None:
+    for mode in ["center", "tags", "ids", "skel qt"]:
+        query = Overpass.build_query(
+            area=dict(icao="LFBO"), aeroway=True, geometry=mode
+        )
+        assert query.endswith(f"nwr(area)[aeroway];out {mode};")
+    with pytest.raises(ValueError):
+        Overpass.build_query(aeroway=True, geometry="bb")
+
+    tags = dict(aeroway="apron")
+    center = Overpass(
+        dict(
+            elements=[
+                dict(type="node", id=1, lat=43.6, lon=1.4, tags=tags),
+                dict(
+                    type="way",
+                    id=2,
+                    center=dict(lat=43.7, lon=1.5),
+                    nodes=[3, 4, 5, 3],
+                    tags=tags,
+                ),
+                dict(
+                    type="relation",
+                    id=6,
+                    center=dict(lat=43.8, lon=1.6),
+                    members=[dict(type="way", ref=2, role="outer")],
+                    tags=dict(type="multipolygon", **tags),
+                ),
+            ]
+        )
+    )
+    data = center.data
+    assert list(data.latitude) == [43.6, 43.7, 43.8]
+    assert list(data.longitude) == [1.4, 1.5, 1.6]
+    assert list(data.geometry.x.fillna(0)) == [0, 1.5, 1.6]
+    assert center.query('type_ == "way"').data.id_.item() == 2
+
+    # out tags: no location, but the geometry column is kept
+    tagged = Overpass(dict(elements=[dict(type="way", id=2, tags=tags)]))
+    assert tagged.data.geometry.isna().all()
+    assert len(tagged.query('aeroway == "apron"').data) == 1
+    assert len(tagged.head(1).data) == 1
+
+    # out ids, skel: untagged elements are kept
+    elements = [dict(type="node", id=1), dict(type="way", id=2)]
+    assert len(Overpass(dict(elements=elements)).data) == 0
+    ids = Overpass(dict(elements=elements))
+    ids.query_string = "[out:json];way(2);out ids;"
+    assert list(ids.data.id_) == [1, 2]
+    assert len(ids.query("id_ > 1").data) == 1
+    skel = Overpass(
+        dict(
+            elements=[
+                dict(type="node", id=3, lat=43.6, lon=1.4),
+                dict(type="way", id=2, nodes=[3, 4]),
+            ]
+        )
+    )
+    skel.query_string = "[out:json];way(2);(._;>;);out skel qt;"
+    assert list(skel.data.latitude.fillna(0)) == [43.6, 0]
+
+
+def test_stream() -> None:
+    query_lfbo = "[out:json];area[icao=LFBO];nwr(area)[aeroway];out geom;"
+    lfbo = Overpass.request(query=query_lfbo)
+    lfbo_stream = Overpass.request(query=query_lfbo, stream=True)
+    assert lfbo_stream.data.shape == lfbo.data.shape
+    assert lfbo_stream.bounds == lfbo.bounds
+    assert all(
+        elt["type"] == "relation" for elt in lfbo_stream.json["elements"]
+    )
+    assert "osm3s" in lfbo_stream.json
+
+
+def test_data_cache() -> None:
+    lfbo = Overpass.request(area=dict(icao="LFBO"), aeroway=True)
+    assert lfbo.data is lfbo.data
+    lfbo.data = lfbo.data.query('aeroway == "runway"')
+    assert set(lfbo.data.aeroway) == {"runway"}
+
+
+def test_get_many() -> None:
+    lfbo = Overpass.request(area=dict(icao="LFBO"), aeroway=True)
+    runways = lfbo.data.query('aeroway == "runway"')
+    subset = lfbo.get_many(runways.id_)
+    assert list(subset.data.id_) == list(runways.id_)
+    assert lfbo[runways.id_.iloc[0]].aeroway == "runway"
+    assert lfbo["way", runways.id_.iloc[0]].aeroway == "runway"
+    with pytest.raises(AttributeError):
+        lfbo["node", runways.id_.iloc[0]]
+
+
+def test_iter() -> None:
+    lfbo = Overpass.request(area=dict(icao="LFBO"), aeroway=True)
+    elements = list(lfbo)
+    assert len(elements) == lfbo.data.shape[0]
+    assert all(elt.shape is not None for elt in elements)
+    runway = next(elt for elt in elements if elt.json.get("ref") == "14L/32R")
+    assert runway.aeroway == "runway"
+    assert not hasattr(runway, "icao")
+
+
+def test_transformer_cache() -> None:
+    from cartes.utils.projections import transformer_cache
+
+    transformer_cache.clear()
+    lfbo = Overpass.request(area=dict(icao="LFBO"), aeroway=True)
+    hits, misses, *_ = transformer_cache.info()
+    area = lfbo.area()
+    length = lfbo.length()
+    assert (area.query('aeroway == "apron"').data["area"] > 0).all()
+    runways = length.query('aeroway == "runway"').data
+    assert runways["length"].max() == pytest.approx(3500, rel=1e-2)
+    # both methods share the projection fitted to the bounds of lfbo
+    info = transformer_cache.info()
+    assert (info.hits - hits, info.misses - misses) == (1, 1)
+
+
+def test_transformer_cache_threads() -> None:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from cartes.utils.projections import transformer_cache
+
+    bounds = (1.3, 43.5, 1.5, 43.7)
+    projection = transformer_cache.equal_area(bounds)
+    assert transformer_cache.equal_area(bounds) is projection
+    # each thread has its own transformers
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        other = executor.submit(transformer_cache.equal_area, bounds).result()
+    assert other.forward is not projection.forward
+
+
+def test_geodesic() -> None:
+    lfbo = Overpass.request(area=dict(icao="LFBO"), aeroway=True)
+    projected = lfbo.area().length().data
+    geodesic = lfbo.area(method="geodesic").length(method="geodesic").data
+    # both methods agree at the scale of an airport
+    assert geodesic["area"].to_numpy() == pytest.approx(
+        projected["area"].to_numpy(), rel=1e-2, abs=1, nan_ok=True
+    )
+    assert geodesic["length"].to_numpy() == pytest.approx(
+        projected["length"].to_numpy(), rel=1e-2, abs=1, nan_ok=True
+    )
+    apron = next(iter(lfbo.query('aeroway == "apron"')))
+    assert apron.geodesic_area == pytest.approx(apron.area, rel=1e-2)
+    with pytest.raises(ValueError):
+        lfbo.area(method="planar")  # type: ignore[arg-type]
+
+
+def test_parquet_cache(monkeypatch) -> None:
+    pytest.importorskip("pyarrow")
+
+    query = "[out:json];area[icao=LFBO];nwr(area)[aeroway];out geom;"
+    cache_file = json_request.cache_file(url=Overpass.endpoint, data=query)
+    assert cache_file is not None
+    parquet_file(cache_file).unlink(missing_ok=True)
+    lfbo = Overpass.request(query=query)
+    # the data frame is only written once parsed
+    assert not parquet_file(cache_file).exists()
+    assert lfbo.data.shape[0] > 0
+    assert parquet_file(cache_file).exists()
+
+    # hits on the parsed cache count as accesses to both files
+    for path in [cache_file, parquet_file(cache_file)]:
+        os.utime(path, (0, path.stat().st_mtime))
+    cached = Overpass.request(query=query)
+    for path in [cache_file, parquet_file(cache_file)]:
+        assert path.stat().st_atime > time.time() - 60
+    assert isinstance(cached.json, LazyJSON) and not cached.json.loaded
+    assert "osm3s" in cached.json
+    assert cached.data.shape == lfbo.data.shape
+    assert list(cached.data.id_) == list(lfbo.data.id_)
+    assert len(list(cached)) == cached.data.shape[0]
+
+    # another parser version invalidates the cache
+    monkeypatch.setattr(Overpass, "parser_version", -1)
+    assert not isinstance(Overpass.request(query=query).json, LazyJSON)
+
+    # failures to parse results never escape from the parsed cache
+    def parse(self):
+        raise NotImplementedError
+
+    monkeypatch.setattr(Overpass, "parse", parse)
+    monkeypatch.setattr(Overpass, "parser_version", -2)
+    overpass = Overpass.request(query=query)
+    Overpass.write_parsed(query, overpass)
+    assert read_parquet(cache_file, Overpass.parser_stamp()) is None
+
+
+def test_split(servers, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path)
+    server = servers()
+    monkeypatch.setattr(Overpass, "endpoint", server.url)
+
+    def response(query: str) -> Dict[str, Any]:
+        bbox = re.search(r"\[bbox:([^\]]+)\]", query).group(1)  # type: ignore
+        south, west, north, east = map(float, bbox.split(","))
+        if east - west > 0.5:
+            return {"remark": "runtime error: Query timed out", "elements": []}
+        lat, lon = (south + north) / 2, (west + east) / 2
+        id_ = int(lon * 100 + lat * 10)
+        node = dict(type="node", id=id_, lat=lat, lon=lon, tags=dict(a=1))
+        # a node returned for all tiles
+        shared = dict(type="node", id=1, lat=0.3, lon=0.3, tags=dict(a=1))
+        return {"elements": [node, shared]}
+
+    server.response = response
+    query = "[out:json][bbox:0,0,1,2];node;out;"
+    with pytest.raises(ValueError):
+        Overpass.request(query.replace("[bbox:0,0,1,2]", ""), split=(2, 1))
+
+    # tiles timing out are split again
+    overpass = Overpass.request(query, split=(2, 1))
+    assert server.requests == 2 + 8
+    assert len(overpass.data) == 9
+    assert sorted(overpass.data.id_)[:3] == [1, 27, 32]
+    assert len(overpass.json["elements"]) == 9
+
+    # tiles are the cells of a global grid, shared with other queries
+    overpass = Overpass.request(
+        query.replace("0,0,1,2", "0,0,1,1"), split="auto", tile_size=0.5
+    )
+    assert server.requests == 10
+    assert sorted(overpass.data.id_) == [1, 27, 32, 77, 82]
+
+    # cells on the edges are clipped to the bounding box
+    monkeypatch.setattr(Overpass, "tile_size", 0.5)
+    overpass = Overpass.request(
+        query.replace("0,0,1,2", "0.2,0.2,0.7,0.9"), split="auto"
+    )
+    assert server.requests == 14
+    assert sorted(overpass.data.id_) == [1, 38, 41, 73, 76]
+
+
+def test_subsumption(servers, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path)
+    server = servers()
+    monkeypatch.setattr(Overpass, "endpoint", server.url)
+
+    def response(query: str) -> Dict[str, Any]:
+        bbox = re.search(r"\[bbox:([^\]]+)\]", query).group(1)  # type: ignore
+        south, west, north, east = map(float, bbox.split(","))
+        elements = [
+            dict(type="node", id=i, lat=x, lon=x, tags=dict(aeroway="gate"))
+            for i, x in enumerate([0.1, 0.5, 0.9])
+            if south <= x <= north and west <= x <= east
+        ]
+        return {"elements": elements}
+
+    server.response = response
+    overpass = Overpass.request(bounds=(0, 0, 1, 1), aeroway=True)
+    assert len(overpass.data) == 3 and server.requests == 1
+
+    # the same filters on contained bounds are answered from the cache
+    overpass = Overpass.request(bounds=(0.2, 0.2, 0.8, 0.8), aeroway=True)
+    assert overpass.data.id_.tolist() == [1]
+    assert server.requests == 1
+
+    # not with other filters, nor on larger bounds
+    Overpass.request(bounds=(0.2, 0.2, 0.8, 0.8), aeroway="gate")
+    Overpass.request(bounds=(0.2, 0.2, 1.8, 0.8), aeroway=True)
+    assert server.requests == 3
+
+    # evicted responses are no longer used
+    for path in tmp_path.glob("*/*.json"):
+        path.unlink()
+    json_request.cache_clear()
+    Overpass.request(bounds=(0.3, 0.3, 0.7, 0.7), aeroway=True)
+    assert server.requests == 4
+
+    # partial results (error remark) do not answer contained queries
+    server.response = lambda query: {
+        **response(query),
+        "remark": "runtime error: Query timed out",
+    }
+    Overpass.request(bounds=(0, 0, 2, 2), aeroway="gate")
+    Overpass.request(bounds=(0.1, 0.1, 0.6, 0.6), aeroway="gate")
+    assert server.requests == 6
+
+
+def test_refresh(servers, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path)
+    server = servers()
+    monkeypatch.setattr(Overpass, "endpoint", server.url)
+
+    def square(size: float) -> List[Dict[str, float]]:
+        corners = [(0, 0), (0, size), (size, size), (size, 0), (0, 0)]
+        return [dict(lon=lon, lat=lat) for lon, lat in corners]
+
+    apron = dict(type="multipolygon", aeroway="apron")
+    response = {
+        "osm3s": {"timestamp_osm_base": "2024-05-01T10:00:00Z"},
+        "elements": [
+            dict(type="node", id=1, lat=0, lon=0, tags=dict(aeroway="gate")),
+            dict(type="node", id=2, lat=1, lon=1, tags=dict(aeroway="gate")),
+            dict(type="node", id=3, lat=2, lon=2, tags=dict(aeroway="gate")),
+            dict(
+                type="way",
+                id=10,
+                nodes=[5, 6, 7, 8, 5],
+                geometry=square(1),
+                tags=dict(aeroway="taxiway"),
+            ),
+            dict(
+                type="relation",
+                id=20,
+                members=[
+                    dict(type="way", ref=10, role="outer", geometry=square(1))
+                ],
+                tags=apron,
+            ),
+        ],
+    }
+    # node 1 renamed, node 2 deleted, node 4 created, way 10 enlarged
+    adiff = b"""<osm version="0.6">
+    <meta osm_base="2024-05-02T10:00:00Z"/>
+    <action type="modify">
+      <old><node id="1" lat="0" lon="0"><tag k="aeroway" v="gate"/></node></old>
+      <new><node id="1" lat="0" lon="0">
+        <tag k="aeroway" v="gate"/><tag k="ref" v="A1"/>
+      </node></new>
+    </action>
+    <action type="delete">
+      <old><node id="2" lat="1" lon="1"><tag k="aeroway" v="gate"/></node></old>
+      <new><node id="2" visible="false"/></new>
+    </action>
+    <action type="create">
+      <node id="4" lat="3" lon="3"><tag k="aeroway" v="gate"/></node>
+    </action>
+    <action type="modify">
+      <old><way id="10"/></old>
+      <new><way id="10">
+        <nd ref="5" lat="0" lon="0"/><nd ref="6" lat="2" lon="0"/>
+        <nd ref="7" lat="2" lon="2"/><nd ref="8" lat="0" lon="2"/>
+        <nd ref="5" lat="0" lon="0"/><tag k="aeroway" v="taxiway"/>
+      </way></new>
+    </action>
+    </osm>"""
+    queries: List[str] = list()
+
+    def respond(query: str) -> Any:
+        queries.append(query)
+        return adiff if "adiff" in query else response
+
+    server.response = respond
+    query = "[out:json][timeout:25];nwr[aeroway];out geom;"
+    overpass = Overpass.request(query)
+    assert overpass.data.query("id_ == 20").geometry.area.item() == 1
+
+    refreshed = overpass.refresh()
+    assert queries[-1].startswith('[out:xml][adiff:"2024-05-01T10:00:00Z"]')
+    data = refreshed.data.set_index("id_")
+    assert sorted(data.index) == [1, 3, 4, 10, 20]
+    assert data.loc[1, "ref"] == "A1"
+    # the relation is assembled again with the new geometry of its member
+    assert data.loc[20, "geometry"].area == 4
+
+    # the cache entry is updated
+    overpass = Overpass.request(query)
+    assert sorted(overpass.data.id_) == [1, 3, 4, 10, 20]
+    overpass.refresh()
+    assert queries[-1].startswith('[out:xml][adiff:"2024-05-02T10:00:00Z"]')
+    assert server.requests == 3
+
+
+def test_request_batch(servers, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(json_request, "cache_dir", tmp_path)
+    server = servers()
+    monkeypatch.setattr(Overpass, "endpoint", server.url)
+
+    def response(query: str) -> Dict[str, Any]:
+        # a marker, then a node per query, named after the filter
+        elements: List[Dict[str, Any]] = list()
+        for i, body in enumerate(query.split("make batch ")[1:]):
+            name = re.search(r"aeroway=(\w+)", body).group(1)  # type: ignore
+            if name == "hold":  # an interrupted program
+                break
+            tags = dict(index=str(i))
+            elements.append(dict(type="batch", id=i + 1, tags=tags))
+            if name == "gate":  # no results
+                continue
+            node = dict(type="node", id=i, lat=0, lon=0, tags=dict(name=name))
+            elements.append(node)
+        return {"elements": elements}
+
+    server.response = response
+    layers = ["runway", "taxiway", "apron"]
+    queries = [dict(area=dict(icao="LFBO"), aeroway=elt) for elt in layers]
+    results = Overpass.request_batch(queries)
+    assert [elt.data.name.item() for elt in results] == layers
+    assert server.requests == 1
+
+    # each part is cached, as if requested alone
+    overpass = Overpass.request(area=dict(icao="LFBO"), aeroway="taxiway")
+    assert overpass.data.name.item() == "taxiway"
+    layers.append("hangar")
+    queries.append(dict(area=dict(icao="LFBO"), aeroway="hangar"))
+    results = Overpass.request_batch(queries)
+    assert [elt.data.name.item() for elt in results] == layers
+    assert server.requests == 2
+
+    # queries with no results are cached as well, unlike the ones not run
+    queries = [
+        dict(area=dict(icao="LFBO"), aeroway=elt)
+        for elt in ["runway", "gate", "hold"]
+    ]
+    for _ in range(2):
+        results = Overpass.request_batch(queries)
+        assert [len(elt.json["elements"]) for elt in results] == [1, 0, 0]
+    assert server.requests == 4
+    assert json_request.cached(
+        Overpass.endpoint, data=results[1].query_string
+    ) == dict(elements=[])
+    assert results[2].query_string is None
+
+    with pytest.raises(ValueError):
+        Overpass.request_batch([dict(aeroway="gate"), dict(out="xml")])